@@ -0,0 +1,145 @@
+# 応答本文と保存データの圧縮
+#
+# Python 版の各ハンドラ（process / ジョブ関数 / agentcore_invoke）で共通。関数ごとに個別にパッケージされるため、
+# 同じ内容のファイルを各 src に置いている（変更時はすべてのコピーを揃えること）。
+#
+#   @metrics.instrument("jobs")
+#   @compression.negotiated               … 応答本文を Accept-Encoding に合わせて br / gzip で圧縮する
+#   def handler(event, context): …
+#   compression.request_body(event)       … base64 / Content-Encoding 付きの要求本文を文字列に戻す
+#   compression.pack(raw) / unpack(data, encoding) … ジョブストアに置く大きなデータ（gzip）
+#
+# 圧縮した応答は base64 にして isBase64Encoded を付けて返す。API Gateway（REST）ではバイナリメディアタイプに
+# */* を設定しないとバイナリに戻されず base64 の文字列のまま届くため、応答の圧縮は RESPONSE_COMPRESSION=1 で有効にする。
+# （*/* を設定すると要求本文も base64 で届くので、本文は request_body() で読む）
+# brotli が入っていなければ br は使わず gzip だけを返す。
+
+import base64
+import functools
+import gzip
+import os
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import metrics
+
+try:
+    import brotli  # type: ignore
+except ImportError:  # pragma: no cover - brotli は任意
+    brotli = None
+
+RESPONSE_COMPRESSION = os.getenv("RESPONSE_COMPRESSION", "0") == "1"
+STORE_COMPRESSION = os.getenv("STORE_COMPRESSION", "1") == "1"
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))  # これより小さい本文は圧縮しない
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "5"))
+
+# 同じ q 値なら前にあるものを選ぶ
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def negotiate(accept_encoding: Optional[str]) -> Optional[str]:
+    """Accept-Encoding から使う圧縮形式を選ぶ（br / gzip、使えるものが無ければ None）"""
+    if not accept_encoding:
+        return None
+    weights: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        token, _, params = part.strip().partition(";")
+        token = token.strip().lower()
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if token:
+            weights[token] = q
+    best, best_q = None, 0.0
+    for encoding in ENCODINGS:
+        q = weights.get(encoding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compress(raw: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(raw, quality=BROTLI_QUALITY)
+    if encoding == "gzip":
+        return gzip.compress(raw, compresslevel=GZIP_LEVEL, mtime=0)
+    raise ValueError(f"unsupported encoding: {encoding}")
+
+
+def decompress(data: bytes, encoding: Optional[str]) -> bytes:
+    if not encoding or encoding == "identity":
+        return data
+    if encoding == "gzip":
+        return gzip.decompress(data)
+    if encoding == "br":
+        if brotli is None:
+            raise ValueError("brotli is not installed")
+        return brotli.decompress(data)
+    raise ValueError(f"unsupported encoding: {encoding}")
+
+
+def _header(event: Any, name: str) -> Optional[str]:
+    headers = event.get("headers") if isinstance(event, dict) else None
+    if not isinstance(headers, dict):
+        return None
+    for k, v in headers.items():
+        if isinstance(k, str) and k.lower() == name:
+            return v
+    return None
+
+
+def encode_response(resp: Any, event: Any) -> Any:
+    """API Gateway 形式の応答の本文を、要求の Accept-Encoding に合わせて圧縮する"""
+    if not RESPONSE_COMPRESSION or not isinstance(resp, dict) or resp.get("isBase64Encoded"):
+        return resp
+    body = resp.get("body")
+    if not isinstance(body, str) or not body:
+        return resp
+    raw = body.encode("utf-8")
+    metrics.put("ResponseRawBytes", len(raw), "Bytes")
+    headers = dict(resp.get("headers") or {})
+    # 同じ URL でも Accept-Encoding で本文が変わるので、キャッシュには分けて持たせる
+    headers["vary"] = "accept-encoding"
+    encoding = negotiate(_header(event, "accept-encoding")) if len(raw) >= COMPRESS_MIN_BYTES else None
+    data = compress(raw, encoding) if encoding else raw
+    if encoding is None or len(data) >= len(raw):
+        return dict(resp, headers=headers)
+    headers["content-encoding"] = encoding
+    metrics.set_property("ContentEncoding", encoding)
+    return dict(resp, headers=headers, body=base64.b64encode(data).decode("ascii"), isBase64Encoded=True)
+
+
+def negotiated(fn: Callable) -> Callable:
+    """Lambda ハンドラ用デコレーター。応答を encode_response() に通す（metrics.instrument の内側に付ける）"""
+    @functools.wraps(fn)
+    def wrapper(event, context, *args, **kwargs):
+        return encode_response(fn(event, context, *args, **kwargs), event)
+    return wrapper
+
+
+def request_body(event: Any) -> Optional[str]:
+    """要求本文を文字列で返す（isBase64Encoded なら base64 を、Content-Encoding があれば圧縮を戻す）"""
+    body = event.get("body") if isinstance(event, dict) else None
+    if not isinstance(body, str):
+        return None
+    if not event.get("isBase64Encoded"):
+        return body
+    data = decompress(base64.b64decode(body), (_header(event, "content-encoding") or "").strip().lower() or None)
+    return data.decode("utf-8")
+
+
+def pack(raw: bytes) -> Tuple[bytes, Optional[str]]:
+    """保存するデータを圧縮する。(保存するバイト列, Content-Encoding) を返す（圧縮しなければ None）"""
+    if not STORE_COMPRESSION or len(raw) < COMPRESS_MIN_BYTES:
+        return raw, None
+    data = gzip.compress(raw, compresslevel=GZIP_LEVEL, mtime=0)
+    return (data, "gzip") if len(data) < len(raw) else (raw, None)
+
+
+def unpack(data: bytes, encoding: Optional[str]) -> bytes:
+    return decompress(data, encoding)
@@ -5,8 +5,21 @@ import json
 import os
 import logging
 import secrets
+import threading
 import time
-from typing import Any, Dict, Tuple, Optional
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+import compression
+import metrics
+from extract_store import UPLOAD_PREFIX, ExtractStore
+from quiz_cache import QUIZ_CACHE_TTL_SEC, QuizCache, quiz_key
+from job_store import (BLOB_NAMES, INDEXES, JOB_TTL_SEC, JOBS, RESULTS, JobConflict, JobStore, config_error,
+                       create_store)
+from quiz_parser import QuestionStream, parse_quiz
+from scheduler import (JOB_SCHEDULER, JOB_QUEUE_URL, WORKER_CONCURRENCY, LambdaScheduler, LocalQueueScheduler,
+                       JOB_DEAD_LETTER_ARN, RateLimiter, RetryLater, SqsScheduler, Throttled, handle_sqs_records)
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -15,31 +28,106 @@ AWS_REGION = os.getenv("AWS_REGION", os.getenv("AWS_DEFAULT_REGION", "us-west-2"
 AGENTCORE_ARN = os.getenv("AGENTCORE_ARN", "")
 AGENTCORE_QUALIFIER = os.getenv("AGENTCORE_QUALIFIER", "")
 INVOCATION_MODE = os.getenv("INVOCATION_MODE", "sdk").lower()  # mock | sdk
+MOCK_LATENCY_SEC = float(os.getenv("MOCK_LATENCY_SEC", "0"))  # mock 時に生成時間を模擬（検証・ベンチマーク用）
 JOBS_BUCKET = os.getenv("JOBS_BUCKET", "")
 JOBS_PREFIX = os.getenv("JOBS_PREFIX", "jobs/")
-
-
-def _resp(status: int, body: Dict[str, Any]) -> Dict[str, Any]:
+BOTO_MAX_POOL_CONNECTIONS = int(os.getenv("BOTO_MAX_POOL_CONNECTIONS", "32"))
+BOTO_MAX_ATTEMPTS = int(os.getenv("BOTO_MAX_ATTEMPTS", "4"))
+BOTO_CONNECT_TIMEOUT = float(os.getenv("BOTO_CONNECT_TIMEOUT", "5"))
+BOTO_READ_TIMEOUT = float(os.getenv("BOTO_READ_TIMEOUT", "60"))
+AGENTCORE_STREAM_CHUNK = int(os.getenv("AGENTCORE_STREAM_CHUNK", "8192"))
+AGENTCORE_PROGRESS_INTERVAL = float(os.getenv("AGENTCORE_PROGRESS_INTERVAL", "1.0"))
+# RUNNING のまま更新が途絶えたら別ワーカーが引き継げる（関数のタイムアウト 300 秒以下にする）
+JOB_LEASE_SEC = int(os.getenv("JOB_LEASE_SEC", "300"))
+JOB_WRITE_RETRIES = int(os.getenv("JOB_WRITE_RETRIES", "5"))
+TERMINAL_STATUSES = ("SUCCEEDED", "FAILED")
+BATCH_MAX_JOBS = int(os.getenv("BATCH_MAX_JOBS", "50"))
+BATCH_MAX_WORKERS = int(os.getenv("BATCH_MAX_WORKERS", "16"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+TENANT_MAX_WAIT_SEC = float(os.getenv("TENANT_MAX_WAIT_SEC", "30"))
+LONG_POLL_MAX_SEC = float(os.getenv("LONG_POLL_MAX_SEC", "25"))  # API Gateway の 29 秒制限より短く
+LONG_POLL_MIN_INTERVAL = float(os.getenv("LONG_POLL_MIN_INTERVAL", "0.25"))
+LONG_POLL_MAX_INTERVAL = float(os.getenv("LONG_POLL_MAX_INTERVAL", "2.0"))
+QUIZ_RESULTS_PREFIX = os.getenv("QUIZ_RESULTS_PREFIX", "results/")
+QUIZ_FLIGHT_WAIT_SEC = float(os.getenv("QUIZ_FLIGHT_WAIT_SEC", str(JOB_LEASE_SEC)))  # 他コンテナの生成完了を待つ上限
+WORKER_TIME_MARGIN_SEC = float(os.getenv("WORKER_TIME_MARGIN_SEC", "10"))  # 関数のタイムアウト前に残す時間（状態の書き込み用）
+
+# boto3 クライアントはウォームコンテナ間で使い回す（セッション/エンドポイント解決/HTTP プールの再構築を避ける）
+_CLIENTS: Dict[str, Any] = {}
+_CLIENTS_LOCK = threading.Lock()
+
+# ワーカーのスケジューラとテナント別レート制限（ウォームコンテナ内で共有）
+_SCHEDULER: Any = None
+_SCHEDULER_LOCK = threading.Lock()
+_RATE_LIMITER = RateLimiter()
+_WORKER_SLOTS = threading.BoundedSemaphore(WORKER_CONCURRENCY)
+_QUIZ_CACHE = QuizCache()
+
+# ジョブストア（JOB_STORE で s3 / dynamodb / sqlite を選ぶ。ウォームコンテナ内で共有）
+_STORE: Optional[JobStore] = None
+_STORE_LOCK = threading.Lock()
+
+# 先行抽出の結果（process 関数が S3 イベントで uploads/ の教材を抽出したもの。EXTRACT_STORE_BUCKET で有効）
+_EXTRACTS: Optional[ExtractStore] = None
+
+
+def _client(service: str):
+    c = _CLIENTS.get(service)
+    if c is not None:
+        return c
+    with _CLIENTS_LOCK:
+        c = _CLIENTS.get(service)
+        if c is None:
+            import boto3
+            from botocore.config import Config
+            cfg = Config(
+                region_name=AWS_REGION,
+                max_pool_connections=BOTO_MAX_POOL_CONNECTIONS,
+                tcp_keepalive=True,
+                connect_timeout=BOTO_CONNECT_TIMEOUT,
+                read_timeout=BOTO_READ_TIMEOUT,
+                retries={"max_attempts": BOTO_MAX_ATTEMPTS, "mode": "adaptive"},
+            )
+            c = boto3.client(service, config=cfg)
+            _CLIENTS[service] = c
+    return c
+
+
+def _resp(status: int, body: Optional[Dict[str, Any]], headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    h = {
+        "access-control-allow-origin": "*",
+        "access-control-allow-methods": "GET,POST,OPTIONS",
+        "access-control-allow-headers": "content-type,content-encoding,if-none-match",
+        "access-control-expose-headers": "etag",
+        "content-type": "application/json",
+    }
+    if headers:
+        h.update(headers)
     return {
         "statusCode": status,
-        "headers": {
-            "access-control-allow-origin": "*",
-            "access-control-allow-methods": "GET,POST,OPTIONS",
-            "access-control-allow-headers": "content-type",
-            "content-type": "application/json",
-        },
-        "body": json.dumps(body, ensure_ascii=False),
+        "headers": h,
+        "body": json.dumps(body, ensure_ascii=False) if body is not None else "",
     }
 
 
+def _header(event: Dict[str, Any], name: str) -> Optional[str]:
+    headers = event.get("headers") if isinstance(event, dict) else None
+    if not isinstance(headers, dict):
+        return None
+    name = name.lower()
+    for k, v in headers.items():
+        if isinstance(k, str) and k.lower() == name:
+            return v
+    return None
+
+
 def _parse_body(event: Dict[str, Any]) -> Tuple[Dict[str, Any], str]:
-    body_raw = event.get("body") if isinstance(event, dict) else None
-    if body_raw and isinstance(body_raw, str):
-        try:
-            body = json.loads(body_raw)
-            return body, "json"
-        except Exception:
-            pass
+    try:
+        body_raw = compression.request_body(event)
+        if body_raw:
+            return json.loads(body_raw), "json"
+    except Exception:
+        pass
     return {}, "unknown"
 
 
@@ -60,37 +148,290 @@ def _new_session_id(prefix: str = "sess") -> str:
     return f"{prefix}-{ts36}-{rand}"
 
 
-def _job_key(job_id: str) -> str:
-    p = JOBS_PREFIX or "jobs/"
-    if not p.endswith('/'):
-        p += '/'
-    return f"{p}{job_id}.json"
+def _now_ms() -> int:
+    return int(time.time()*1000)
 
 
-def _s3_put_json(bucket: str, key: str, data: Dict[str, Any]):
-    import boto3
-    s3 = boto3.client('s3', region_name=AWS_REGION)
-    s3.put_object(Bucket=bucket, Key=key, Body=json.dumps(data, ensure_ascii=False).encode('utf-8'), ContentType='application/json')
+def _store() -> JobStore:
+    global _STORE
+    if _STORE is None:
+        with _STORE_LOCK:
+            if _STORE is None:
+                prefixes = {JOBS: JOBS_PREFIX or "jobs/", RESULTS: QUIZ_RESULTS_PREFIX or "results/"}
+                _STORE = create_store(_client, JOBS_BUCKET, prefixes)
+    return _STORE
 
 
-def _s3_get_json(bucket: str, key: str) -> Optional[Dict[str, Any]]:
-    import boto3
-    s3 = boto3.client('s3', region_name=AWS_REGION)
-    try:
-        r = s3.get_object(Bucket=bucket, Key=key)
-        b = r.get('Body')
-        if hasattr(b, 'read'):
-            raw = b.read()
-            return json.loads(raw)
-    except Exception:
-        return None
-    return None
+def _extracts() -> ExtractStore:
+    global _EXTRACTS
+    if _EXTRACTS is None:
+        with _STORE_LOCK:
+            if _EXTRACTS is None:
+                _EXTRACTS = ExtractStore(s3_client=_client("s3"))
+    return _EXTRACTS
 
 
-def invoke_agentcore_via_sdk(payload: Dict[str, Any], session_id: Optional[str] = None) -> Dict[str, Any]:
-    import boto3
+def _with_extraction(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """先行抽出済み（抽出中なら完了を待つ）の教材は、抽出テキストを extracted_text として AgentCore に渡す
 
-    client = boto3.client('bedrock-agentcore', region_name=AWS_REGION)
+    AgentCore 側はこれがあれば S3 からの取得と抽出を省ける（無い・待ちきれない場合は従来どおり s3_uri だけ）。
+    """
+    uri = payload.get("s3_uri")
+    if not isinstance(uri, str) or not uri.startswith("s3://") or payload.get("extracted_text"):
+        return payload
+    bucket, _, key = uri[len("s3://"):].partition("/")
+    if not key.startswith(UPLOAD_PREFIX) or not _extracts().enabled:
+        return payload
+    try:
+        etag = _client("s3").head_object(Bucket=bucket, Key=key).get("ETag")
+        with metrics.timer("EagerWaitMs"):
+            record, status = _extracts().wait(bucket, key, etag)
+    except Exception as e:
+        logger.warning("extract store lookup failed for %s: %s", uri, e)
+        return payload
+    metrics.set_property("Eager", status)
+    if record is None:
+        return payload
+    return dict(payload, extracted_text=record["text"])
+
+
+class _JobNotifier:
+    """ジョブ更新の通知チャネル（プロセス内）。
+
+    同じプロセスのワーカーが書き込むと、待機中のロングポーリング GET を即座に起こす。
+    別プロセス（Lambda の別コンテナ）からの更新は、待機側がジョブストアの条件付き GET で拾う。
+    """
+
+    def __init__(self, max_jobs: int = 10000):
+        self._cond = threading.Condition()
+        self._generations: "OrderedDict[str, int]" = OrderedDict()
+        self._max_jobs = max_jobs
+
+    def generation(self, job_id: str) -> int:
+        with self._cond:
+            return self._generations.get(job_id, 0)
+
+    def publish(self, job_id: str) -> None:
+        with self._cond:
+            self._generations[job_id] = self._generations.pop(job_id, 0) + 1
+            while len(self._generations) > self._max_jobs:
+                self._generations.popitem(last=False)
+            self._cond.notify_all()
+
+    def wait(self, job_id: str, seen: int, timeout: float) -> bool:
+        with self._cond:
+            return self._cond.wait_for(lambda: self._generations.get(job_id, 0) > seen, timeout=timeout)
+
+
+_NOTIFIER = _JobNotifier()
+
+
+def _wait_for_change(job_id: str, if_none_match: str,
+                     wait_sec: float) -> Tuple[Optional[Dict[str, Any]], Optional[str], bool]:
+    """ジョブ文書が if_none_match から変わるまで最大 wait_sec 秒待つ（通知 + 指数バックオフの条件付き GET）"""
+    store = _store()
+    deadline = time.time() + wait_sec
+    delay = LONG_POLL_MIN_INTERVAL
+    seen = _NOTIFIER.generation(job_id)
+    job, etag, not_modified = store.get(JOBS, job_id, if_none_match=if_none_match)
+    while not_modified:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            break
+        if _NOTIFIER.wait(job_id, seen, timeout=min(delay, remaining)):
+            seen = _NOTIFIER.generation(job_id)
+        job, etag, not_modified = store.get(JOBS, job_id, if_none_match=if_none_match)
+        delay = min(delay * 2, LONG_POLL_MAX_INTERVAL)
+    return job, etag, not_modified
+
+
+class _JobState:
+    """1ジョブ分の状態を ETag 条件付きで更新する。
+
+    書き込みごとに version を1つ進め、workerId を所有者として記録する。
+    競合したら読み直して再適用し、他のワーカーに所有権が移っていれば以降の書き込みを止める。
+    """
+
+    def __init__(self, job_id: str, worker_id: str):
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self.lost = False
+        self._reload()
+
+    @property
+    def doc(self) -> Dict[str, Any]:
+        return self._doc or {"jobId": self.job_id, "status": "PENDING"}
+
+    def claim(self) -> bool:
+        def mutate(doc: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+            now = _now_ms()
+            if doc.get("status") in TERMINAL_STATUSES:
+                return None
+            owner = doc.get("workerId")
+            if doc.get("status") == "RUNNING" and owner and owner != self.worker_id \
+                    and now - int(doc.get("updatedAt") or 0) < JOB_LEASE_SEC * 1000:
+                return None
+            doc.update({
+                "status": "RUNNING",
+                "workerId": self.worker_id,
+                "startedAt": now,
+                "attempts": int(doc.get("attempts") or 0) + 1,
+            })
+            doc.setdefault("timings", {})["queueMs"] = now - int(doc.get("createdAt") or now)
+            return doc
+        return self._apply(mutate, owner_check=False)
+
+    def abandon(self, error: str) -> bool:
+        """再試行を使い切ったジョブを FAILED にする（所有者によらない。終了済み・他のワーカーのリース中は何もしない）"""
+        def mutate(doc: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+            now = _now_ms()
+            if doc.get("status") in TERMINAL_STATUSES or (doc.get("status") == "RUNNING" and doc.get("workerId")
+                                                           and now - int(doc.get("updatedAt") or 0) < JOB_LEASE_SEC * 1000):
+                return None
+            doc.pop("workerId", None)
+            doc.update({"status": "FAILED", "finishedAt": now, "error": error})
+            return doc
+        return self._apply(mutate, owner_check=False)
+
+    def update(self, changes: Dict[str, Any], timings: Optional[Dict[str, int]] = None, drop: Tuple[str, ...] = ()) -> bool:
+        def mutate(doc: Dict[str, Any]) -> Dict[str, Any]:
+            for k in drop:
+                doc.pop(k, None)
+            doc.update(changes)
+            if timings:
+                doc["timings"] = dict(doc.get("timings") or {}, **timings)
+            return doc
+        return self._apply(mutate)
+
+    def _reload(self) -> None:
+        self._doc, self.etag, _ = _store().get(JOBS, self.job_id)
+
+    def _apply(self, mutate: Callable[[Dict[str, Any]], Optional[Dict[str, Any]]], owner_check: bool = True) -> bool:
+        if self.lost:
+            return False
+        for _ in range(JOB_WRITE_RETRIES):
+            doc = json.loads(json.dumps(self.doc))
+            if owner_check and (doc.get("workerId") != self.worker_id or doc.get("status") in TERMINAL_STATUSES):
+                self.lost = True
+                return False
+            new = mutate(doc)
+            if new is None:
+                return False
+            new["version"] = int(new.get("version") or 0) + 1
+            new["updatedAt"] = _now_ms()
+            try:
+                if self.etag:
+                    etag = _store().put(JOBS, self.job_id, new, if_match=self.etag, previous=self._doc)
+                else:
+                    etag = _store().put(JOBS, self.job_id, new, if_none_match="*")
+            except JobConflict:
+                logger.info("job %s: conditional write conflict, reloading", self.job_id)
+                self._reload()
+                continue
+            self._doc, self.etag = new, etag
+            _NOTIFIER.publish(self.job_id)
+            return True
+        self.lost = True
+        return False
+
+
+def _iter_body_chunks(body_stream, chunk_size: int = AGENTCORE_STREAM_CHUNK) -> Iterator[bytes]:
+    if hasattr(body_stream, 'iter_chunks'):
+        yield from body_stream.iter_chunks(chunk_size)
+        return
+    while True:
+        chunk = body_stream.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+def _parse_event_line(line: bytes) -> Optional[Any]:
+    line = line.strip()
+    if not line or line.startswith(b':'):
+        return None
+    if line.startswith(b'data:'):
+        line = line[5:].strip()
+    elif line.startswith((b'event:', b'id:', b'retry:')):
+        return None
+    text = line.decode('utf-8', errors='replace')
+    if text == '[DONE]':
+        return None
+    try:
+        return json.loads(text)
+    except Exception:
+        return text
+
+
+def iter_agentcore_events(body_stream) -> Iterator[Any]:
+    """SSE / NDJSON のレスポンスをチャンク単位で読み、イベントを1件ずつ返す（全体をバッファしない）"""
+    buf = bytearray()
+    for chunk in _iter_body_chunks(body_stream):
+        buf += chunk
+        while True:
+            nl = buf.find(b'\n')
+            if nl < 0:
+                break
+            ev = _parse_event_line(bytes(buf[:nl]))
+            del buf[:nl + 1]
+            if ev is not None:
+                yield ev
+    ev = _parse_event_line(bytes(buf))
+    if ev is not None:
+        yield ev
+
+
+def _merge_event(acc: Dict[str, Any], ev: Any) -> None:
+    # 文字列はテキスト断片、{"question": ...} は1問分、{"questions": [...]} はその時点のスナップショット
+    if isinstance(ev, str):
+        acc.setdefault('_text', []).append(ev)
+        # テキストで届く JSON も、閉じた問題から順に取り出して途中結果に出す
+        acc.setdefault('_stream', QuestionStream()).feed(ev)
+    elif isinstance(ev, dict):
+        if isinstance(ev.get('questions'), list):
+            acc['questions'] = list(ev['questions'])
+        elif 'question' in ev:
+            acc.setdefault('questions', []).append(ev)
+        else:
+            acc.update(ev)
+
+
+def _finish_events(acc: Dict[str, Any]) -> Dict[str, Any]:
+    text = ''.join(acc.pop('_text', []))
+    acc.pop('_stream', None)
+    if text and 'result' not in acc:
+        acc['result'] = text
+    return _normalize_quiz(acc)
+
+
+def _partial_questions(acc: Dict[str, Any]) -> list:
+    if acc.get('questions'):
+        return list(acc['questions'])
+    stream = acc.get('_stream')
+    return list(stream.questions) if stream is not None else []
+
+
+def _normalize_quiz(data: Dict[str, Any]) -> Dict[str, Any]:
+    """問題を Question スキーマで検証・正規化する（result の文字列は途中切れを修復して取り出す）。取り出せなければそのまま"""
+    parsed = parse_quiz(data)
+    if not parsed['questions']:
+        return data
+    data['questions'] = parsed['questions']
+    data['parse'] = {"status": parsed['status'], "truncated": parsed['truncated'], "invalid": len(parsed['invalid'])}
+    if parsed['invalid']:
+        logger.warning("invalid questions dropped: %s", parsed['invalid'])
+    return data
+
+
+def _is_event_stream(content_type: str) -> bool:
+    ct = (content_type or '').lower()
+    return 'event-stream' in ct or 'ndjson' in ct or 'jsonl' in ct
+
+
+@metrics.timed("AgentCoreMs")
+def invoke_agentcore_via_sdk(payload: Dict[str, Any], session_id: Optional[str] = None,
+                             on_event: Optional[Callable[[Any, Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+    client = _client('bedrock-agentcore')
     runtime_session_id = session_id or payload.get('session_id') or _new_session_id()
 
     req = {
@@ -103,97 +444,535 @@ def invoke_agentcore_via_sdk(payload: Dict[str, Any], session_id: Optional[str]
 
     resp = client.invoke_agent_runtime(**req)
     body_stream = resp.get('response')
-    if hasattr(body_stream, 'read'):
+    if hasattr(body_stream, 'read') and _is_event_stream(resp.get('contentType', '')):
+        # ストリーミング応答: 届いたイベントから順に反映する
+        acc: Dict[str, Any] = {}
+        for ev in iter_agentcore_events(body_stream):
+            _merge_event(acc, ev)
+            if on_event is not None:
+                on_event(ev, acc)
+        data = _finish_events(acc)
+    elif hasattr(body_stream, 'read'):
         raw = body_stream.read()
         try:
             data = json.loads(raw)
         except Exception:
             data = { 'result': raw.decode('utf-8', errors='replace') if isinstance(raw, (bytes, bytearray)) else str(raw) }
+        data = _normalize_quiz(data if isinstance(data, dict) else { 'result': data })
     else:
         data = resp
     return data if isinstance(data, dict) else { 'result': data }
 
 
+def _progress_writer(state: _JobState) -> Callable[[Any, Dict[str, Any]], None]:
+    """ストリーミング中の途中結果をジョブストアへ書き出すコールバック（新しい問題が届いたら即時、それ以外は間引く）"""
+    started = state.doc.get("startedAt") or _now_ms()
+    last = {"at": 0.0, "questions": 0, "events": 0}
+
+    def on_event(ev: Any, acc: Dict[str, Any]) -> None:
+        now = time.time()
+        last["events"] += 1
+        timings = {"firstEventMs": _now_ms() - started} if last["events"] == 1 else None
+        if timings:
+            metrics.put("FirstEventMs", timings["firstEventMs"])
+        questions = _partial_questions(acc)
+        n = len(questions)
+        if not timings and n == last["questions"] and now - last["at"] < AGENTCORE_PROGRESS_INTERVAL:
+            return
+        last["at"], last["questions"] = now, n
+        if state.lost:
+            return
+        try:
+            # 途中結果は別データに書き、レコードには件数だけ載せる（ポーリングはレコードだけを読む）
+            size = _store().put_blob(state.job_id, "partial", {
+                "questions": questions,
+                "text": ''.join(acc.get('_text') or []),
+            }, state.doc.get("expiresAt"))
+            state.update({"progress": {"questions": n, "events": last["events"], "bytes": size}}, timings=timings)
+        except Exception:
+            logger.exception("progress write failed")
+
+    return on_event
+
+
+def _quiz_key_of(payload: Dict[str, Any]) -> Optional[str]:
+    """構造化 payload の生成結果キー。キャッシュ対象外（prompt 指定、cache: false）は None"""
+    if payload.get("cache") is False:
+        return None
+    s3_uri, target, difficulty = payload.get("s3_uri"), payload.get("target"), payload.get("difficulty")
+    num_questions = payload.get("num_questions")
+    if not (s3_uri and target and difficulty) or num_questions is None:
+        return None
+    return quiz_key(s3_uri, target, difficulty, num_questions, f"{INVOCATION_MODE}|{AGENTCORE_ARN}|{AGENTCORE_QUALIFIER}")
+
+
+def _flight_wait_sec(context: Any) -> float:
+    """他コンテナの生成完了を待てる秒数（Lambda では関数の残り時間から WORKER_TIME_MARGIN_SEC を引いた分まで）"""
+    if context is None or not hasattr(context, "get_remaining_time_in_millis"):
+        return QUIZ_FLIGHT_WAIT_SEC
+    remaining = context.get_remaining_time_in_millis() / 1000 - WORKER_TIME_MARGIN_SEC
+    return max(0.0, min(QUIZ_FLIGHT_WAIT_SEC, remaining))
+
+
+def _shared_result(quiz_key_: str, owner: str, compute: Callable[[], Dict[str, Any]],
+                   wait_sec: float = QUIZ_FLIGHT_WAIT_SEC) -> Tuple[Dict[str, Any], str]:
+    """ジョブストアの結果レコードでコンテナをまたいで生成を1回にまとめる。(結果, 'hit'|'miss'|'coalesced') を返す。
+
+    レコードがなければ IfNoneMatch で生成役を取り、RUNNING のレコードがあれば最大 wait_sec 秒完了を待つ。
+    生成役の更新が JOB_LEASE_SEC 途絶えたか失敗した場合は、ETag 条件付きで生成役を引き継ぐ。
+    関数の残り時間で待ちきれなかった（生成役はまだ動いている）ときは RetryLater を投げ、再配信で結果を受け取る。
+    """
+    store = _store()
+    deadline = time.time() + wait_sec
+    delay = LONG_POLL_MIN_INTERVAL
+    waited = False
+    while True:
+        rec, etag, _ = store.get(RESULTS, quiz_key_)
+        now = _now_ms()
+        if rec and rec.get("status") == "SUCCEEDED" and now - int(rec.get("createdAt") or 0) < QUIZ_CACHE_TTL_SEC * 1000:
+            return rec.get("result") or {}, "coalesced" if waited else "hit"
+        running = rec and rec.get("status") == "RUNNING" and now - int(rec.get("updatedAt") or 0) < JOB_LEASE_SEC * 1000
+        if running and time.time() < deadline:
+            waited = True
+            time.sleep(min(delay, max(0.0, deadline - time.time())))
+            delay = min(delay * 2, LONG_POLL_MAX_INTERVAL)
+            continue
+        if running and wait_sec < QUIZ_FLIGHT_WAIT_SEC:
+            lease_ms = int(rec.get("updatedAt") or 0) + JOB_LEASE_SEC * 1000 - now
+            raise RetryLater(f"result {quiz_key_} is still being generated", max(1.0, min(lease_ms / 1000, 60.0)))
+        lease = {"status": "RUNNING", "owner": owner, "updatedAt": now, "expiresAt": now + JOB_LEASE_SEC * 1000}
+        try:
+            # 期限切れ・壊れたレコードは文書なしで ETag だけ返るので、それも条件付きで上書きする
+            if etag:
+                store.put(RESULTS, quiz_key_, lease, if_match=etag)
+            else:
+                store.put(RESULTS, quiz_key_, lease, if_none_match="*")
+        except JobConflict:
+            continue
+        break
+
+    try:
+        result = compute()
+    except Exception as e:
+        try:
+            now = _now_ms()
+            store.put(RESULTS, quiz_key_, {"status": "FAILED", "owner": owner, "error": str(e), "updatedAt": now,
+                                           "expiresAt": now + JOB_LEASE_SEC * 1000})
+        except Exception:
+            logger.exception("result record write failed")
+        raise
+    now = _now_ms()
+    store.put(RESULTS, quiz_key_, {"status": "SUCCEEDED", "owner": owner, "createdAt": now, "updatedAt": now,
+                                   "expiresAt": now + QUIZ_CACHE_TTL_SEC * 1000, "result": result})
+    return result, "miss"
+
+
+_USAGE = {
+    "prompt": {"prompt": "任意の文字列"},
+    "structured": {"s3_uri": "s3://bucket/key", "target": "高校生", "difficulty": "普通", "num_questions": 5},
+    "batch": {"jobs": ["<prompt または structured の payload>", "..."]},
+}
+
+
+def _caller_of(event: Dict[str, Any]) -> Optional[str]:
+    """認証済みの呼び出し元（Cognito オーソライザーの sub）。未認証なら None"""
+    claims = ((event.get("requestContext") or {}).get("authorizer") or {}).get("claims") or {}
+    sub = claims.get("sub") if isinstance(claims, dict) else None
+    return sub if isinstance(sub, str) and sub else None
+
+
+def _tenant_of(event: Dict[str, Any], payload: Dict[str, Any]) -> str:
+    """テナント。認証済みなら sub だけを使い、クライアントが指定した tenant / x-tenant-id は無視する"""
+    caller = _caller_of(event)
+    if caller:
+        return caller
+    if isinstance(payload.get("tenant"), str) and payload["tenant"]:
+        return payload["tenant"]
+    return _header(event, "x-tenant-id") or "default"
+
+
+def _create_job(payload: Dict[str, Any], tenant: str = "default") -> str:
+    job_id = _new_session_id(prefix="job")
+    created = _now_ms()
+    job_doc = {
+        "jobId": job_id,
+        "status": "PENDING",
+        "createdAt": created,
+        "expiresAt": created + JOB_TTL_SEC * 1000,
+        "version": 1,
+        "tenant": tenant,
+        "payload": payload
+    }
+    _store().put(JOBS, job_id, job_doc, if_none_match="*")
+    return job_id
+
+
+def _scheduler():
+    global _SCHEDULER
+    if _SCHEDULER is None:
+        with _SCHEDULER_LOCK:
+            if _SCHEDULER is None:
+                function_name = os.getenv('AWS_LAMBDA_FUNCTION_NAME')
+                if JOB_SCHEDULER == "sqs":
+                    _SCHEDULER = SqsScheduler(_client, JOB_QUEUE_URL)
+                elif JOB_SCHEDULER == "local" or not function_name:
+                    # Lambda 外（ローカル検証）では SQLite キュー + スレッドで実行する
+                    _SCHEDULER = LocalQueueScheduler(_run_message, on_dead_letter=_dead_letter)
+                else:
+                    _SCHEDULER = LambdaScheduler(_client, function_name)
+    return _SCHEDULER
+
+
+def _dispatch_worker(job_id: str, tenant: str = "default") -> None:
+    _scheduler().submit({"type": "worker", "jobId": job_id, "tenant": tenant})
+
+
+def _start_jobs(payloads: list, tenant: str = "default") -> list:
+    """ジョブ文書の作成とワーカー起動をスレッドプールで並列に行う。結果は入力順"""
+    def start(p: Any) -> Dict[str, Any]:
+        ok, kind = _validate_payload(p)
+        if not ok:
+            return {"status": "REJECTED", "error": kind}
+        try:
+            job_id = _create_job(p, tenant)
+        except Exception as e:
+            logger.exception("batch job create failed")
+            return {"status": "REJECTED", "error": str(e)}
+        try:
+            _dispatch_worker(job_id, tenant)
+        except Exception as e:
+            logger.exception("batch job dispatch failed")
+            return {"jobId": job_id, "status": "PENDING", "error": f"dispatch failed: {e}"}
+        return {"jobId": job_id, "status": "PENDING"}
+
+    with ThreadPoolExecutor(max_workers=min(BATCH_MAX_WORKERS, len(payloads))) as pool:
+        return list(pool.map(start, payloads))
+
+
+def _include_of(qs: Dict[str, Any]) -> Tuple[str, ...]:
+    """GET の include=result,partial（レコードに付ける大きなデータ。省略時は result、include= で付けない）"""
+    raw = qs.get('include')
+    if raw is None:
+        return ("result",)
+    return tuple(x for x in (v.strip() for v in str(raw).split(',')) if x in BLOB_NAMES)
+
+
+def _fields_of(qs: Dict[str, Any]) -> Optional[Tuple[str, ...]]:
+    """GET の fields=status,progress,result.questions（返す項目。ドット区切りで入れ子。省略時はすべて）"""
+    raw = qs.get('fields')
+    if raw is None:
+        return None
+    return tuple(x for x in (v.strip() for v in str(raw).split(',')) if x)
+
+
+def _blobs_for(include: Tuple[str, ...], fields: Optional[Tuple[str, ...]]) -> Tuple[str, ...]:
+    """fields を指定したら、そこに含まれる大きなデータだけを読む（include より優先）"""
+    if fields is None:
+        return include
+    tops = {f.split('.', 1)[0] for f in fields}
+    return tuple(n for n in BLOB_NAMES if n in tops)
+
+
+_MISSING = object()
+
+
+def _project(doc: Dict[str, Any], fields: Optional[Tuple[str, ...]]) -> Dict[str, Any]:
+    """doc から fields の項目だけを残す（jobId と error は常に残す。無い項目は返さない）"""
+    if fields is None:
+        return doc
+    out = {k: doc[k] for k in ("jobId", "error") if k in doc}
+    for path in fields:
+        parts = path.split('.')
+        value: Any = doc
+        for part in parts:
+            value = value.get(part, _MISSING) if isinstance(value, dict) else _MISSING
+            if value is _MISSING:
+                break
+        if value is _MISSING:
+            continue
+        dst = out
+        for part in parts[:-1]:
+            if not isinstance(dst.get(part), dict):
+                dst[part] = {}
+            dst = dst[part]
+        dst[parts[-1]] = value
+    return out
+
+
+def _with_blobs(job: Dict[str, Any], include: Tuple[str, ...]) -> Dict[str, Any]:
+    """ジョブレコードに include で指定された生成結果 / 途中結果を付ける"""
+    job_id = job.get("jobId")
+    if "result" in include and "resultBytes" in job and "result" not in job:
+        job["result"] = _store().get_blob(job_id, "result")
+    if "partial" in include and "progress" in job:
+        job["partial"] = _store().get_blob(job_id, "partial")
+    return job
+
+
+def _result_summary(result: Any) -> Dict[str, Any]:
+    questions = result.get("questions") if isinstance(result, dict) else None
+    return {"questions": len(questions)} if isinstance(questions, list) else {}
+
+
+def _get_jobs(job_ids: list, include: Tuple[str, ...] = ("result",),
+              fields: Optional[Tuple[str, ...]] = None) -> list:
+    def get(job_id: str) -> Dict[str, Any]:
+        job = _store().get(JOBS, job_id)[0]
+        return _project(_with_blobs(job, include), fields) if job else {"jobId": job_id, "error": "job not found"}
+
+    with ThreadPoolExecutor(max_workers=min(BATCH_MAX_WORKERS, len(job_ids) or 1)) as pool:
+        return list(pool.map(get, job_ids))
+
+
+def _list_jobs(event: Dict[str, Any], index: str, qs: Dict[str, Any]) -> Dict[str, Any]:
+    """索引で引いたジョブレコードの一覧（大きなデータは付けない）。認証済みの呼び出し元の自分のジョブだけ
+
+    テナントは作成時と同じく _tenant_of（認証済みなら sub）で決まるので、呼び出し元の sub と一致するものを返す。
+    """
+    try:
+        since = int(qs.get('since') or 0)
+        limit = int(qs.get('limit') or 50)
+    except (TypeError, ValueError):
+        return _resp(400, {"error": "since and limit must be integers"})
+    owner = _caller_of(event)
+    if not owner:
+        return _resp(401, {"error": "authentication is required to list jobs"})
+    value = qs[index]
+    if index == "tenant" and value != owner:
+        return _resp(403, {"error": "tenant does not match the caller"})
+    # テナントで絞り込んでから limit 件を取る（他のテナントのレコードは読まない）
+    jobs = _store().query(index, value, since_ms=since, limit=limit, tenant=owner)
+    fields = _fields_of(qs)
+    return _resp(200, {"jobs": [_project(j, fields) for j in jobs]})
+
+
+def _run_worker(job_id: Optional[str], tenant: Optional[str] = None, wait_on_throttle: bool = False,
+                delivery_id: Optional[str] = None, context: Any = None) -> Dict[str, Any]:
+    """ジョブを1件実行する。再試行可能な失敗は RETRYING にして例外を投げ、キュー/Lambda の再配信に任せる
+
+    delivery_id（Lambda の aws_request_id、SQS の messageId）は再配信でも変わらないため、
+    タイムアウトで止まった試行の RUNNING はリースを待たずに同じ配信の再試行が引き継げる。
+    """
+    if not job_id or config_error(JOBS_BUCKET):
+        return {"ok": False}
+    tenant = tenant or "default"
+    ok, retry_after = _RATE_LIMITER.try_acquire(tenant)
+    if not ok:
+        if not wait_on_throttle or retry_after > TENANT_MAX_WAIT_SEC:
+            raise Throttled(tenant, retry_after)
+        time.sleep(retry_after)
+
+    with _WORKER_SLOTS:
+        state = _JobState(job_id, f"worker-{delivery_id}" if delivery_id else _new_session_id(prefix="worker"))
+        if not state.claim():
+            if state.doc.get("status") in TERMINAL_STATUSES:
+                logger.info("job %s: already finished", job_id)
+                return {"ok": True, "skipped": True}
+            # 他のワーカーのリースが生きている間は例外にして、リース切れの後に再配信させる
+            lease_ms = int(state.doc.get("updatedAt") or 0) + JOB_LEASE_SEC * 1000 - _now_ms()
+            raise RetryLater(f"job {job_id} is owned by another worker", max(1.0, lease_ms / 1000))
+        started = state.doc.get("startedAt") or _now_ms()
+        metrics.put("QueueMs", int((state.doc.get("timings") or {}).get("queueMs") or 0))
+        metrics.put("Attempts", int(state.doc.get("attempts") or 1), "Count")
+        try:
+            payload = state.doc.get("payload") or {}
+            sid = payload.get('session_id') if isinstance(payload.get('session_id'), str) else None
+
+            def generate() -> Dict[str, Any]:
+                if INVOCATION_MODE == "mock":
+                    if MOCK_LATENCY_SEC:
+                        time.sleep(MOCK_LATENCY_SEC)
+                    return {"result": f"[MOCK] Echo: {payload.get('prompt') or payload.get('s3_uri','')}"}
+                return invoke_agentcore_via_sdk(_with_extraction(payload), session_id=sid,
+                                                on_event=_progress_writer(state))
+
+            # 同じ教材・パラメータは生成結果を共有する（同時に来た重複はプロセス内 / S3 レコードで1回にまとめる）
+            qkey = _quiz_key_of(payload)
+            extra: Dict[str, Any] = {}
+            if qkey:
+                (result, shared), local = _QUIZ_CACHE.get_or_compute(
+                    qkey, lambda: _shared_result(qkey, job_id, generate, _flight_wait_sec(context)),
+                    cacheable=lambda v: isinstance(v[0], dict))
+                extra = {"resultKey": qkey, "cache": shared if local == "miss" else local}
+                metrics.set_property("QuizCache", extra["cache"])
+            else:
+                result = generate()
+            # 生成結果は別データに書き、レコードにはサイズと問題数だけ載せる
+            size = _store().put_blob(job_id, "result", result, state.doc.get("expiresAt"))
+            finished = _now_ms()
+            state.update(dict({
+                "status": "SUCCEEDED",
+                "finishedAt": finished,
+                "resultBytes": size,
+                "summary": _result_summary(result)
+            }, **extra), timings={
+                "invokeMs": finished - started,
+                "totalMs": finished - int(state.doc.get("createdAt") or started),
+            }, drop=("partial", "progress", "lastError"))
+        except RetryLater:
+            # 他のワーカーの生成を待ちきれなかった。試行回数には数えずに再配信させる
+            state.update({"status": "RETRYING", "attempts": max(0, int(state.doc.get("attempts") or 1) - 1)},
+                         drop=("workerId",))
+            raise
+        except Exception as e:
+            logger.exception("worker failed")
+            finished = _now_ms()
+            if int(state.doc.get("attempts") or 1) < JOB_MAX_ATTEMPTS:
+                state.update({"status": "RETRYING", "lastError": str(e)}, drop=("workerId",))
+                raise
+            state.update({
+                "status": "FAILED",
+                "finishedAt": finished,
+                "error": str(e)
+            }, timings={"invokeMs": finished - started})
+        return {"ok": not state.lost}
+
+
+def _run_message(message: Dict[str, Any], delivery_id: Optional[str] = None, context: Any = None) -> Dict[str, Any]:
+    # キュー経由のワーカーは1メッセージごとに計測する（SQS バッチ・ローカルキューのスレッド）
+    with metrics.invocation("worker"):
+        metrics.set_property("JobId", message.get("jobId"))
+        with metrics.timer("WorkerMs"):
+            return _run_worker(message.get("jobId"), message.get("tenant"), delivery_id=delivery_id,
+                               context=context)
+
+
+def _dead_letter(message: Dict[str, Any], error: str) -> Dict[str, Any]:
+    """再試行を使い切ったワーカーのメッセージ（DLQ / OnFailure の送信先）を受け取り、ジョブを FAILED にする。
+
+    Lambda の OnFailure の記録（requestPayload に元のイベント）と、SQS の redrive で移ったメッセージの両方を受け付ける。
+    """
+    if isinstance(message.get("requestPayload"), dict):
+        condition = (message.get("requestContext") or {}).get("condition") or "RetriesExhausted"
+        error = f"{error} ({condition})"
+        message = message["requestPayload"]
+    job_id = message.get("jobId")
+    if message.get("type") != "worker" or not job_id:
+        return {"ok": False}
+    metrics.set_property("JobId", job_id)
+    abandoned = _JobState(job_id, "dead-letter").abandon(error)
+    if abandoned:
+        logger.warning("job %s: marked FAILED after %s", job_id, error)
+    metrics.put("DeadLetterJobs", 1 if abandoned else 0, "Count")
+    return {"ok": True, "failed": abandoned}
+
+
+@metrics.instrument("jobs")
+@compression.negotiated
 def handler(event, context):
     # CORS preflight
     if isinstance(event, dict) and event.get("httpMethod") == "OPTIONS":
         return _resp(200, {"ok": True})
 
-    try:
-        # Worker invocation
-        if isinstance(event, dict) and event.get("type") == "worker":
-            job_id = event.get("jobId")
-            if not job_id or not JOBS_BUCKET:
-                return {"ok": False}
-            job_key = _job_key(job_id)
-            job = _s3_get_json(JOBS_BUCKET, job_key) or {"status": "PENDING"}
-            try:
-                payload = job.get("payload") or {}
-                sid = payload.get('session_id') if isinstance(payload.get('session_id'), str) else None
-                if INVOCATION_MODE == "mock":
-                    result = {"result": f"[MOCK] Echo: {payload.get('prompt') or payload.get('s3_uri','')}"}
-                else:
-                    result = invoke_agentcore_via_sdk(payload, session_id=sid)
-                job.update({
-                    "status": "SUCCEEDED",
-                    "finishedAt": int(time.time()*1000),
-                    "result": result
-                })
-            except Exception as e:
-                logger.exception("worker failed")
-                job.update({
-                    "status": "FAILED",
-                    "finishedAt": int(time.time()*1000),
-                    "error": str(e)
-                })
-            _s3_put_json(JOBS_BUCKET, job_key, job)
-            return {"ok": True}
+    # SQS 経由のワーカー起動（JOB_SCHEDULER=sqs）。失敗分は batchItemFailures で再配信
+    records = event.get("Records") if isinstance(event, dict) else None
+    if isinstance(records, list) and records and records[0].get("eventSource") == "aws:sqs" \
+            and JOB_DEAD_LETTER_ARN and records[0].get("eventSourceARN") == JOB_DEAD_LETTER_ARN:
+        # DLQ（SQS の redrive、lambda モードの OnFailure）: 再試行を使い切ったジョブを FAILED にする
+        metrics.set_property("Route", "dead-letter")
+        return handle_sqs_records(records, lambda m, d: _dead_letter(m, "retries exhausted"), _client, queue_url="")
+    if isinstance(records, list) and records and records[0].get("eventSource") == "aws:sqs":
+        metrics.set_property("Route", "sqs")
+        metrics.put("SqsRecords", len(records), "Count")
+        return handle_sqs_records(records, lambda m, d: _run_message(m, d, context), _client)
+
+    # 自関数の非同期起動によるワーカー（JOB_SCHEDULER=lambda）。例外は Lambda の非同期リトライに任せる
+    if isinstance(event, dict) and event.get("type") == "worker":
+        metrics.set_property("Route", "worker")
+        metrics.set_property("JobId", event.get("jobId"))
+        with metrics.timer("WorkerMs"):
+            return _run_worker(event.get("jobId"), event.get("tenant"), wait_on_throttle=True,
+                               delivery_id=getattr(context, "aws_request_id", None), context=context)
+
+    # 非同期起動の OnFailure の送信先に自関数を直接指定した場合
+    if isinstance(event, dict) and isinstance(event.get("requestPayload"), dict) \
+            and (event.get("requestContext") or {}).get("condition"):
+        metrics.set_property("Route", "dead-letter")
+        return _dead_letter(event, "retries exhausted")
+
+    # 定期実行（EventBridge スケジュール）による期限切れジョブの削除
+    if isinstance(event, dict) and event.get("type") == "compact":
+        metrics.set_property("Route", "compact")
+        removed = _store().compact(limit=int(event.get("limit") or 1000))
+        metrics.put("CompactedJobs", removed, "Count")
+        return {"ok": True, "removed": removed}
 
+    try:
         # API Gateway invocation
         method = (event.get("httpMethod") or "").upper() if isinstance(event, dict) else "POST"
+        metrics.set_property("Route", method or "POST")
+        store_error = config_error(JOBS_BUCKET)
 
         if method == "GET":
             # GET /agentcore?jobId=...
             qs = event.get('queryStringParameters') or {}
-            job_id = (qs.get('jobId') if isinstance(qs, dict) else None) or ''
+            if not isinstance(qs, dict):
+                qs = {}
+            fields = _fields_of(qs)
+            include = _blobs_for(_include_of(qs), fields)
+            resource = event.get("resource") or event.get("path") or "/"
+            index = next((k for k in INDEXES if qs.get(k)), None)
+            if index and not qs.get('jobId') and not qs.get('jobIds'):
+                # GET /agentcore?status=RUNNING または ?tenant=...: 新しい順の一覧（since=ミリ秒, limit=件数）
+                metrics.set_property("Endpoint", f"GET {resource}?{index}")
+                if store_error:
+                    return _resp(500, {"error": store_error})
+                return _list_jobs(event, index, qs)
+            job_ids = qs.get('jobIds') or ''
+            if job_ids:
+                # GET /agentcore?jobIds=a,b,c: まとめて取得
+                metrics.set_property("Endpoint", f"GET {resource}?jobIds")
+                if store_error:
+                    return _resp(500, {"error": store_error})
+                ids = [j for j in (x.strip() for x in job_ids.split(',')) if j]
+                if len(ids) > BATCH_MAX_JOBS:
+                    return _resp(400, {"error": f"jobIds accepts at most {BATCH_MAX_JOBS} ids"})
+                return _resp(200, {"jobs": _get_jobs(ids, include, fields)})
+            metrics.set_property("Endpoint", f"GET {resource}?jobId")
+            job_id = qs.get('jobId') or ''
             if not job_id:
                 return _resp(400, {"error": "jobId is required"})
-            if not JOBS_BUCKET:
-                return _resp(500, {"error": "JOBS_BUCKET is not set"})
-            job = _s3_get_json(JOBS_BUCKET, _job_key(job_id))
+            if store_error:
+                return _resp(500, {"error": store_error})
+            # If-None-Match をそのままジョブストアに渡し、未変更なら本体を読まずに 304 を返す。
+            # wait=秒 が指定されていれば、変化するまでサーバー側で待つ（ロングポーリング）
+            inm = _header(event, "if-none-match")
+            try:
+                wait_sec = min(max(float(qs.get('wait') or 0), 0.0), LONG_POLL_MAX_SEC)
+            except (TypeError, ValueError):
+                wait_sec = 0.0
+            if inm and wait_sec > 0:
+                job, etag, not_modified = _wait_for_change(job_id, inm, wait_sec)
+            else:
+                job, etag, not_modified = _store().get(JOBS, job_id, if_none_match=inm)
+            if not_modified:
+                return _resp(304, None, {"etag": etag})
             if not job:
                 return _resp(404, {"error": "job not found"})
-            return _resp(200, job)
+            return _resp(200, _project(_with_blobs(job, include), fields), {"etag": etag} if etag else None)
 
         # POST: start job
         body, _ = _parse_body(event)
+
+        # POST {"jobs": [payload, ...]}: 一括投入
+        if isinstance(body, dict) and isinstance(body.get("jobs"), list):
+            if store_error:
+                return _resp(500, {"error": store_error})
+            payloads = body["jobs"]
+            if not payloads or len(payloads) > BATCH_MAX_JOBS:
+                return _resp(400, {"error": f"jobs must contain 1..{BATCH_MAX_JOBS} payloads"})
+            return _resp(202, {"jobs": _start_jobs(payloads, _tenant_of(event, body))})
+
         ok, kind = _validate_payload(body)
         if not ok:
-            return _resp(400, {"error": kind, "usage": {
-                "prompt": {"prompt": "任意の文字列"},
-                "structured": {"s3_uri": "s3://bucket/key", "target": "高校生", "difficulty": "普通", "num_questions": 5}
-            }})
-
-        if not JOBS_BUCKET:
-            return _resp(500, {"error": "JOBS_BUCKET is not set"})
-
-        job_id = _new_session_id(prefix="job")
-        job_doc = {
-            "jobId": job_id,
-            "status": "PENDING",
-            "createdAt": int(time.time()*1000),
-            "payload": body
-        }
-        _s3_put_json(JOBS_BUCKET, _job_key(job_id), job_doc)
-
-        # async self invoke
-        import boto3
-        lam = boto3.client('lambda', region_name=AWS_REGION)
-        lam.invoke(
-            FunctionName=os.getenv('AWS_LAMBDA_FUNCTION_NAME'),
-            InvocationType='Event',
-            Payload=json.dumps({"type": "worker", "jobId": job_id}).encode('utf-8')
-        )
+            return _resp(400, {"error": kind, "usage": _USAGE})
+
+        if store_error:
+            return _resp(500, {"error": store_error})
+
+        tenant = _tenant_of(event, body)
+        job_id = _create_job(body, tenant)
+        _dispatch_worker(job_id, tenant)
 
         return _resp(202, {"jobId": job_id, "status": "PENDING"})
 
@@ -0,0 +1,623 @@
+# ジョブ文書の保存先（ジョブストア）
+#
+# - s3      : JOBS_BUCKET の jobs/<jobId>.json（従来方式）。索引は空オブジェクトのマーカーで持つ
+# - dynamodb: JOB_TABLE（DynamoDB 互換）。索引は GSI、期限切れの削除は DynamoDB の TTL
+# - sqlite  : SQLite（既定 :memory:、ローカル検証用）
+#
+# レコード（状態・タイミングなど数百バイト）と大きなデータ（生成結果 result、途中結果 partial）は分けて保存し、
+# ポーリングはレコードだけを読む。ジョブレコードは status / tenant ごとに createdAt の新しい順で引ける。
+# 各レコードの expiresAt（ミリ秒）を過ぎたものは存在しないものとして扱い、compact() で削除する。
+# 大きなデータは COMPRESS_MIN_BYTES 以上なら gzip で保存する（STORE_COMPRESSION=0 で無効。読み込みは両方に対応）。
+
+import json
+import logging
+import os
+from abc import ABC, abstractmethod
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import quote, unquote
+
+import compression
+import metrics
+
+logger = logging.getLogger()
+
+JOB_STORE = os.getenv("JOB_STORE", "s3").lower()  # s3 | dynamodb | sqlite
+JOB_TABLE = os.getenv("JOB_TABLE", "")
+JOB_STORE_SQLITE = os.getenv("JOB_STORE_SQLITE", ":memory:")
+JOB_TTL_SEC = int(os.getenv("JOB_TTL_SEC", str(7 * 24 * 3600)))
+JOB_QUERY_MAX = int(os.getenv("JOB_QUERY_MAX", "100"))
+
+JOBS = "jobs"        # ジョブレコード（索引あり）
+RESULTS = "results"  # 生成結果レコード（コンテナをまたぐ合流用）
+INDEXES = ("status", "tenant")
+BLOB_NAMES = ("result", "partial")
+
+Doc = Dict[str, Any]
+GetResult = Tuple[Optional[Doc], Optional[str], bool]
+
+
+class JobConflict(Exception):
+    """ETag 条件付き書き込みが他の書き込みと競合した"""
+
+
+def _aws_status(e: Exception) -> int:
+    r = getattr(e, 'response', None) or {}
+    try:
+        return int((r.get('ResponseMetadata') or {}).get('HTTPStatusCode') or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _aws_code(e: Exception) -> str:
+    return str(((getattr(e, 'response', None) or {}).get('Error') or {}).get('Code') or '')
+
+
+def _now_ms() -> int:
+    return int(time.time()*1000)
+
+
+def _expired(doc: Optional[Doc], now: Optional[int] = None) -> bool:
+    expires = (doc or {}).get("expiresAt")
+    return bool(expires) and int(expires) <= (now or _now_ms())
+
+
+def _encode(data: Any) -> bytes:
+    return json.dumps(data, ensure_ascii=False).encode('utf-8')
+
+
+class JobStore(ABC):
+    """バックエンド共通のインターフェース。
+
+    get / put は ETag による楽観的排他（if_match / if_none_match="*"）を持ち、競合時は JobConflict を投げる。
+    期限切れのレコードは get で (None, ETag, False) を返す（ETag を if_match に渡せば上書きできる）。
+    """
+
+    kind = ""
+
+    @abstractmethod
+    def get(self, ns: str, key: str, if_none_match: Optional[str] = None) -> GetResult:
+        """(文書, ETag, 未変更か) を返す。if_none_match が現在の ETag と一致すれば本体を返さない"""
+
+    @abstractmethod
+    def put(self, ns: str, key: str, doc: Doc, if_match: Optional[str] = None,
+            if_none_match: Optional[str] = None, previous: Optional[Doc] = None) -> Optional[str]:
+        """文書を書き込み、新しい ETag を返す。previous は直前の文書（索引の付け替えに使う）"""
+
+    @abstractmethod
+    def put_blob(self, job_id: str, name: str, value: Any, expires_at: Optional[int] = None) -> int:
+        """ジョブの大きなデータ（name は BLOB_NAMES）を書き込み、バイト数を返す"""
+
+    @abstractmethod
+    def get_blob(self, job_id: str, name: str) -> Any:
+        """put_blob で書いたデータを返す（無ければ None）"""
+
+    @abstractmethod
+    def query(self, index: str, value: str, since_ms: int = 0, limit: int = 50,
+              tenant: Optional[str] = None) -> List[Doc]:
+        """索引（status / tenant）が value のジョブレコードを createdAt の新しい順に返す（since_ms 以降）。
+
+        tenant を指定したらそのテナントのジョブだけを索引で引く（limit は絞り込んだ後に数える）。
+        """
+
+    @abstractmethod
+    def compact(self, now_ms: Optional[int] = None, limit: int = 1000) -> int:
+        """期限切れのレコードと関連データを最大 limit 件削除し、削除したジョブ数を返す"""
+
+
+class S3JobStore(JobStore):
+    """S3 のオブジェクトをレコードにする。
+
+    索引は jobs/index/ 配下の空オブジェクト（キー名だけで並べ替えと絞り込みができる）:
+      status/<STATUS>/<逆順 createdAt>_<jobId>, tenant/<tenant>/<逆順 createdAt>_<jobId>, expires/<expiresAt>_<jobId>
+      tenant-status/<tenant>%2F<STATUS>/<逆順 createdAt>_<jobId>（テナント内の状態別。query(tenant=...) で使う）
+    状態が変わるたびに新しい status / tenant-status マーカーを書いて古いものを消す。マーカーは目安で、query はレコードを読んで確かめる。
+    大きなデータは jobs/blobs/<jobId>.<name>.json。
+    ジョブ以外の名前空間（results など）は索引を持たず、期限マーカー <prefix>index/expires/<expiresAt>_<key> だけを書く。
+    """
+
+    kind = "s3"
+
+    def __init__(self, client_factory: Callable[[str], Any], bucket: str,
+                 prefixes: Dict[str, str], max_workers: int = 16):
+        self.client_factory = client_factory
+        self.bucket = bucket
+        self.prefixes = {ns: (p if p.endswith('/') else p + '/') for ns, p in prefixes.items()}
+        self.max_workers = max_workers
+
+    @property
+    def _s3(self):
+        return self.client_factory('s3')
+
+    def _key(self, ns: str, key: str) -> str:
+        return f"{self.prefixes[ns]}{key}.json"
+
+    def _index_prefix(self, ns: str = JOBS) -> str:
+        return f"{self.prefixes[ns]}index/"
+
+    def _marker(self, index: str, value: str, created: int, job_id: str) -> str:
+        # 10**13 - createdAt で新しいジョブほど前に並ぶ（LIST は昇順）
+        return f"{self._index_prefix()}{index}/{quote(str(value), safe='')}/{10**13 - created:013d}_{job_id}"
+
+    @staticmethod
+    def _tenant_status(tenant: str, status: str) -> str:
+        return f"{quote(str(tenant), safe='')}/{status}"
+
+    def _expiry_marker(self, expires: int, key: str, ns: str = JOBS) -> str:
+        return f"{self._index_prefix(ns)}expires/{expires:013d}_{quote(key, safe='')}"
+
+    @metrics.timed("StoreGetMs")
+    def get(self, ns: str, key: str, if_none_match: Optional[str] = None) -> GetResult:
+        req = {'Bucket': self.bucket, 'Key': self._key(ns, key)}
+        if if_none_match:
+            req['IfNoneMatch'] = if_none_match
+        try:
+            r = self._s3.get_object(**req)
+        except Exception as e:
+            if _aws_status(e) == 304:
+                return None, if_none_match, True
+            return None, None, False
+        try:
+            doc = json.loads(r['Body'].read())
+        except Exception:
+            return None, r.get('ETag'), False
+        return (None if _expired(doc) else doc), r.get('ETag'), False
+
+    @metrics.timed("StorePutMs")
+    def put(self, ns: str, key: str, doc: Doc, if_match: Optional[str] = None,
+            if_none_match: Optional[str] = None, previous: Optional[Doc] = None) -> Optional[str]:
+        req = {'Bucket': self.bucket, 'Key': self._key(ns, key), 'Body': _encode(doc), 'ContentType': 'application/json'}
+        if if_match:
+            req['IfMatch'] = if_match
+        if if_none_match:
+            req['IfNoneMatch'] = if_none_match
+        metrics.add("StorePutBytes", len(req['Body']), "Bytes")
+        try:
+            r = self._s3.put_object(**req)
+        except Exception as e:
+            if _aws_status(e) in (409, 412):
+                raise JobConflict(key) from e
+            raise
+        if ns == JOBS:
+            try:
+                self._reindex(key, doc, previous)
+            except Exception:
+                logger.exception("job %s: index update failed", key)
+        elif doc.get("expiresAt"):
+            # 書き込みごとに期限が延びるので毎回マーカーを書く（古いマーカーは compact() が読み比べて消す）
+            try:
+                self._touch(self._expiry_marker(int(doc["expiresAt"]), key, ns))
+            except Exception:
+                logger.exception("%s %s: expiry marker write failed", ns, key)
+        return r.get('ETag')
+
+    def _reindex(self, job_id: str, doc: Doc, previous: Optional[Doc]) -> None:
+        created = int(doc.get("createdAt") or 0)
+        status, prev_status = doc.get("status"), (previous or {}).get("status")
+        tenant = doc.get("tenant")
+        if status and status != prev_status:
+            self._touch(self._marker("status", status, created, job_id))
+            if tenant:
+                self._touch(self._marker("tenant-status", self._tenant_status(tenant, status), created, job_id))
+            if prev_status:
+                self._s3.delete_object(Bucket=self.bucket, Key=self._marker("status", prev_status, created, job_id))
+                if tenant:
+                    self._s3.delete_object(Bucket=self.bucket, Key=self._marker(
+                        "tenant-status", self._tenant_status(tenant, prev_status), created, job_id))
+        if previous is None:
+            if doc.get("tenant"):
+                self._touch(self._marker("tenant", doc["tenant"], created, job_id))
+            if doc.get("expiresAt"):
+                self._touch(self._expiry_marker(int(doc["expiresAt"]), job_id))
+
+    def _touch(self, key: str) -> None:
+        self._s3.put_object(Bucket=self.bucket, Key=key, Body=b'')
+
+    def _blob_key(self, job_id: str, name: str) -> str:
+        return f"{self.prefixes[JOBS]}blobs/{job_id}.{name}.json"
+
+    @metrics.timed("StorePutMs")
+    def put_blob(self, job_id: str, name: str, value: Any, expires_at: Optional[int] = None) -> int:
+        body = _encode(value)
+        data, encoding = compression.pack(body)
+        metrics.add("StorePutBytes", len(data), "Bytes")
+        req = {'Bucket': self.bucket, 'Key': self._blob_key(job_id, name), 'Body': data,
+               'ContentType': 'application/json'}
+        if encoding:
+            req['ContentEncoding'] = encoding
+        self._s3.put_object(**req)
+        return len(body)
+
+    @metrics.timed("StoreGetMs")
+    def get_blob(self, job_id: str, name: str) -> Any:
+        try:
+            r = self._s3.get_object(Bucket=self.bucket, Key=self._blob_key(job_id, name))
+            return json.loads(compression.unpack(r['Body'].read(), r.get('ContentEncoding')))
+        except Exception:
+            return None
+
+    @metrics.timed("StoreGetMs")
+    def _load(self, job_id: str) -> Tuple[Optional[Doc], bool]:
+        """索引から引くジョブレコードを読む。(文書, マーカーを消してよいか) を返す。
+
+        消してよいのはレコードが無い（404）か期限切れのときだけ。スロットリングや 5xx、権限エラーでは残す。
+        """
+        try:
+            r = self._s3.get_object(Bucket=self.bucket, Key=self._key(JOBS, job_id))
+        except Exception as e:
+            if _aws_status(e) == 404:
+                return None, True
+            logger.warning("job %s: index lookup failed (%s)", job_id, e)
+            return None, False
+        try:
+            doc = json.loads(r['Body'].read())
+        except Exception:
+            return None, False
+        return (None, True) if _expired(doc) else (doc, False)
+
+    def _list(self, prefix: str, start_after: str = '') -> Iterator[str]:
+        req = {'Bucket': self.bucket, 'Prefix': prefix}
+        if start_after:
+            req['StartAfter'] = start_after
+        while True:
+            page = self._s3.list_objects_v2(**req)
+            for obj in page.get('Contents') or []:
+                yield obj['Key']
+            token = page.get('NextContinuationToken')
+            if not page.get('IsTruncated') or not token:
+                return
+            req['ContinuationToken'] = token
+            req.pop('StartAfter', None)
+
+    def query(self, index: str, value: str, since_ms: int = 0, limit: int = 50,
+              tenant: Optional[str] = None) -> List[Doc]:
+        limit = max(1, min(limit, JOB_QUERY_MAX))
+        if tenant is not None and index == "tenant" and str(value) != str(tenant):
+            return []
+        marker_index, marker_value = index, value
+        if tenant is not None and index == "status":
+            marker_index, marker_value = "tenant-status", self._tenant_status(tenant, value)
+        prefix = f"{self._index_prefix()}{marker_index}/{quote(str(marker_value), safe='')}/"
+        out: List[Doc] = []
+        keys = self._list(prefix)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while len(out) < limit:
+                batch = []
+                for marker in keys:
+                    rev, _, job_id = marker[len(prefix):].partition('_')
+                    if 10**13 - int(rev) < since_ms:
+                        keys = iter(())
+                        break
+                    batch.append((marker, job_id))
+                    if len(batch) >= limit - len(out):
+                        break
+                if not batch:
+                    break
+                loaded = pool.map(metrics.bind(lambda m: self._load(m[1])), batch)
+                for (marker, job_id), (doc, gone) in zip(batch, loaded):
+                    if doc and str(doc.get(index)) == str(value) and (tenant is None or doc.get("tenant") == tenant):
+                        out.append(doc)
+                    elif gone or (doc is not None and index != "status"):
+                        # レコードが消えた・期限切れのマーカーは読むついでに消す（status は書き込み中の付け替えがあり得るので残す）
+                        self._s3.delete_object(Bucket=self.bucket, Key=marker)
+        return out[:limit]
+
+    def compact(self, now_ms: Optional[int] = None, limit: int = 1000) -> int:
+        now = now_ms or _now_ms()
+        removed = self._compact_jobs(now, limit)
+        for ns in self.prefixes:
+            if ns != JOBS and removed < limit:
+                removed += self._compact_records(ns, now, limit - removed)
+        return removed
+
+    def _compact_jobs(self, now: int, limit: int) -> int:
+        expiry_prefix = f"{self._index_prefix()}expires/"
+        removed = 0
+        for marker in self._list(expiry_prefix):
+            expires, _, job_id = marker[len(expiry_prefix):].partition('_')
+            if int(expires) > now or removed >= limit:
+                break  # 期限の昇順に並んでいるので、ここから先はまだ有効
+            try:
+                doc = json.loads(self._s3.get_object(Bucket=self.bucket, Key=self._key(JOBS, job_id))['Body'].read())
+            except Exception as e:
+                if _aws_status(e) != 404:
+                    logger.warning("job %s: compaction skipped (%s)", job_id, e)
+                    continue  # 読めないレコードは消さずに残す
+                doc = {}
+            if not _expired(doc, now) and doc.get("expiresAt"):
+                # 期限が延ばされたレコード。古いマーカーだけ消す
+                self._delete([marker])
+                continue
+            keys = [self._key(JOBS, job_id), marker] + [self._blob_key(job_id, n) for n in BLOB_NAMES]
+            created = int(doc.get("createdAt") or 0)
+            if doc.get("status"):
+                keys.append(self._marker("status", doc["status"], created, job_id))
+            if doc.get("tenant"):
+                keys.append(self._marker("tenant", doc["tenant"], created, job_id))
+                if doc.get("status"):
+                    keys.append(self._marker("tenant-status", self._tenant_status(doc["tenant"], doc["status"]),
+                                             created, job_id))
+            self._delete(keys)
+            removed += 1
+        return removed
+
+    def _compact_records(self, ns: str, now: int, limit: int) -> int:
+        expiry_prefix = f"{self._index_prefix(ns)}expires/"
+        removed = 0
+        for marker in self._list(expiry_prefix):
+            expires, _, quoted = marker[len(expiry_prefix):].partition('_')
+            if int(expires) > now or removed >= limit:
+                break
+            key = unquote(quoted)
+            try:
+                doc = json.loads(self._s3.get_object(Bucket=self.bucket, Key=self._key(ns, key))['Body'].read())
+            except Exception as e:
+                if _aws_status(e) != 404:
+                    logger.warning("%s %s: compaction skipped (%s)", ns, key, e)
+                    continue
+                doc = {}
+            if not _expired(doc, now) and doc.get("expiresAt"):
+                self._delete([marker])
+                continue
+            self._delete([self._key(ns, key), marker])
+            removed += 1
+        return removed
+
+    def _delete(self, keys: List[str]) -> None:
+        for i in range(0, len(keys), 1000):
+            self._s3.delete_objects(Bucket=self.bucket, Delete={
+                'Objects': [{'Key': k} for k in keys[i:i + 1000]], 'Quiet': True})
+
+
+class DynamoJobStore(JobStore):
+    """DynamoDB（互換）テーブルの1項目を1レコードにする。
+
+    キーは pk（"<ns>#<key>"）。doc は JSON 文字列、rev（書き込みごとに変わる番号）を ETag として使う。
+    ジョブレコードは status / tenant / tenantStatus（"<tenant>#<status>"）/ createdAt を属性にも持ち、
+    GSI（status-createdAt、tenant-createdAt、tenantStatus-createdAt）で引く。
+    ttl（エポック秒）は DynamoDB の TTL 属性。TTL による削除は遅れるので、期限切れは読み取り時にも除く。
+    大きなデータは pk "blob#<jobId>.<name>" の別項目（圧縮したものはバイナリ属性 gz、それ以外は data）。
+    """
+
+    kind = "dynamodb"
+    INDEX_NAMES = {"status": "status-createdAt", "tenant": "tenant-createdAt", "tenantStatus": "tenantStatus-createdAt"}
+
+    def __init__(self, client_factory: Callable[[str], Any], table: str):
+        self.client_factory = client_factory
+        self.table = table
+
+    @property
+    def _db(self):
+        return self.client_factory('dynamodb')
+
+    @staticmethod
+    def _etag(rev: Any) -> str:
+        return f'"{rev}"'
+
+    @metrics.timed("StoreGetMs")
+    def get(self, ns: str, key: str, if_none_match: Optional[str] = None) -> GetResult:
+        try:
+            item = self._db.get_item(TableName=self.table, Key={'pk': {'S': f"{ns}#{key}"}},
+                                     ConsistentRead=True).get('Item')
+        except Exception:
+            logger.exception("dynamodb get failed: %s#%s", ns, key)
+            return None, None, False
+        if not item:
+            return None, None, False
+        etag = self._etag(item['rev']['N'])
+        if if_none_match and if_none_match == etag:
+            return None, etag, True
+        try:
+            doc = json.loads(item['doc']['S'])
+        except Exception:
+            return None, etag, False
+        return (None if _expired(doc) else doc), etag, False
+
+    @metrics.timed("StorePutMs")
+    def put(self, ns: str, key: str, doc: Doc, if_match: Optional[str] = None,
+            if_none_match: Optional[str] = None, previous: Optional[Doc] = None) -> Optional[str]:
+        body = _encode(doc).decode('utf-8')
+        metrics.add("StorePutBytes", len(body.encode('utf-8')), "Bytes")
+        rev = time.time_ns()
+        item: Dict[str, Any] = {'pk': {'S': f"{ns}#{key}"}, 'doc': {'S': body}, 'rev': {'N': str(rev)}}
+        if doc.get("expiresAt"):
+            item['ttl'] = {'N': str(int(doc["expiresAt"]) // 1000)}
+        if ns == JOBS:
+            for attr in INDEXES:
+                if doc.get(attr):
+                    item[attr] = {'S': str(doc[attr])}
+            if doc.get("tenant") and doc.get("status"):
+                item['tenantStatus'] = {'S': f"{doc['tenant']}#{doc['status']}"}
+            item['createdAt'] = {'N': str(int(doc.get("createdAt") or 0))}
+        req: Dict[str, Any] = {'TableName': self.table, 'Item': item}
+        if if_match:
+            req.update(ConditionExpression='rev = :rev', ExpressionAttributeValues={':rev': {'N': if_match.strip('"')}})
+        elif if_none_match == "*":
+            # TTL で未削除の期限切れ項目は無いものとして扱う
+            req.update(ConditionExpression='attribute_not_exists(pk) OR #ttl <= :now',
+                       ExpressionAttributeNames={'#ttl': 'ttl'},
+                       ExpressionAttributeValues={':now': {'N': str(_now_ms() // 1000)}})
+        try:
+            self._db.put_item(**req)
+        except Exception as e:
+            if _aws_code(e) == 'ConditionalCheckFailedException':
+                raise JobConflict(key) from e
+            raise
+        return self._etag(rev)
+
+    @metrics.timed("StorePutMs")
+    def put_blob(self, job_id: str, name: str, value: Any, expires_at: Optional[int] = None) -> int:
+        body = _encode(value)
+        data, encoding = compression.pack(body)
+        metrics.add("StorePutBytes", len(data), "Bytes")
+        item = {'pk': {'S': f"blob#{job_id}.{name}"}}
+        if encoding:
+            item['gz'] = {'B': data}
+        else:
+            item['data'] = {'S': body.decode('utf-8')}
+        if expires_at:
+            item['ttl'] = {'N': str(int(expires_at) // 1000)}
+        self._db.put_item(TableName=self.table, Item=item)
+        return len(body)
+
+    @metrics.timed("StoreGetMs")
+    def get_blob(self, job_id: str, name: str) -> Any:
+        try:
+            item = self._db.get_item(TableName=self.table, Key={'pk': {'S': f"blob#{job_id}.{name}"}}).get('Item')
+            if not item:
+                return None
+            if 'gz' in item:
+                return json.loads(compression.unpack(item['gz']['B'], 'gzip'))
+            return json.loads(item['data']['S'])
+        except Exception:
+            logger.exception("dynamodb blob get failed: %s.%s", job_id, name)
+            return None
+
+    def query(self, index: str, value: str, since_ms: int = 0, limit: int = 50,
+              tenant: Optional[str] = None) -> List[Doc]:
+        limit = max(1, min(limit, JOB_QUERY_MAX))
+        if tenant is not None and index == "tenant" and str(value) != str(tenant):
+            return []
+        if tenant is not None and index == "status":
+            index, value = "tenantStatus", f"{tenant}#{value}"
+        req: Dict[str, Any] = {
+            'TableName': self.table,
+            'IndexName': self.INDEX_NAMES[index],
+            'KeyConditionExpression': '#k = :v AND createdAt >= :since',
+            'ExpressionAttributeNames': {'#k': index},
+            'ExpressionAttributeValues': {':v': {'S': str(value)}, ':since': {'N': str(int(since_ms))}},
+            'ScanIndexForward': False,
+            'Limit': limit,
+        }
+        out: List[Doc] = []
+        now = _now_ms()
+        while len(out) < limit:
+            page = self._db.query(**req)
+            for item in page.get('Items') or []:
+                doc = json.loads(item['doc']['S'])
+                if not _expired(doc, now):
+                    out.append(doc)
+            if not page.get('LastEvaluatedKey'):
+                break
+            req['ExclusiveStartKey'] = page['LastEvaluatedKey']
+        return out[:limit]
+
+    def compact(self, now_ms: Optional[int] = None, limit: int = 1000) -> int:
+        # 削除はテーブルの TTL 設定（属性 ttl）に任せる
+        return 0
+
+
+class SqliteJobStore(JobStore):
+    """SQLite のテーブルをレコードにするローカル実装（scheduler.LocalQueueScheduler と同じく1接続 + ロック）"""
+
+    kind = "sqlite"
+
+    def __init__(self, path: str = JOB_STORE_SQLITE):
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("CREATE TABLE IF NOT EXISTS records (ns TEXT NOT NULL, key TEXT NOT NULL, doc TEXT NOT NULL, "
+                         "rev INTEGER NOT NULL, status TEXT, tenant TEXT, created_at INTEGER, expires_at INTEGER, "
+                         "PRIMARY KEY (ns, key))")
+        self._db.execute("CREATE INDEX IF NOT EXISTS records_status ON records (ns, status, created_at)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS records_tenant ON records (ns, tenant, created_at)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS records_tenant_status ON records (ns, tenant, status, created_at)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS records_expires ON records (expires_at)")
+        # data は JSON の文字列、または gzip したバイト列（BLOB）
+        self._db.execute("CREATE TABLE IF NOT EXISTS blobs (job_id TEXT NOT NULL, name TEXT NOT NULL, data NOT NULL, "
+                         "expires_at INTEGER, PRIMARY KEY (job_id, name))")
+        self._lock = threading.Lock()
+        self._rev = 0
+
+    @metrics.timed("StoreGetMs")
+    def get(self, ns: str, key: str, if_none_match: Optional[str] = None) -> GetResult:
+        with self._lock:
+            row = self._db.execute("SELECT doc, rev FROM records WHERE ns = ? AND key = ?", (ns, key)).fetchone()
+        if row is None:
+            return None, None, False
+        etag = f'"{row[1]}"'
+        if if_none_match and if_none_match == etag:
+            return None, etag, True
+        doc = json.loads(row[0])
+        return (None if _expired(doc) else doc), etag, False
+
+    @metrics.timed("StorePutMs")
+    def put(self, ns: str, key: str, doc: Doc, if_match: Optional[str] = None,
+            if_none_match: Optional[str] = None, previous: Optional[Doc] = None) -> Optional[str]:
+        body = _encode(doc).decode('utf-8')
+        metrics.add("StorePutBytes", len(body.encode('utf-8')), "Bytes")
+        indexed = ns == JOBS
+        with self._lock:
+            row = self._db.execute("SELECT rev, expires_at FROM records WHERE ns = ? AND key = ?", (ns, key)).fetchone()
+            if if_match and (row is None or f'"{row[0]}"' != if_match):
+                raise JobConflict(key)
+            if if_none_match == "*" and row is not None and not (row[1] and row[1] <= _now_ms()):
+                raise JobConflict(key)
+            self._rev = max(self._rev + 1, time.time_ns())
+            self._db.execute("INSERT OR REPLACE INTO records (ns, key, doc, rev, status, tenant, created_at, expires_at) "
+                             "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                             (ns, key, body, self._rev, doc.get("status") if indexed else None,
+                              doc.get("tenant") if indexed else None, doc.get("createdAt"), doc.get("expiresAt")))
+            return f'"{self._rev}"'
+
+    @metrics.timed("StorePutMs")
+    def put_blob(self, job_id: str, name: str, value: Any, expires_at: Optional[int] = None) -> int:
+        body = _encode(value)
+        data, encoding = compression.pack(body)
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO blobs (job_id, name, data, expires_at) VALUES (?, ?, ?, ?)",
+                             (job_id, name, data if encoding else body.decode('utf-8'), expires_at))
+        metrics.add("StorePutBytes", len(data), "Bytes")
+        return len(body)
+
+    @metrics.timed("StoreGetMs")
+    def get_blob(self, job_id: str, name: str) -> Any:
+        with self._lock:
+            row = self._db.execute("SELECT data FROM blobs WHERE job_id = ? AND name = ?", (job_id, name)).fetchone()
+        if row is None:
+            return None
+        return json.loads(compression.unpack(row[0], 'gzip') if isinstance(row[0], bytes) else row[0])
+
+    def query(self, index: str, value: str, since_ms: int = 0, limit: int = 50,
+              tenant: Optional[str] = None) -> List[Doc]:
+        if index not in INDEXES:
+            raise ValueError(f"unknown index: {index}")
+        limit = max(1, min(limit, JOB_QUERY_MAX))
+        scope, params = ("AND tenant = ? ", (tenant,)) if tenant is not None else ("", ())
+        with self._lock:
+            rows = self._db.execute(f"SELECT doc FROM records WHERE ns = ? AND {index} = ? {scope}AND created_at >= ? "
+                                    "AND (expires_at IS NULL OR expires_at > ?) ORDER BY created_at DESC LIMIT ?",
+                                    (JOBS, value) + params + (since_ms, _now_ms(), limit)).fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+    def compact(self, now_ms: Optional[int] = None, limit: int = 1000) -> int:
+        now = now_ms or _now_ms()
+        with self._lock:
+            keys = [r[0] for r in self._db.execute(
+                "SELECT key FROM records WHERE ns = ? AND expires_at <= ? ORDER BY expires_at LIMIT ?",
+                (JOBS, now, limit)).fetchall()]
+            self._db.executemany("DELETE FROM records WHERE ns = ? AND key = ?", [(JOBS, k) for k in keys])
+            self._db.executemany("DELETE FROM blobs WHERE job_id = ?", [(k,) for k in keys])
+            self._db.execute("DELETE FROM records WHERE ns != ? AND expires_at <= ?", (JOBS, now))
+            self._db.execute("DELETE FROM blobs WHERE expires_at <= ?", (now,))
+        return len(keys)
+
+
+def create_store(client_factory: Callable[[str], Any], bucket: str, prefixes: Dict[str, str],
+                 kind: str = JOB_STORE) -> JobStore:
+    """JOB_STORE に応じたジョブストアを作る"""
+    if kind == "dynamodb":
+        return DynamoJobStore(client_factory, JOB_TABLE)
+    if kind == "sqlite":
+        return SqliteJobStore()
+    return S3JobStore(client_factory, bucket, prefixes)
+
+
+def config_error(bucket: str, kind: str = JOB_STORE) -> Optional[str]:
+    """ジョブストアの設定が足りなければエラーメッセージを返す"""
+    if kind == "dynamodb":
+        return None if JOB_TABLE else "JOB_TABLE is not set"
+    if kind == "sqlite":
+        return None
+    return None if bucket else "JOBS_BUCKET is not set"
@@ -0,0 +1,299 @@
+# 段階別のレイテンシ計測と CloudWatch Embedded Metric Format（EMF）出力
+#
+# Python 版の各ハンドラ（process / ジョブ関数 / agentcore_invoke）で共通。関数ごとに個別にパッケージされるため、
+# 同じ内容のファイルを各 src に置いている（変更時はすべてのコピーを揃えること）。
+#
+#   @metrics.instrument("process")      … 1呼び出しごとに EMF を1行出力（Duration, ColdStart, Errors, 入出力バイト数）
+#                                          API Gateway からの呼び出しは Endpoint（メソッド + リソース）でも入出力バイト数を分ける
+#   with metrics.invocation("worker"): … … ハンドラ以外の実行単位（キューのワーカーなど）
+#   with metrics.timer("S3FetchMs"): …  … 段階ごとの所要時間
+#   @metrics.timed("AgentCoreMs")       … 関数単位の所要時間
+#   metrics.usage(resp.get("usage"), "Ocr") … converse の usage からトークン数
+#
+# PROFILE_SLOW_MS を設定すると、その時間を超えた呼び出しだけ実行中のスタックを標本化して出力する。
+
+import contextvars
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+METRICS_NAMESPACE = os.getenv("METRICS_NAMESPACE", "TdxQuiz")
+METRICS_SERVICE = os.getenv("METRICS_SERVICE", os.getenv("AWS_LAMBDA_FUNCTION_NAME", "local"))
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "0"))  # 0 で無効
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "10"))
+PROFILE_TOP = int(os.getenv("PROFILE_TOP", "15"))
+
+_MAX_VALUES = 100  # EMF の1メトリクスあたりの値の上限
+_ENDPOINT_METRICS = ("RequestBytes", "ResponseBytes", "ResponseRawBytes")  # Endpoint の次元でも出すもの
+_CURRENT: "contextvars.ContextVar[Optional[Metrics]]" = contextvars.ContextVar("metrics", default=None)
+_COLD_START = True
+_COLD_LOCK = threading.Lock()
+_LOADED_AT = time.time()
+
+
+class Metrics:
+    """1呼び出し分のメトリクス。flush() で EMF の JSON 1行として標準出力へ書く"""
+
+    def __init__(self, handler: str):
+        self.handler = handler
+        self._values: Dict[str, List[float]] = {}
+        self._units: Dict[str, str] = {}
+        self._props: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self.failed = False
+
+    def put(self, name: str, value: float, unit: str = "Milliseconds") -> None:
+        with self._lock:
+            values = self._values.setdefault(name, [])
+            if len(values) < _MAX_VALUES:
+                values.append(value)
+            self._units[name] = unit
+
+    def add(self, name: str, value: float, unit: str = "Count") -> None:
+        """同じ名前の値を合計する（トークン数・バイト数など）"""
+        with self._lock:
+            values = self._values.setdefault(name, [0])
+            values[0] += value
+            self._units[name] = unit
+
+    def set_property(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._props[key] = value
+
+    @contextmanager
+    def timer(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.put(name, round((time.perf_counter() - started) * 1000, 3))
+
+    def record_response(self, result: Any) -> None:
+        """API Gateway 形式の応答から statusCode と本文のバイト数（圧縮後・base64 を戻した転送量）を記録する"""
+        if not isinstance(result, dict):
+            return
+        status = result.get("statusCode")
+        if isinstance(status, int):
+            self.set_property("StatusCode", status)
+            if status >= 500:
+                self.failed = True
+        size = _body_bytes(result)
+        if size is not None:
+            self.put("ResponseBytes", size, "Bytes")
+
+    def flush(self) -> None:
+        if not METRICS_ENABLED:
+            return
+        with self._lock:
+            if not self._values:
+                return
+            doc: Dict[str, Any] = dict(self._props)
+            directives = [{
+                "Namespace": METRICS_NAMESPACE,
+                "Dimensions": [["Service", "Handler"]],
+                "Metrics": [{"Name": n, "Unit": self._units[n]} for n in self._values],
+            }]
+            by_endpoint = [n for n in _ENDPOINT_METRICS if n in self._values]
+            if doc.get("Endpoint") and by_endpoint:
+                directives.append({
+                    "Namespace": METRICS_NAMESPACE,
+                    "Dimensions": [["Service", "Handler", "Endpoint"]],
+                    "Metrics": [{"Name": n, "Unit": self._units[n]} for n in by_endpoint],
+                })
+            doc.update({
+                "_aws": {
+                    "Timestamp": int(time.time() * 1000),
+                    "CloudWatchMetrics": directives,
+                },
+                "Service": METRICS_SERVICE,
+                "Handler": self.handler,
+            })
+            for name, values in self._values.items():
+                doc[name] = values[0] if len(values) == 1 else values
+            self._values = {}
+        # Lambda の logging 書式（接頭辞付き）では EMF として解釈されないため、標準出力へそのまま書く
+        sys.stdout.write(json.dumps(doc, ensure_ascii=False, default=str) + "\n")
+        sys.stdout.flush()
+
+
+def current() -> Metrics:
+    """実行中の呼び出しのメトリクス。呼び出しの外では即時に1行出力する使い捨てのものを返す"""
+    m = _CURRENT.get()
+    return m if m is not None else _Standalone()
+
+
+class _Standalone(Metrics):
+    def __init__(self):
+        super().__init__("standalone")
+
+    def put(self, name: str, value: float, unit: str = "Milliseconds") -> None:
+        super().put(name, value, unit)
+        self.flush()
+
+    def add(self, name: str, value: float, unit: str = "Count") -> None:
+        super().add(name, value, unit)
+        self.flush()
+
+
+def timer(name: str):
+    return current().timer(name)
+
+
+def put(name: str, value: float, unit: str = "Milliseconds") -> None:
+    current().put(name, value, unit)
+
+
+def add(name: str, value: float, unit: str = "Count") -> None:
+    current().add(name, value, unit)
+
+
+def set_property(key: str, value: Any) -> None:
+    current().set_property(key, value)
+
+
+def usage(u: Optional[Dict[str, Any]], prefix: str = "") -> None:
+    """converse 応答の usage（inputTokens / outputTokens / totalTokens、プロンプトキャッシュの読み書き）を記録する"""
+    if not isinstance(u, dict):
+        return
+    m = current()
+    for key, name in (("inputTokens", "InputTokens"), ("outputTokens", "OutputTokens"), ("totalTokens", "TotalTokens"),
+                      ("cacheReadInputTokens", "CacheReadTokens"), ("cacheWriteInputTokens", "CacheWriteTokens")):
+        if isinstance(u.get(key), (int, float)):
+            m.add(f"{prefix}{name}", u[key])
+
+
+def timed(name: str) -> Callable:
+    """関数の所要時間を name（ミリ秒）として記録するデコレーター"""
+    def deco(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timer(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+
+def bind(fn: Callable) -> Callable:
+    """スレッドプールへ渡す関数を、呼び出し元と同じメトリクスに記録させる"""
+    m = _CURRENT.get()
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        token = _CURRENT.set(m)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _CURRENT.reset(token)
+    return wrapper
+
+
+def _body_bytes(message: Any) -> Optional[int]:
+    """API Gateway 形式の要求・応答の本文のバイト数（isBase64Encoded なら base64 を戻した大きさ）"""
+    body = message.get("body") if isinstance(message, dict) else None
+    if not isinstance(body, str):
+        return None
+    if message.get("isBase64Encoded"):
+        return len(body) * 3 // 4 - (len(body) - len(body.rstrip("=")))
+    return len(body.encode("utf-8"))
+
+
+def _claim_cold_start() -> bool:
+    global _COLD_START
+    with _COLD_LOCK:
+        cold, _COLD_START = _COLD_START, False
+    return cold
+
+
+@contextmanager
+def invocation(handler: str, event: Any = None, context: Any = None):
+    """1呼び出し分の計測範囲。終了時に Duration・ColdStart・Errors を加えて EMF を1行出力する"""
+    m = Metrics(handler)
+    token = _CURRENT.set(m)
+    cold = _claim_cold_start()
+    m.put("ColdStart", 1 if cold else 0, "Count")
+    if cold:
+        m.put("SinceImportMs", round((time.time() - _LOADED_AT) * 1000, 3))
+    request_id = getattr(context, "aws_request_id", None)
+    if request_id:
+        m.set_property("RequestId", request_id)
+    if isinstance(event, dict) and event.get("httpMethod"):
+        m.set_property("Endpoint", f'{event["httpMethod"]} {event.get("resource") or event.get("path") or "/"}')
+    size = _body_bytes(event)
+    if size is not None:
+        m.put("RequestBytes", size, "Bytes")
+    profiler = _SlowProfiler(threading.get_ident()) if PROFILE_SLOW_MS > 0 else None
+    started = time.perf_counter()
+    try:
+        yield m
+    except BaseException:
+        m.failed = True
+        raise
+    finally:
+        duration = (time.perf_counter() - started) * 1000
+        m.put("Duration", round(duration, 3))
+        m.put("Errors", 1 if m.failed else 0, "Count")
+        if profiler is not None:
+            profiler.stop(m, duration)
+        m.flush()
+        _CURRENT.reset(token)
+
+
+def instrument(handler: str) -> Callable:
+    """Lambda ハンドラ用デコレーター。応答の statusCode と本文のバイト数も記録する（5xx はエラー扱い）"""
+    def deco(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(event, context, *args, **kwargs):
+            with invocation(handler, event, context) as m:
+                result = fn(event, context, *args, **kwargs)
+                m.record_response(result)
+                return result
+        return wrapper
+    return deco
+
+
+class _SlowProfiler:
+    """PROFILE_SLOW_MS を超えた呼び出しだけ、対象スレッドのスタックを PROFILE_INTERVAL_MS 間隔で標本化する"""
+
+    def __init__(self, thread_id: int):
+        self.thread_id = thread_id
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        # 閾値までは何もしない（速い呼び出しには標本化のコストがかからない）
+        if self._stop.wait(PROFILE_SLOW_MS / 1000):
+            return
+        interval = PROFILE_INTERVAL_MS / 1000
+        while not self._stop.wait(interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None and len(stack) < 8:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def stop(self, m: Metrics, duration_ms: float) -> None:
+        self._stop.set()
+        self._thread.join(timeout=1)
+        if duration_ms < PROFILE_SLOW_MS or not self.samples:
+            return
+        m.put("ProfileSamples", sum(self.samples.values()), "Count")
+        sys.stdout.write(json.dumps({
+            "type": "profile",
+            "Service": METRICS_SERVICE,
+            "Handler": m.handler,
+            "durationMs": round(duration_ms, 3),
+            "intervalMs": PROFILE_INTERVAL_MS,
+            "top": [{"stack": s, "samples": n} for s, n in self.samples.most_common(PROFILE_TOP)],
+        }, ensure_ascii=False) + "\n")
@@ -0,0 +1,109 @@
+# 問題生成結果のキャッシュと同一リクエストの合流（single-flight、プロセス内）
+#
+# 同じ教材・対象・難易度・問題数での再実行（授業のやり直しなど）は結果を使い回す。
+# 生成中に同じキーの要求が来た場合は新たにモデルを呼ばず、先行する生成の完了を待って同じ結果を返す。
+# コンテナをまたぐ合流は index.py のジョブストアの結果レコード（S3 なら results/<key>.json）で行う。
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+QUIZ_CACHE_TTL_SEC = int(os.getenv("QUIZ_CACHE_TTL_SEC", str(24 * 3600)))
+QUIZ_CACHE_MAX_ITEMS = int(os.getenv("QUIZ_CACHE_MAX_ITEMS", "128"))
+
+
+def quiz_key(document: Any, target: Any, difficulty: Any, num_questions: Any, version: str = '') -> str:
+    """教材の内容ハッシュ + 生成パラメータ + 生成器の版 からキーを作る"""
+    raw = json.dumps([document, target, difficulty, num_questions, version], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class _Flight:
+    """生成中の1件。完了すると待機中の要求をまとめて起こす"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class QuizCache:
+    """TTL 付き LRU + single-flight。hit/miss/coalesced はコンテナ寿命の累計"""
+
+    def __init__(self, max_items: int = QUIZ_CACHE_MAX_ITEMS, ttl_sec: float = QUIZ_CACHE_TTL_SEC):
+        self.max_items = max_items
+        self.ttl_sec = ttl_sec
+        self._items: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()  # key -> (expires_at, value)
+        self._flights: Dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+        self.counts = {'hit': 0, 'miss': 0, 'coalesced': 0}
+
+    def get(self, key: str) -> Any:
+        with self._lock:
+            return self._get_locked(key)
+
+    def put(self, key: str, value: Any) -> None:
+        if self.max_items <= 0 or self.ttl_sec <= 0:
+            return
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = (time.time() + self.ttl_sec, value)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def get_or_compute(self, key: str, compute: Callable[[], Any], cacheable: Optional[Callable[[Any], bool]] = None,
+                       timeout: Optional[float] = None) -> Tuple[Any, str]:
+        """キャッシュがあれば返し、なければ compute() を1回だけ実行する。(value, 'hit'|'miss'|'coalesced') を返す
+
+        cacheable(value) が False の結果は待機中の要求には渡すが保存しない。
+        compute() が例外を投げた場合は待機中の要求にも同じ例外を投げる。
+        """
+        with self._lock:
+            value = self._get_locked(key)
+            if value is not None:
+                self.counts['hit'] += 1
+                return value, 'hit'
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            self.counts['miss' if leader else 'coalesced'] += 1
+
+        if not leader:
+            if not flight.done.wait(timeout):
+                raise TimeoutError(f'quiz generation for {key[:12]} did not finish in {timeout}s')
+            if flight.error is not None:
+                raise flight.error
+            return flight.value, 'coalesced'
+
+        try:
+            flight.value = compute()
+            if flight.value is not None and (cacheable is None or cacheable(flight.value)):
+                self.put(key, flight.value)
+            return flight.value, 'miss'
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.counts, size=len(self._items), inFlight=len(self._flights))
+
+    def _get_locked(self, key: str) -> Any:
+        item = self._items.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at < time.time():
+            del self._items[key]
+            return None
+        self._items.move_to_end(key)
+        return value
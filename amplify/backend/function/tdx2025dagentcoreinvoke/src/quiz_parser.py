@@ -0,0 +1,273 @@
+# モデルが出力した小テスト JSON の解析・修復・検証
+#
+# - strip_fence: ```json ... ``` のコードフェンスと JSON の前の説明文を除く
+# - repair_json: maxTokens で途中切れした JSON を、最後に完結した要素までで閉じる
+# - validate_question: Question スキーマで1問ずつ検証し、キー名の揺れ（title / options / correctAnswer など）を揃える
+# - QuestionStream: テキスト断片を受け取り、閉じた問題から順に返す（ストリーミング応答用）
+# - parse_quiz: 上記をまとめ、有効な問題・無効な問題・修復の有無を返す
+# - select: 問題構成（四択3＋穴埋め2 など）に合わせて問題を選び、不足分を返す（不足分だけ再生成する）
+#
+# Question: {"type": "mcq|cloze", "question": str, "choices"?: str[], "answer": str, "explanation": str, "sourceText": str}
+#
+# process 関数（tdx2025dlambdaamplify02）にも同じ処理がある（変更時は両方を揃えること）。
+
+import json
+import re
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+Layout = Sequence[Tuple[str, int]]
+
+QUESTION_TYPES = ('mcq', 'cloze')
+TYPE_LABELS = {'mcq': '四択', 'cloze': '穴埋め'}
+
+# 正規化後のキー → モデルが使いがちな別名（先にあるものを優先）
+_ALIASES = (
+    ('question', ('question', 'title')),
+    ('choices', ('choices', 'options')),
+    ('answer', ('answer', 'correctAnswer')),
+    ('explanation', ('explanation', 'reason')),
+    ('sourceText', ('sourceText', 'source')),
+)
+_REQUIRED_TEXT = ('question', 'answer', 'explanation', 'sourceText')
+_FENCE = re.compile(r'```[A-Za-z]*[ \t]*\n?(.*?)(?:```|$)', re.S)
+_CHOICE_LABEL = re.compile(r'^\s*[(（]?([A-Da-dＡ-Ｄア-エ1-4１-４])[)）.．:：]?\s*$')
+_decoder = json.JSONDecoder()
+
+
+def strip_fence(text: Any) -> Any:
+    """コードフェンスの中身を取り出し、最初の { か [ から始まる文字列にする"""
+    if not isinstance(text, str):
+        return text
+    if '```' in text:
+        m = _FENCE.search(text)
+        if m:
+            text = m.group(1)
+    starts = [i for i in (text.find('{'), text.find('[')) if i >= 0]
+    return text[min(starts):] if starts else text.strip()
+
+
+class QuestionStream:
+    """テキスト断片を順に受け取り、問題配列の要素が閉じたものから検証して返す
+
+    問題配列は {"questions": [...]} の値、またはトップレベルの配列。
+    文字列・括弧の状態を保持するので、断片の境界が文字列やオブジェクトの途中でもよい。
+    """
+
+    def __init__(self):
+        self.text = ''
+        self.questions: List[Dict[str, Any]] = []  # 検証を通った問題（正規化済み）
+        self.invalid: List[Dict[str, Any]] = []    # 検証で落ちた問題 {'index', 'error'}
+        self.done = False    # トップレベルの値が閉じた
+        self._pos = 0
+        self._started = False
+        self._stack: List[str] = []
+        self._in_str = False
+        self._escape = False
+        self._array: Optional[int] = None   # 問題配列の深さ
+        self._start: Optional[int] = None   # 読み取り中の問題の開始位置
+        self._safe: Optional[Tuple[int, int]] = None  # (位置, 深さ): 最後に完結した要素の直後
+        self._count = 0
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        """断片を追加し、新たに閉じて検証を通った問題のリストを返す"""
+        self.text += chunk
+        text = self.text
+        new = []
+        for i in range(self._pos, len(text)):
+            if self.done:
+                break
+            c = text[i]
+            if self._in_str:
+                if self._escape:
+                    self._escape = False
+                elif c == '\\':
+                    self._escape = True
+                elif c == '"':
+                    self._in_str = False
+                continue
+            if not self._started:
+                if c not in '{[':
+                    continue
+                self._started = True
+            if c == '"':
+                self._in_str = True
+            elif c in '{[':
+                if c == '{' and self._array is not None and len(self._stack) == self._array:
+                    self._start = i
+                self._stack.append(c)
+                if c == '[' and self._array is None and self._stack in (['['], ['{', '[']):
+                    self._array = len(self._stack)
+                self._safe = (i + 1, len(self._stack))
+            elif c in '}]':
+                if not self._stack:
+                    self.done = True
+                    break
+                self._stack.pop()
+                if c == '}' and self._start is not None and len(self._stack) == self._array:
+                    q = self._take(text[self._start:i + 1])
+                    if q is not None:
+                        new.append(q)
+                    self._start = None
+                self._safe = (i + 1, len(self._stack))
+                if not self._stack:
+                    self.done = True
+            elif c == ',':
+                self._safe = (i, len(self._stack))
+        self._pos = len(text)
+        return new
+
+    def _take(self, raw: str) -> Optional[Dict[str, Any]]:
+        index = self._count
+        self._count += 1
+        try:
+            q = json.loads(raw)
+        except ValueError as e:
+            self.invalid.append({'index': index, 'error': f'invalid json: {e}'})
+            return None
+        q, error = validate_question(q)
+        if error:
+            self.invalid.append({'index': index, 'error': error})
+            return None
+        self.questions.append(q)
+        return q
+
+    @property
+    def truncated(self) -> bool:
+        """最後の問題が閉じないまま入力が終わったか"""
+        return self._start is not None
+
+    def repaired(self) -> str:
+        """最後に完結した要素までで切り、開いている括弧を閉じた JSON 文字列"""
+        if self._safe is None:
+            return ''
+        pos, depth = self._safe
+        closers = ''.join('}' if c == '{' else ']' for c in reversed(self._stack[:depth]))
+        return self.text[:pos] + closers
+
+
+def repair_json(text: str) -> str:
+    """途中切れの JSON を、最後に完結した要素までで閉じる（閉じた JSON はそのまま）"""
+    stream = QuestionStream()
+    stream.feed(strip_fence(text))
+    if stream.done:
+        return stream.text[:stream._safe[0]]
+    return stream.repaired()
+
+
+def validate_question(q: Any) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """1問を正規化して検証する。(問題, None) または (None, 理由) を返す"""
+    if not isinstance(q, dict):
+        return None, 'not an object'
+    out: Dict[str, Any] = {}
+    for key, names in _ALIASES:
+        for name in names:
+            value = q.get(name)
+            if value is not None and value != '':
+                out[key] = value
+                break
+    for key in _REQUIRED_TEXT:
+        if isinstance(out.get(key), (int, float)) and not isinstance(out.get(key), bool):
+            out[key] = str(out[key])
+    choices = out.get('choices')
+    qtype = str(q.get('type') or '').strip().lower()
+    if not qtype:
+        qtype = 'mcq' if choices else 'cloze'
+    if qtype not in QUESTION_TYPES:
+        return None, f'unknown type: {qtype}'
+    for key in _REQUIRED_TEXT:
+        if not isinstance(out.get(key), str) or not out[key].strip():
+            return None, f'missing {key}'
+    if qtype == 'mcq':
+        if not isinstance(choices, list) or len(choices) < 2:
+            return None, 'mcq needs at least 2 choices'
+        choices = [str(c).strip() for c in choices]
+        if not all(choices):
+            return None, 'empty choice'
+        out['choices'] = choices
+        out['answer'] = _resolve_answer(out['answer'], choices)
+    elif choices is not None and not isinstance(choices, list):
+        del out['choices']
+    return dict(type=qtype, **out), None
+
+
+def _resolve_answer(answer: str, choices: List[str]) -> str:
+    """「B」「2」などの記号・番号で答えた場合は選択肢の本文に置き換える"""
+    answer = answer.strip()
+    if answer in choices:
+        return answer
+    m = _CHOICE_LABEL.match(answer)
+    if m:
+        label = m.group(1)
+        for labels in ('ABCD', 'abcd', 'ＡＢＣＤ', 'アイウエ', '1234', '１２３４'):
+            idx = labels.find(label)
+            if 0 <= idx < len(choices):
+                return choices[idx]
+    return answer
+
+
+def parse_quiz(value: Any) -> Dict[str, Any]:
+    """モデル出力（文字列、または解析済みの dict / list）から問題を取り出して検証する
+
+    {'questions': [...], 'invalid': [...], 'status': 'ok' | 'repaired' | 'unparsed', 'truncated': bool} を返す。
+    途中切れで閉じなかった最後の問題は invalid ではなく truncated として扱う。
+    """
+    status = 'ok'
+    truncated = False
+    data = value
+    if isinstance(value, dict) and isinstance(value.get('result'), str) and not isinstance(value.get('questions'), list):
+        data = value['result']
+    if isinstance(data, str):
+        body = strip_fence(data)
+        try:
+            data, _ = _decoder.raw_decode(body)
+        except ValueError:
+            stream = QuestionStream()
+            stream.feed(body)
+            truncated = stream.truncated
+            try:
+                data = json.loads(stream.repaired())
+                status = 'repaired'
+            except ValueError:
+                data, status = None, 'unparsed'
+            if status == 'repaired' and truncated:
+                # 修復で残った最後の問題は閉じていない（項目が欠けている）ので除く
+                items = data if isinstance(data, list) else data.get('questions') if isinstance(data, dict) else None
+                if isinstance(items, list) and items:
+                    items.pop()
+    items = data if isinstance(data, list) else data.get('questions') if isinstance(data, dict) else None
+    if not isinstance(items, list):
+        return {'questions': [], 'invalid': [], 'status': 'unparsed', 'truncated': truncated}
+    questions = []
+    invalid = []
+    for index, item in enumerate(items):
+        q, error = validate_question(item)
+        if error:
+            invalid.append({'index': index, 'error': error})
+        else:
+            questions.append(q)
+    return {'questions': questions, 'invalid': invalid, 'status': status, 'truncated': truncated}
+
+
+def select(questions: List[Dict[str, Any]], layout: Layout) -> Tuple[List[Dict[str, Any]], Tuple[Tuple[str, int], ...]]:
+    """layout（(種類, 問題数) の並び）に合わせて先頭から問題を選ぶ。(選んだ問題, 不足分の layout) を返す
+
+    問題文が重複するものは除く。
+    """
+    want = dict(layout)
+    picked = []
+    seen = set()
+    for q in questions:
+        text = q['question'].strip()
+        if want.get(q['type'], 0) <= 0 or text in seen:
+            continue
+        want[q['type']] -= 1
+        seen.add(text)
+        picked.append(q)
+    missing = tuple((t, want[t]) for t, _ in layout if want[t] > 0)
+    return picked, missing
+
+
+def describe(layout: Layout) -> str:
+    """layout を「5問（四択3＋穴埋め2）」の形で表す"""
+    total = sum(n for _, n in layout)
+    return f"{total}問（{'＋'.join(f'{TYPE_LABELS.get(t, t)}{n}' for t, n in layout)}）"
@@ -0,0 +1,257 @@
+# ジョブのスケジューリング（ワーカーへの受け渡し）
+#
+# - lambda: 自関数を InvocationType=Event で非同期起動（従来方式）
+# - sqs   : SQS にメッセージを送り、イベントソースマッピング経由でワーカーを起動
+#           （同時実行数は MaximumConcurrency、再試行は可視性タイムアウト、DLQ は redrive policy で制御）
+# - local : SQLite（既定 :memory:）を SQS 互換のキューとして使い、プロセス内のスレッドで実行（ローカル検証用）
+
+import json
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger()
+
+JOB_SCHEDULER = os.getenv("JOB_SCHEDULER", "lambda").lower()  # lambda | sqs | local
+JOB_QUEUE_URL = os.getenv("JOB_QUEUE_URL", "")
+# 再試行を使い切ったワーカーの届け先（SQS の redrive 先 DLQ。lambda モードの非同期起動の OnFailure 送信先にもする）
+JOB_DEAD_LETTER_ARN = os.getenv("JOB_DEAD_LETTER_ARN", "")
+SQS_MAX_DELAY_SEC = 900
+JOB_QUEUE_SQLITE = os.getenv("JOB_QUEUE_SQLITE", ":memory:")
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "4"))
+VISIBILITY_TIMEOUT_SEC = float(os.getenv("VISIBILITY_TIMEOUT_SEC", "900"))
+MAX_RECEIVE_COUNT = int(os.getenv("MAX_RECEIVE_COUNT", "3"))
+TENANT_RATE_PER_SEC = float(os.getenv("TENANT_RATE_PER_SEC", "0"))  # 0 で無制限
+TENANT_BURST = float(os.getenv("TENANT_BURST", "5"))
+
+Message = Dict[str, Any]
+
+
+class RetryLater(Exception):
+    """今は実行できない。retry_after 秒後に再配信する。
+
+    SQS では DelaySeconds 付きの新しいメッセージとして送り直して元のメッセージは消す（ApproximateReceiveCount を
+    増やさないため、何度スロットリングされても DLQ へは移らない）。ローカルキューは受信回数を戻して再配信する。
+    lambda モードでは Lambda の非同期リトライ（既定 2 回）に任せるので、使い切ると OnFailure の送信先へ移る。
+    """
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Throttled(RetryLater):
+    """テナントのレート上限に達した"""
+
+    def __init__(self, tenant: str, retry_after: float):
+        super().__init__(f"tenant {tenant} is rate limited", retry_after)
+        self.tenant = tenant
+
+
+class RateLimiter:
+    """テナントごとのトークンバケット（プロセス内）"""
+
+    def __init__(self, rate_per_sec: float = TENANT_RATE_PER_SEC, burst: float = TENANT_BURST):
+        self.rate = rate_per_sec
+        self.burst = max(1.0, burst)
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def try_acquire(self, tenant: str) -> Tuple[bool, float]:
+        if self.rate <= 0:
+            return True, 0.0
+        now = time.monotonic()
+        with self._lock:
+            tokens, at = self._buckets.get(tenant, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - at) * self.rate)
+            if tokens >= 1.0:
+                self._buckets[tenant] = (tokens - 1.0, now)
+                return True, 0.0
+            self._buckets[tenant] = (tokens, now)
+            return False, (1.0 - tokens) / self.rate
+
+
+class LambdaScheduler:
+    def __init__(self, client_factory: Callable[[str], Any], function_name: str):
+        self._client = client_factory
+        self.function_name = function_name
+
+    def submit(self, message: Message) -> None:
+        self._client('lambda').invoke(
+            FunctionName=self.function_name,
+            InvocationType='Event',
+            Payload=json.dumps(message).encode('utf-8')
+        )
+
+
+class SqsScheduler:
+    def __init__(self, client_factory: Callable[[str], Any], queue_url: str):
+        self._client = client_factory
+        self.queue_url = queue_url
+
+    def submit(self, message: Message) -> None:
+        self._client('sqs').send_message(QueueUrl=self.queue_url, MessageBody=json.dumps(message))
+
+
+def handle_sqs_records(records: List[Dict[str, Any]], run_message: Callable[[Message, str], Any],
+                       client_factory: Callable[[str], Any], queue_url: str = JOB_QUEUE_URL) -> Dict[str, Any]:
+    """SQS イベントを処理し、失敗したメッセージを batchItemFailures として返す（部分バッチ応答）
+
+    run_message には messageId を配信 ID として渡す（再配信でも変わらない）。
+    """
+    failures = []
+    for record in records:
+        message_id = record.get("messageId")
+        try:
+            run_message(json.loads(record.get("body") or "{}"), message_id)
+        except RetryLater as t:
+            # レート超過・リース中は受信回数に数えないよう、遅延付きで送り直して元のメッセージは成功扱いにする
+            if queue_url:
+                try:
+                    client_factory('sqs').send_message(QueueUrl=queue_url, MessageBody=record.get("body") or "{}",
+                                                       DelaySeconds=min(SQS_MAX_DELAY_SEC, max(1, math.ceil(t.retry_after))))
+                    continue
+                except Exception:
+                    logger.exception("sqs re-enqueue failed: %s", message_id)
+            # 送り直せなければ可視性タイムアウトを retry_after に合わせて再配信させる（受信回数には数えられる）
+            failures.append({"itemIdentifier": message_id})
+            if queue_url and record.get("receiptHandle"):
+                try:
+                    client_factory('sqs').change_message_visibility(
+                        QueueUrl=queue_url,
+                        ReceiptHandle=record["receiptHandle"],
+                        VisibilityTimeout=max(1, math.ceil(t.retry_after))
+                    )
+                except Exception:
+                    logger.exception("change_message_visibility failed")
+        except Exception:
+            logger.exception("sqs message failed: %s", message_id)
+            failures.append({"itemIdentifier": message_id})
+    return {"batchItemFailures": failures}
+
+
+class LocalQueueScheduler:
+    """SQLite を SQS 互換キューとして使うローカル実装。
+
+    受信時に visible_at を可視性タイムアウト分先へ進め、ack されなければ再び受信可能になる。
+    受信回数が max_receive_count を超えたメッセージは dead_letters へ移し、on_dead_letter を呼ぶ。
+    """
+
+    def __init__(self, run_message: Callable[[Message, str], Any], path: str = JOB_QUEUE_SQLITE,
+                 concurrency: int = WORKER_CONCURRENCY, visibility_timeout: float = VISIBILITY_TIMEOUT_SEC,
+                 max_receive_count: int = MAX_RECEIVE_COUNT, retry_delay: float = 1.0,
+                 on_dead_letter: Optional[Callable[[Message, str], Any]] = None):
+        self.run_message = run_message
+        self.on_dead_letter = on_dead_letter
+        self.concurrency = max(1, concurrency)
+        self.visibility_timeout = visibility_timeout
+        self.max_receive_count = max_receive_count
+        self.retry_delay = retry_delay
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("CREATE TABLE IF NOT EXISTS messages (id INTEGER PRIMARY KEY AUTOINCREMENT, body TEXT NOT NULL, "
+                         "visible_at REAL NOT NULL, receive_count INTEGER NOT NULL DEFAULT 0)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS dead_letters (id INTEGER PRIMARY KEY, body TEXT NOT NULL, "
+                         "error TEXT, failed_at REAL NOT NULL)")
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition()
+        self._busy = 0
+        self._threads: List[threading.Thread] = []
+        self._stopped = False
+
+    def submit(self, message: Message) -> None:
+        with self._lock:
+            self._db.execute("INSERT INTO messages (body, visible_at) VALUES (?, ?)", (json.dumps(message), time.time()))
+        self._ensure_workers()
+        with self._wakeup:
+            self._wakeup.notify()
+
+    def receive(self) -> Optional[Tuple[int, Message, int]]:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT id, body, receive_count FROM messages WHERE visible_at <= ? "
+                                   "ORDER BY visible_at, id LIMIT 1", (now,)).fetchone()
+            if row is None:
+                return None
+            self._db.execute("UPDATE messages SET visible_at = ?, receive_count = receive_count + 1 WHERE id = ?",
+                             (now + self.visibility_timeout, row[0]))
+        return row[0], json.loads(row[1]), row[2] + 1
+
+    def ack(self, msg_id: int) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM messages WHERE id = ?", (msg_id,))
+
+    def retry(self, msg_id: int, delay: float, count: bool = True) -> None:
+        with self._lock:
+            if count:
+                self._db.execute("UPDATE messages SET visible_at = ? WHERE id = ?", (time.time() + delay, msg_id))
+            else:
+                self._db.execute("UPDATE messages SET visible_at = ?, receive_count = receive_count - 1 WHERE id = ?",
+                                 (time.time() + delay, msg_id))
+
+    def dead_letter(self, msg_id: int, body: Message, error: str) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM messages WHERE id = ?", (msg_id,))
+            self._db.execute("INSERT INTO dead_letters (id, body, error, failed_at) VALUES (?, ?, ?, ?)",
+                             (msg_id, json.dumps(body), error, time.time()))
+        if self.on_dead_letter is not None:
+            try:
+                self.on_dead_letter(body, error)
+            except Exception:
+                logger.exception("dead letter handler failed")
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            queued = self._db.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+            dead = self._db.execute("SELECT COUNT(*) FROM dead_letters").fetchone()[0]
+        return {"queued": queued, "inFlight": self._busy, "deadLetters": dead}
+
+    def drain(self, timeout: float = 30.0) -> bool:
+        """キューが空になるまで待つ（テスト・ベンチマーク用）"""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.stats()["queued"] == 0 and self._busy == 0:
+                return True
+            time.sleep(0.01)
+        return False
+
+    def stop(self) -> None:
+        self._stopped = True
+        with self._wakeup:
+            self._wakeup.notify_all()
+
+    def _ensure_workers(self) -> None:
+        with self._lock:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            while len(self._threads) < self.concurrency:
+                t = threading.Thread(target=self._worker_loop, daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def _worker_loop(self) -> None:
+        while not self._stopped:
+            got = self.receive()
+            if got is None:
+                with self._wakeup:
+                    self._wakeup.wait(timeout=0.5)
+                continue
+            msg_id, body, receive_count = got
+            with self._lock:
+                self._busy += 1
+            try:
+                self.run_message(body, f"local-{msg_id}")
+                self.ack(msg_id)
+            except RetryLater as t:
+                self.retry(msg_id, t.retry_after, count=False)
+            except Exception as e:
+                logger.exception("local queue message failed")
+                if receive_count >= self.max_receive_count:
+                    self.dead_letter(msg_id, body, str(e))
+                else:
+                    self.retry(msg_id, self.retry_delay * (2 ** (receive_count - 1)))
+            finally:
+                with self._lock:
+                    self._busy -= 1
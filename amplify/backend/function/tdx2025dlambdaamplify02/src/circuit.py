@@ -0,0 +1,112 @@
+"""AgentCore 呼び出しのサーキットブレーカー
+
+直近 CB_WINDOW_SEC 秒の呼び出し結果（成否・所要時間）を保持し、
+失敗率（エラーまたは CB_SLOW_CALL_SEC 超の遅延）が閾値を超えたら一定時間 open にして呼び出しを省略する。
+open 期間が過ぎると half-open で1件だけ試し、成功すれば closed に戻す。
+"""
+import os
+import threading
+import time
+from collections import deque
+
+CB_WINDOW_SEC = float(os.environ.get('CB_WINDOW_SEC', '60'))
+CB_MIN_CALLS = int(os.environ.get('CB_MIN_CALLS', '5'))
+CB_FAILURE_RATE = float(os.environ.get('CB_FAILURE_RATE', '0.5'))
+CB_SLOW_CALL_SEC = float(os.environ.get('CB_SLOW_CALL_SEC', '30'))
+CB_OPEN_SEC = float(os.environ.get('CB_OPEN_SEC', '30'))
+CB_MAX_SAMPLES = int(os.environ.get('CB_MAX_SAMPLES', '200'))
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """プロセス内（ウォームコンテナ単位）のブレーカー"""
+
+    def __init__(self, name, window_sec=CB_WINDOW_SEC, min_calls=CB_MIN_CALLS, failure_rate=CB_FAILURE_RATE,
+                 slow_call_sec=CB_SLOW_CALL_SEC, open_sec=CB_OPEN_SEC, max_samples=CB_MAX_SAMPLES):
+        self.name = name
+        self.window_sec = window_sec
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_sec = slow_call_sec
+        self.open_sec = open_sec
+        self._samples = deque(maxlen=max_samples)  # (at, ok, latency_sec)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """呼び出してよいか。open 中は False、half-open では試行を1件だけ通す"""
+        with self._lock:
+            if self._state == OPEN:
+                if time.time() - self._opened_at < self.open_sec:
+                    return False
+                self._state = HALF_OPEN
+                self._probing = False
+            if self._state == HALF_OPEN:
+                if self._probing:
+                    return False
+                self._probing = True
+            return True
+
+    def record(self, ok, latency_sec):
+        """呼び出し結果を記録し、必要なら状態を切り替える"""
+        now = time.time()
+        failed = (not ok) or latency_sec > self.slow_call_sec
+        with self._lock:
+            self._samples.append((now, not failed, latency_sec))
+            if self._state == HALF_OPEN:
+                self._probing = False
+                if failed:
+                    self._trip(now)
+                else:
+                    self._state = CLOSED
+                    self._samples.clear()
+                    self._samples.append((now, True, latency_sec))
+                return
+            calls, failures = self._window_counts(now)
+            if self._state == CLOSED and calls >= self.min_calls and failures / calls >= self.failure_rate:
+                self._trip(now)
+
+    def p95(self):
+        """ウィンドウ内の成功呼び出しの p95 所要時間（秒）。サンプルがなければ None"""
+        with self._lock:
+            cutoff = time.time() - self.window_sec
+            latencies = sorted(lat for at, ok, lat in self._samples if at >= cutoff and ok)
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+
+    def snapshot(self):
+        """レスポンスのメタデータ用"""
+        p95 = self.p95()
+        with self._lock:
+            calls, failures = self._window_counts(time.time())
+            state = self._state
+            if state == OPEN and time.time() - self._opened_at >= self.open_sec:
+                state = HALF_OPEN
+        return {
+            'name': self.name,
+            'state': state,
+            'calls': calls,
+            'failures': failures,
+            'p95Sec': round(p95, 3) if p95 is not None else None,
+        }
+
+    def _trip(self, now):
+        self._state = OPEN
+        self._opened_at = now
+        print(f'Circuit {self.name} opened')
+
+    def _window_counts(self, now):
+        cutoff = now - self.window_sec
+        calls = failures = 0
+        for at, ok, _ in self._samples:
+            if at >= cutoff:
+                calls += 1
+                if not ok:
+                    failures += 1
+        return calls, failures
@@ -0,0 +1,76 @@
+"""boto3 クライアントの遅延生成と初期化時の事前準備
+
+boto3 の import とクライアント生成（サービス定義の読み込み）はコールドスタートの大半を占める。
+既定（INIT_MODE=lazy）では最初に使うときに生成し、構造化パラメータのない要求では
+AgentCore クライアントを作らない。
+
+初期化時間が利用者の待ち時間にならない環境（SnapStart のスナップショット作成、
+Provisioned Concurrency）や INIT_MODE=eager では、初期化中に prewarm() で
+クライアント生成と重いモジュールの import を済ませておく。
+"""
+import importlib
+import os
+import threading
+import time
+
+INIT_MODE = os.environ.get('INIT_MODE', '').lower()  # lazy | eager（未設定なら実行環境から判断）
+PREWARM_MODULES = ('PIL.Image', 'pypdf')
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def get_client(service):
+    """サービスごとのクライアントを1つだけ生成して使い回す"""
+    client = _clients.get(service)
+    if client is None:
+        with _lock:
+            client = _clients.get(service)
+            if client is None:
+                import boto3  # 初回のみ（import だけで数百ミリ秒かかる）
+                client = _clients[service] = boto3.client(service, region_name=os.environ.get('AWS_REGION'))
+    return client
+
+
+class LazyClient:
+    """属性に初めてアクセスしたときにクライアントを生成する代理オブジェクト"""
+
+    def __init__(self, service):
+        self._service = service
+
+    def __getattr__(self, name):
+        return getattr(get_client(self._service), name)
+
+
+def eager_init():
+    """初期化時に prewarm() すべきか（INIT_MODE 未設定時は SnapStart / Provisioned Concurrency で有効）"""
+    if INIT_MODE:
+        return INIT_MODE == 'eager'
+    return os.environ.get('AWS_LAMBDA_INITIALIZATION_TYPE') in ('snap-start', 'provisioned-concurrency')
+
+
+def prewarm(services=(), modules=PREWARM_MODULES):
+    """クライアント生成と任意依存の import を済ませ、各段階の所要時間（ミリ秒）を返す"""
+    timings = {}
+    for service in services:
+        t0 = time.perf_counter()
+        get_client(service)
+        timings[service] = round((time.perf_counter() - t0) * 1000, 2)
+    for name in modules:
+        t0 = time.perf_counter()
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            continue
+        timings[name] = round((time.perf_counter() - t0) * 1000, 2)
+    return timings
+
+
+def register_before_snapshot(fn):
+    """SnapStart のスナップショット作成前フック（snapshot_restore_py がある実行環境のみ）"""
+    try:
+        from snapshot_restore_py import register_before_snapshot as register
+    except ImportError:
+        return False
+    register(fn)
+    return True
@@ -0,0 +1,233 @@
+# アップロード直後の先行抽出（S3 ObjectCreated → 抽出）の結果と進行状況
+#
+# presign で発行した uploads/ へのアップロードが完了すると、S3 イベントで process 関数が起動する。
+# 利用者が「生成」を押す前に抽出（画像の前処理・PDF のページ並列抽出を含む）を済ませ、
+# 結果を bucket / key / ETag ごとのレコードに置く。process 関数の lambda_handler とジョブ関数のワーカーは、
+# 抽出済みならそれを使い、抽出中なら完了を待って合流する（待ちきれなければ従来どおり自分で抽出する）。
+#
+# レコード: {"status": "pending|ready|failed", "bucket", "key", "etag", "version", "text"?, "meta"?, "error"?,
+#           "startedAt", "updatedAt"}（時刻は epoch ミリ秒。version はモデルID と抽出の版）
+# - 永続層: EXTRACT_STORE_BUCKET（未設定なら OCR_CACHE_BUCKET）の EXTRACT_STORE_PREFIX 配下、
+#   または EXTRACT_STORE_DIR のローカルディレクトリ（検証用）。どちらもなければ先行抽出は無効
+# - pending は If-None-Match の条件付き書き込みで1件だけ作る（同じオブジェクトへの重複イベントでは後発が何もしない）
+# - EAGER_STALE_SEC を過ぎても pending のままのレコードは、抽出していた関数が落ちたものとして引き継ぐ
+#
+# process 関数（tdx2025dlambdaamplify02）とジョブ関数（tdx2025dagentcoreinvoke）は個別にパッケージされるため、
+# 同じ内容のファイルを各 src に置いている（変更時は両方のコピーを揃えること）。
+
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+EXTRACT_STORE_BUCKET = os.environ.get('EXTRACT_STORE_BUCKET') or os.environ.get('OCR_CACHE_BUCKET', '')
+EXTRACT_STORE_PREFIX = os.environ.get('EXTRACT_STORE_PREFIX', 'cache/extract/')
+EXTRACT_STORE_DIR = os.environ.get('EXTRACT_STORE_DIR', '')  # ローカル検証用（例: /tmp/extract-store）
+EXTRACT_STORE_TTL_SEC = int(os.environ.get('EXTRACT_STORE_TTL_SEC', str(24 * 3600)))
+# 抽出中のレコードを待つ上限（API Gateway の 29 秒制限の内側で、生成の時間を残す）
+EAGER_WAIT_SEC = float(os.environ.get('EAGER_WAIT_SEC', '10'))
+EAGER_STALE_SEC = float(os.environ.get('EAGER_STALE_SEC', '120'))
+EAGER_POLL_SEC = float(os.environ.get('EAGER_POLL_SEC', '0.2'))
+UPLOAD_PREFIX = os.environ.get('UPLOAD_PREFIX', 'uploads/')
+
+
+def record_id(bucket: str, key: str, etag: Optional[str]) -> str:
+    """bucket / key / ETag からレコードのキーを作る（上書きされたオブジェクトは別レコードになる）"""
+    raw = json.dumps([bucket, key, str(etag or '').strip('"')])
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+class _S3Records:
+    def __init__(self, s3_client: Any, bucket: str, prefix: str):
+        self.s3 = s3_client
+        self.bucket = bucket
+        self.prefix = prefix if prefix.endswith('/') else prefix + '/'
+
+    def get(self, rid: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """(レコード, ETag)。無ければ (None, None)"""
+        try:
+            obj = self.s3.get_object(Bucket=self.bucket, Key=f'{self.prefix}{rid}.json')
+            return json.loads(obj['Body'].read()), obj.get('ETag')
+        except Exception as e:
+            if _error_code(e) not in ('NoSuchKey', '404'):
+                print(f'Extract store get failed: {str(e)}')
+            return None, None
+
+    def put(self, rid: str, record: Dict[str, Any], if_none_match: bool = False, if_match: Optional[str] = None) -> bool:
+        """書き込めれば True。条件（If-None-Match / If-Match）が満たされなければ False"""
+        args = {
+            'Bucket': self.bucket,
+            'Key': f'{self.prefix}{rid}.json',
+            'Body': json.dumps(record, ensure_ascii=False).encode('utf-8'),
+            'ContentType': 'application/json'
+        }
+        if if_none_match:
+            args['IfNoneMatch'] = '*'
+        if if_match:
+            args['IfMatch'] = if_match
+        try:
+            self.s3.put_object(**args)
+            return True
+        except Exception as e:
+            if _error_code(e) in ('PreconditionFailed', 'ConditionalRequestConflict', '412', '409'):
+                return False
+            raise
+
+
+class _FileRecords:
+    """S3 の代わりにローカルディレクトリへ保存する永続層（検証用。条件付き書き込みはプロセス内でのみ排他）"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, rid: str) -> str:
+        return os.path.join(self.directory, f'{rid}.json')
+
+    def get(self, rid: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        try:
+            with open(self._path(rid), 'rb') as f:
+                raw = f.read()
+        except OSError:
+            return None, None
+        try:
+            return json.loads(raw), hashlib.md5(raw).hexdigest()
+        except ValueError:
+            return None, None
+
+    def put(self, rid: str, record: Dict[str, Any], if_none_match: bool = False, if_match: Optional[str] = None) -> bool:
+        path = self._path(rid)
+        raw = json.dumps(record, ensure_ascii=False).encode('utf-8')
+        with self._lock:
+            if if_none_match:
+                try:
+                    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+                except FileExistsError:
+                    return False
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(raw)
+                return True
+            if if_match and self.get(rid)[1] != if_match:
+                return False
+            tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(raw)
+            os.replace(tmp, path)
+            return True
+
+
+def _error_code(e: Exception) -> str:
+    response = getattr(e, 'response', None) or {}
+    return str((response.get('Error') or {}).get('Code') or '')
+
+
+class ExtractStore:
+    """先行抽出のレコード。同じコンテナ内で抽出中のものは完了をイベントで受け取る（他コンテナはポーリング）"""
+
+    def __init__(self, s3_client: Any = None):
+        if EXTRACT_STORE_BUCKET and s3_client is not None:
+            self.records = _S3Records(s3_client, EXTRACT_STORE_BUCKET, EXTRACT_STORE_PREFIX)
+        elif EXTRACT_STORE_DIR:
+            self.records = _FileRecords(EXTRACT_STORE_DIR)
+        else:
+            self.records = None
+        self._local: Dict[str, threading.Event] = {}  # レコードのキー -> threading.Event（このコンテナで抽出中）
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.records is not None
+
+    def get(self, bucket: str, key: str, etag: Optional[str]) -> Optional[Dict[str, Any]]:
+        """レコードを返す（無い・期限切れなら None）"""
+        record, _ = self.records.get(record_id(bucket, key, etag))
+        if record is None or int(record.get('updatedAt') or 0) + EXTRACT_STORE_TTL_SEC * 1000 < _now_ms():
+            return None
+        return record
+
+    def begin(self, bucket: str, key: str, etag: Optional[str], version: str) -> bool:
+        """抽出の開始を記録する。他で抽出中・抽出済みなら False（呼び出し側は何もしない）"""
+        rid = record_id(bucket, key, etag)
+        now = _now_ms()
+        record = {'status': 'pending', 'bucket': bucket, 'key': key, 'etag': str(etag or '').strip('"'),
+                  'version': version, 'startedAt': now, 'updatedAt': now}
+        if not self.records.put(rid, record, if_none_match=True):
+            current, tag = self.records.get(rid)
+            if current is None or self._usable(current, version):
+                return False
+            # 失敗・期限切れ・版違い・止まった pending は引き継ぐ
+            if not self.records.put(rid, record, if_match=tag):
+                return False
+        with self._lock:
+            self._local[rid] = threading.Event()
+        return True
+
+    def finish(self, bucket: str, key: str, etag: Optional[str], version: str, text: str,
+               meta: Optional[Dict[str, Any]] = None) -> None:
+        self._close(bucket, key, etag, version, {'status': 'ready', 'text': text, 'meta': meta or {}})
+
+    def fail(self, bucket: str, key: str, etag: Optional[str], version: str, error: Any) -> None:
+        self._close(bucket, key, etag, version, {'status': 'failed', 'error': str(error)[:500]})
+
+    def wait(self, bucket: str, key: str, etag: Optional[str], version: Optional[str] = None,
+             timeout: float = EAGER_WAIT_SEC) -> Tuple[Optional[Dict[str, Any]], str]:
+        """抽出済みのレコードを返す。抽出中なら完了まで（最大 timeout 秒）待つ
+
+        (レコード, 'ready'|'joined') または (None, 'none'|'failed'|'stale'|'timeout') を返す。
+        version を渡すと版の違うレコードは使わない。
+        """
+        rid = record_id(bucket, key, etag)
+        deadline = time.monotonic() + timeout
+        interval = EAGER_POLL_SEC
+        joined = False
+        while True:
+            record = self.get(bucket, key, etag)
+            if record is None:
+                return None, 'none'
+            if version and record.get('version') != version:
+                return None, 'stale'
+            status = record.get('status')
+            if status == 'ready':
+                return record, 'joined' if joined else 'ready'
+            if status != 'pending':
+                return None, 'failed'
+            if _now_ms() - int(record.get('updatedAt') or 0) > EAGER_STALE_SEC * 1000:
+                return None, 'stale'
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None, 'timeout'
+            joined = True
+            event = self._local.get(rid)
+            if event is not None:
+                event.wait(remaining)
+            else:
+                time.sleep(min(interval, remaining))
+                interval = min(interval * 2, 0.5)
+
+    def _usable(self, record: Dict[str, Any], version: str) -> bool:
+        """そのまま使える（抽出済み）か、まだ抽出中とみなせるレコードか"""
+        if record.get('version') != version:
+            return False
+        age_ms = _now_ms() - int(record.get('updatedAt') or 0)
+        if record.get('status') == 'ready':
+            return age_ms < EXTRACT_STORE_TTL_SEC * 1000
+        return record.get('status') == 'pending' and age_ms <= EAGER_STALE_SEC * 1000
+
+    def _close(self, bucket: str, key: str, etag: Optional[str], version: str, fields: Dict[str, Any]) -> None:
+        rid = record_id(bucket, key, etag)
+        record = dict(fields, bucket=bucket, key=key, etag=str(etag or '').strip('"'), version=version,
+                      updatedAt=_now_ms())
+        try:
+            self.records.put(rid, record)
+        finally:
+            with self._lock:
+                event = self._local.pop(rid, None)
+            if event is not None:
+                event.set()
@@ -0,0 +1,99 @@
+"""抽出前の画像正規化（Pillow が使える場合のみ）
+
+スマホ写真（5〜12MB）をそのまま Bedrock に送ると、転送量・Lambda メモリ・入力トークンが膨らむ。
+デコード → EXIF 回転補正 → 長辺を IMAGE_MAX_EDGE 以下に縮小 → グレースケール化 → 再エンコード
+の順に処理し、元より小さくならなければ元のバイト列をそのまま使う。
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from io import BytesIO
+
+IMAGE_PREP_ENABLED = os.environ.get('IMAGE_PREP_ENABLED', '1') == '1'
+IMAGE_MAX_EDGE = int(os.environ.get('IMAGE_MAX_EDGE', '1568'))
+IMAGE_GRAYSCALE = os.environ.get('IMAGE_GRAYSCALE', '1') == '1'
+IMAGE_FORMAT = os.environ.get('IMAGE_FORMAT', 'jpeg').lower()  # jpeg | png
+IMAGE_JPEG_QUALITY = int(os.environ.get('IMAGE_JPEG_QUALITY', '85'))
+IMAGE_CACHE_MAX_ITEMS = int(os.environ.get('IMAGE_CACHE_MAX_ITEMS', '16'))
+
+_cache = OrderedDict()  # sha256 + 設定 -> (bytes, fmt, stats)
+_cache_lock = threading.Lock()
+
+
+def signature():
+    """抽出結果に影響する前処理設定（抽出キャッシュのキーに含める）"""
+    if not IMAGE_PREP_ENABLED:
+        return 'raw'
+    return f'edge{IMAGE_MAX_EDGE}-{"gray" if IMAGE_GRAYSCALE else "color"}-{IMAGE_FORMAT}-q{IMAGE_JPEG_QUALITY}'
+
+
+def _ms(t0):
+    return round((time.perf_counter() - t0) * 1000, 2)
+
+
+def prepare_image(data, fmt):
+    """(bytes, format, stats) を返す。Pillow が無い・無効化・失敗時は元のまま"""
+    stats = {'originalBytes': len(data), 'bytes': len(data), 'bytesSaved': 0, 'applied': False}
+    if not IMAGE_PREP_ENABLED:
+        return data, fmt, stats
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        return data, fmt, stats
+    
+    key = hashlib.sha256(data).hexdigest() + '|' + signature()
+    with _cache_lock:
+        hit = _cache.get(key)
+        if hit is not None:
+            _cache.move_to_end(key)
+            return hit[0], hit[1], dict(hit[2], cached=True)
+    
+    try:
+        t0 = time.perf_counter()
+        img = Image.open(BytesIO(data))
+        # JPEG は DCT 段階で縮小デコードできる（1/2, 1/4, 1/8）
+        img.draft('L' if IMAGE_GRAYSCALE else 'RGB', (IMAGE_MAX_EDGE, IMAGE_MAX_EDGE))
+        img.load()
+        stats['decodeMs'] = _ms(t0)
+        
+        t0 = time.perf_counter()
+        img = ImageOps.exif_transpose(img)
+        if max(img.size) > IMAGE_MAX_EDGE:
+            img.thumbnail((IMAGE_MAX_EDGE, IMAGE_MAX_EDGE), Image.LANCZOS)
+        stats['resizeMs'] = _ms(t0)
+        
+        t0 = time.perf_counter()
+        if IMAGE_GRAYSCALE:
+            img = img.convert('L')
+        elif img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+        stats['convertMs'] = _ms(t0)
+        
+        t0 = time.perf_counter()
+        out = BytesIO()
+        if IMAGE_FORMAT == 'png':
+            img.save(out, format='PNG', optimize=True)
+            out_fmt = 'png'
+        else:
+            img.save(out, format='JPEG', quality=IMAGE_JPEG_QUALITY, optimize=True)
+            out_fmt = 'jpeg'
+        stats['encodeMs'] = _ms(t0)
+        stats['size'] = list(img.size)
+    except Exception as e:
+        print(f'Image preprocessing skipped: {str(e)}')
+        return data, fmt, stats
+    
+    prepared = out.getvalue()
+    if len(prepared) < len(data):
+        stats.update(bytes=len(prepared), bytesSaved=len(data) - len(prepared), applied=True)
+        result = (prepared, out_fmt, stats)
+    else:
+        result = (data, fmt, stats)
+    
+    with _cache_lock:
+        _cache[key] = result
+        while len(_cache) > IMAGE_CACHE_MAX_ITEMS:
+            _cache.popitem(last=False)
+    return result
@@ -1,24 +1,113 @@
 import json
 import os
 import base64
+import random
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from io import BytesIO
+from urllib.parse import unquote_plus
 
-import boto3
 from botocore.exceptions import ClientError
 
-# AWS clients
-s3_client = boto3.client('s3', region_name=os.environ.get('AWS_REGION'))
-br_client = boto3.client('bedrock-runtime', region_name=os.environ.get('AWS_REGION'))
-agentcore_client = boto3.client('bedrock-agentcore', region_name=os.environ.get('AWS_REGION'))
+import clients
+import compression
+import image_prep
+import metrics
+import quiz_parser
+import text_budget
+from circuit import CircuitBreaker
+from extract_store import UPLOAD_PREFIX, ExtractStore
+from ocr_cache import OcrCache, cache_key, content_digest
+from pdf_pages import count_pages, split_pdf
+from quiz_cache import QuizCache, quiz_key
+from s3_fetch import UnsupportedObject, open_object
+
+# AWS clients（初回使用時に生成。INIT_MODE=eager / SnapStart / Provisioned Concurrency では初期化時に生成）
+AWS_SERVICES = ('s3', 'bedrock-runtime', 'bedrock-agentcore')
+s3_client = clients.LazyClient('s3')
+br_client = clients.LazyClient('bedrock-runtime')
+agentcore_client = clients.LazyClient('bedrock-agentcore')
 
 # Config
 MODEL_ID = os.environ.get('BEDROCK_MODEL_ID')
 AGENTCORE_RUNTIME_ARN = os.environ.get('AGENTCORE_RUNTIME_ARN', 
     'arn:aws:bedrock-agentcore:us-west-2:975050325676:runtime/agentcore_app5-hzJtlH2rgJ')
 
+# 抽出プロンプト（文言を変えたら版を上げてキャッシュを無効化する）
+EXTRACT_PROMPT = '以下の画像/文書から、日本語本文を段落保持で正確に抽出してください。'
+EXTRACT_PROMPT_VERSION = 'ocr-v1'
+# キャッシュキー用の版（画像前処理・maxTokens の設定が変われば抽出結果も変わり得る）
+EXTRACT_CACHE_VERSION = f'{EXTRACT_PROMPT_VERSION}|{image_prep.signature()}|tok{text_budget.OCR_TOKENS_PER_PAGE}'
+AGENTCORE_STREAM_CHUNK = int(os.environ.get('AGENTCORE_STREAM_CHUNK', '8192'))
+
+# 複数ページ PDF はページ範囲ごとに並列抽出する
+PDF_PAGES_PER_CHUNK = int(os.environ.get('PDF_PAGES_PER_CHUNK', '1'))
+PDF_MAX_WORKERS = int(os.environ.get('PDF_MAX_WORKERS', '4'))
+
+# 抽出結果キャッシュ（ウォームコンテナ間で共有）
+ocr_cache = OcrCache(s3_client=s3_client)
+# 先行抽出（uploads/ への S3 ObjectCreated イベントで、生成要求より先に抽出する）の結果と進行状況
+extract_store = ExtractStore(s3_client=s3_client)
+EXTRACT_VERSION = f'{MODEL_ID}|{EXTRACT_CACHE_VERSION}'
+# 先行抽出のレコードがこの状態なら、生成要求が抽出を受け持つ（抽出中 = timeout のときは二重に始めない）
+EAGER_CLAIMABLE = ('none', 'failed', 'stale')
+
+# 問題生成プロンプトの版（文言や出力の形を変えたら上げて生成結果キャッシュを無効化する）
+QUIZ_PROMPT_VERSION = 'quiz-v2'
+# ローカル生成の問題数（num_questions が無ければ既定の5問 = 四択3＋穴埋め2）
+QUIZ_DEFAULT_QUESTIONS = 5
+QUIZ_MAX_QUESTIONS = int(os.environ.get('QUIZ_MAX_QUESTIONS', '20'))
+# 不足・不正な問題だけを作り直す回数
+QUIZ_REPAIR_ROUNDS = int(os.environ.get('QUIZ_REPAIR_ROUNDS', '1'))
+# 生成結果キャッシュ（同じ教材・パラメータの再実行と同時実行をまとめる）
+quiz_cache = QuizCache()
+
+# パイプライン: two-call（抽出 → 本文から生成の2回）| fused（画像/PDF から本文の冒頭と問題を1回で受け取る）
+# リクエストの pipeline で要求ごとに選べる。fused はローカル生成になる要求で、抽出結果がキャッシュにない場合だけ使う
+PIPELINE_MODES = ('two-call', 'fused')
+PIPELINE_MODE = os.environ.get('PIPELINE_MODE', 'two-call').lower()
+FUSED_PROMPT_VERSION = 'fused-v1'
+FUSED_MAX_PAGES = int(os.environ.get('FUSED_MAX_PAGES', '4'))  # これより多いページの PDF はページ並列の抽出を使う
+FUSED_PREVIEW_CHARS = 400
+# 固定の指示文（と fused の文書）の後ろに Bedrock のプロンプトキャッシュ（cachePoint）を置く
+PROMPT_CACHE = os.environ.get('PROMPT_CACHE', '1') == '1'
+prompt_cache_state = {'supported': PROMPT_CACHE}
+CACHE_POINT = {'cachePoint': {'type': 'default'}}
+FUSED_INSTRUCTIONS = f'''添付の画像/文書の日本語本文を読み取り、その内容だけから日本語の小テストを作成してください。
+各問に 正答・解説・根拠（本文の該当行） を含め、全体を JSON オブジェクト1つで返してください（前後に説明文を付けない）。
+出力は {{"extractedPreview": string, "questions": Question[]}} の形で返してください。
+extractedPreview: 本文の冒頭 {FUSED_PREVIEW_CHARS} 文字程度を、段落を保ったまま正確に書き写したもの
+Question: {{"type": "mcq|cloze", "question": string, "choices"?: string[], "answer": string, "explanation": string, "sourceText": string}}'''
+
+# AgentCore が劣化しているときはタイムアウトを待たずにローカル生成へ切り替える
+agentcore_breaker = CircuitBreaker('agentcore')
+# ヘッジ: AgentCore が p95 ベースの期限内に応答しなければローカル生成も並行して始め、先に終わった方を使う
+HEDGE_ENABLED = os.environ.get('HEDGE_ENABLED', '0') == '1'
+HEDGE_P95_FACTOR = float(os.environ.get('HEDGE_P95_FACTOR', '1.0'))
+HEDGE_MIN_SEC = float(os.environ.get('HEDGE_MIN_SEC', '2'))
+HEDGE_MAX_SEC = float(os.environ.get('HEDGE_MAX_SEC', '20'))  # p95 のサンプルがないときの期限にも使う
+hedge_pool = ThreadPoolExecutor(max_workers=4)
+
+
+def prewarm():
+    """初期化時の事前準備（SnapStart ではスナップショット作成前のフックとして実行）"""
+    timings = clients.prewarm(AWS_SERVICES)
+    print(f'Prewarm: {timings}')
+    return timings
+
+
+if clients.eager_init() and not clients.register_before_snapshot(prewarm):
+    prewarm()
 
+
+@metrics.instrument('process')
+@compression.negotiated
 def lambda_handler(event, context):
     try:
+        if is_s3_event(event):
+            metrics.set_property('Route', 's3')
+            return prefetch_uploads(event)
+        
         body = parse_body(event)
         bucket = body.get('bucket')
         key = body.get('key')
@@ -31,79 +120,95 @@ def lambda_handler(event, context):
         if not MODEL_ID:
             return res(500, {'error': '環境変数 BEDROCK_MODEL_ID が未設定です'})
         
-        # S3: メタデータと本体バイト取得
+        # S3: GET 1回で取得。先頭数KBで種別判定し、ETag でキャッシュを引く（ヒットなら残りは読まない）
         try:
-            head = s3_client.head_object(Bucket=bucket, Key=key)
-            obj = s3_client.get_object(Bucket=bucket, Key=key)
-            image_bytes = obj['Body'].read()
-            print(f'S3 object retrieved: {len(image_bytes)} bytes')
+            with metrics.timer('S3FetchMs'):
+                fetched = open_object(s3_client, bucket, key)
         except ClientError as e:
             print(f'S3 error: {str(e)}')
             return res(400, {'error': f'S3から本文を取得できませんでした: {str(e)}'})
+        except UnsupportedObject as e:
+            return res(e.status, {'error': str(e)})
         
-        if not image_bytes:
-            return res(400, {'error': 'S3から本文を取得できませんでした'})
+        etag_key = None
+        etag_digest = content_digest(etag=fetched.etag)
+        if etag_digest:
+            etag_key = cache_key(etag_digest, MODEL_ID, EXTRACT_CACHE_VERSION)
+        cached, cache_tier = ocr_cache.get(etag_key)
         
-        # ファイル種別判定
-        lower_key = key.lower()
-        content_type = head.get('ContentType', '')
-        is_pdf = lower_key.endswith('.pdf') or 'pdf' in content_type
-        is_png = lower_key.endswith('.png') or 'png' in content_type
-        is_jpg = any(lower_key.endswith(ext) for ext in ['.jpg', '.jpeg']) or any(t in content_type for t in ['jpeg', 'jpg'])
+        # 先行抽出（S3 イベント）: 済んでいれば使い、抽出中なら完了を待って合流する（本体は読まない）
+        eager = None
+        if cached is None and extract_store.enabled:
+            with metrics.timer('EagerWaitMs'):
+                cached, eager = extract_store.wait(bucket, key, fetched.etag, EXTRACT_VERSION)
+            metrics.set_property('Eager', eager)
+            if cached is not None:
+                cache_tier = 'eager'
+                ocr_cache.alias(etag_key, cached, persist=False)
         
-        # 1) テキスト抽出
-        content = [
-            {
-                'text': '以下の画像/文書から、日本語本文を段落保持で正確に抽出してください。'
-            }
-        ]
-        
-        if is_pdf:
-            content.append({
-                'document': {
-                    'format': 'pdf',
-                    'name': key.split('/')[-1],
-                    'source': {
-                        'bytes': image_bytes
-                    }
-                }
-            })
+        if cached is not None:
+            fetched.close()
         else:
-            fmt = 'png' if is_png else 'jpeg'
-            content.append({
-                'image': {
-                    'format': fmt,
-                    'source': {
-                        'bytes': image_bytes
-                    }
-                }
-            })
+            try:
+                with metrics.timer('S3ReadMs'):
+                    image_bytes = fetched.read_all()
+                metrics.put('PayloadBytes', len(image_bytes), 'Bytes')
+                print(f'S3 object retrieved: {len(image_bytes)} bytes ({fetched.kind})')
+            except ClientError as e:
+                print(f'S3 error: {str(e)}')
+                return res(400, {'error': f'S3から本文を取得できませんでした: {str(e)}'})
+            
+            if not image_bytes:
+                return res(400, {'error': 'S3から本文を取得できませんでした'})
+            
+            # 本体の SHA-256 でも引く（マルチパート等で ETag が一致しない場合）
+            sha_key = cache_key(content_digest(data=image_bytes), MODEL_ID, EXTRACT_CACHE_VERSION)
+            cached, cache_tier = ocr_cache.get(sha_key)
+            if cached is not None:
+                ocr_cache.alias(etag_key, cached)
         
-        # Converse API で抽出
-        ocr_resp = br_client.converse(
-            modelId=MODEL_ID,
-            messages=[{
-                'role': 'user',
-                'content': content
-            }],
-            inferenceConfig={
-                'maxTokens': 1800,
-                'temperature': 0.0
-            }
-        )
+        # fused: 抽出と問題生成を1回の Converse で行う（問題が取り出せなければ two-call に戻る）
+        if cached is None and use_fused(body, fetched.kind, image_bytes):
+            fused = fused_response(body, key, fetched.kind, image_bytes, sha_key, cache_tier)
+            if fused is not None:
+                ocr_cache.record(cache_tier)
+                return fused
+            print('Fused output had no questions, falling back to two-call')
         
-        print(f'Bedrock response keys: {ocr_resp.keys()}')
-        print(f'Bedrock output: {ocr_resp.get("output")}')
+        # 先行抽出がまだ無ければこの要求が抽出を受け持ち、結果を置く（遅れて届いたイベントは何もしない）
+        claimed = False
+        if cached is None and eager in EAGER_CLAIMABLE:
+            claimed = extract_store.begin(bucket, key, fetched.etag, EXTRACT_VERSION)
+            if not claimed:
+                # ちょうど始まった先行抽出に合流する
+                cached, eager = extract_store.wait(bucket, key, fetched.etag, EXTRACT_VERSION)
+                metrics.set_property('Eager', eager)
+                if cached is not None:
+                    cache_tier = 'eager'
         
-        extracted = ''
-        if 'output' in ocr_resp and 'message' in ocr_resp['output'] and 'content' in ocr_resp['output']['message']:
-            for block in ocr_resp['output']['message']['content']:
-                print(f'Block keys: {block.keys()}')
-                if 'text' in block:  # type キーではなく text キーで判定
-                    extracted += block.get('text', '')
+        if cached is not None:
+            extracted = cached['text']
+            extract_meta = cached.get('meta') or {}
+            print(f'OCR cache hit ({cache_tier}): {len(extracted)} chars')
+        else:
+            # 1) テキスト抽出（種別はマジックバイトで判定済み。PDF はページ単位で並列）
+            try:
+                extracted, extract_meta = run_extraction(image_bytes, fetched.kind, key)
+            except Exception as e:
+                if claimed:
+                    extract_store.fail(bucket, key, fetched.etag, EXTRACT_VERSION, e)
+                raise
+            if extracted:
+                ocr_cache.put([etag_key, sha_key], extracted, modelId=MODEL_ID, promptVersion=EXTRACT_CACHE_VERSION)
+            if claimed and extracted:
+                extract_store.finish(bucket, key, fetched.etag, EXTRACT_VERSION, extracted, extract_meta)
+            elif claimed:
+                extract_store.fail(bucket, key, fetched.etag, EXTRACT_VERSION, 'empty extraction')
         
-        extracted = extracted.strip()
-        print(f'Extracted text length: {len(extracted)}')
+        ocr_cache.record(cache_tier)
+        metrics.set_property('OcrCache', cache_tier)
+        metrics.put('ExtractedChars', len(extracted), 'Count')
+        cache_meta = dict(ocr_cache.stats(), ocr=cache_tier, **extract_meta)
         
         if not extracted:
             return res(200, {
@@ -116,97 +221,615 @@ def lambda_handler(event, context):
         difficulty = body.get('difficulty')
         num_questions = body.get('num_questions')
         
+        # 教材は抽出テキストの内容ハッシュで識別する（別キーでの再アップロードも同じ教材として扱う）
+        document = content_digest(data=extracted.encode('utf-8'))
+        
+        routing = {'decision': 'local', 'hedged': False, 'pipeline': 'two-call'}
+        layout = quiz_layout(num_questions)
+        local_key = quiz_key(document, None, None, layout,
+                             f'local|{MODEL_ID}|{QUIZ_PROMPT_VERSION}|{text_budget.signature()}')
+        
+        local_runs = []  # ヘッジでローカル生成を始めたか（失敗したら同じ生成を繰り返さない）
+        
+        def run_local():
+            local_runs.append(True)
+            return quiz_cache.get_or_compute(local_key, lambda: generate_local(extracted, layout), cacheable=is_quiz)
+        
         if AGENTCORE_RUNTIME_ARN and target and difficulty and (num_questions is not None):
-            try:
-                import time
-                import random
-                
-                # セッション ID は33文字以上が必須
-                session_id = f"session-{int(time.time()*1000)}-{random.randint(1000000000, 9999999999)}"
-                print(f'AgentCore session_id length: {len(session_id)}')
-                
-                agent_payload = {
-                    's3_uri': f's3://{bucket}/{key}',
-                    'target': target,
-                    'difficulty': difficulty,
-                    'num_questions': num_questions
-                }
-                
-                print(f'Calling AgentCore with session_id={session_id}')
-                agent_resp = agentcore_client.invoke_agent_runtime(
-                    agentRuntimeArn=AGENTCORE_RUNTIME_ARN,
-                    runtimeSessionId=session_id,
-                    payload=json.dumps(agent_payload)
+            agent_key = quiz_key(document, target, difficulty, num_questions, f'agentcore|{AGENTCORE_RUNTIME_ARN}')
+            
+            def run_agentcore():
+                return quiz_cache.get_or_compute(
+                    agent_key,
+                    lambda: call_agentcore(bucket, key, target, difficulty, num_questions),
+                    cacheable=is_quiz
                 )
-                
-                # レスポンス本体を読む
-                agent_result = ''
-                if 'response' in agent_resp:
-                    response_body = agent_resp['response']
-                    if hasattr(response_body, 'read'):
-                        agent_result = response_body.read().decode('utf-8')
-                    elif isinstance(response_body, bytes):
-                        agent_result = response_body.decode('utf-8')
-                    elif isinstance(response_body, str):
-                        agent_result = response_body
-                
-                print(f'AgentCore response received: {len(agent_result)} bytes')
-                
-                # JSON として解析を試みる
+            
+            cached_quiz = quiz_cache.get(agent_key)
+            if cached_quiz is not None:
+                # キャッシュ済みならブレーカーの状態によらず返す
+                routing['decision'] = 'agentcore'
+                return quiz_response(extracted, cached_quiz, 'hit', cache_meta, routing, 'agentcore')
+            if not agentcore_breaker.allow():
+                routing['decision'] = 'breaker_open'
+                print('AgentCore circuit is open, using local generation')
+            else:
                 try:
-                    parsed_result = json.loads(agent_result)
-                except:
-                    parsed_result = agent_result
-                
-                return res(200, {
-                    'extractedPreview': extracted[:400],
-                    'quiz': parsed_result,
-                    'source': 'agentcore'
-                })
-            except Exception as e:
-                print(f'AgentCore invocation failed, falling back to local generation: {str(e)}')
+                    if HEDGE_ENABLED:
+                        deadline = hedge_deadline()
+                        routing.update(hedged=True, deadlineSec=round(deadline, 3))
+                        (quiz, quiz_tier), source = hedged_call(run_agentcore, run_local, deadline)
+                        routing['decision'] = source if source == 'agentcore' else 'hedge_local'
+                    else:
+                        quiz, quiz_tier = run_agentcore()
+                        source = routing['decision'] = 'agentcore'
+                    return quiz_response(extracted, quiz, quiz_tier, cache_meta, routing,
+                                         'agentcore' if source == 'agentcore' else None)
+                except Exception as e:
+                    if local_runs:
+                        # ヘッジしたローカル生成も失敗している。もう一度ローカル生成はしない
+                        print(f'AgentCore and hedged local generation both failed: {str(e)}')
+                        raise
+                    routing['decision'] = 'fallback_error'
+                    print(f'AgentCore invocation failed, falling back to local generation: {str(e)}')
         
         # Fallback: ローカル Bedrock による問題生成
-        quiz_prompt = f'''以下の本文から日本語の小テストを5問（四択3＋穴埋め2）で作成してください。
+        quiz_result, quiz_tier = run_local()
+        return quiz_response(extracted, quiz_result, quiz_tier, cache_meta, routing)
+    
+    except Exception as e:
+        print(f'Error: {str(e)}')
+        return res(500, {'error': str(e)})
+
+
+def run_extraction(data, kind, key):
+    """画像/PDF から本文を抽出する。(本文, メタデータ {'pages': ...} / {'preprocess': ...}) を返す"""
+    if kind == 'pdf':
+        with metrics.timer('OcrMs'):
+            extracted, page_meta = extract_pdf(data, key)
+        meta = {'pages': page_meta} if page_meta else {}
+    else:
+        # 画像は縮小・グレースケール化・再エンコードしてから送る
+        with metrics.timer('ImagePrepMs'):
+            data, fmt, prep_meta = image_prep.prepare_image(data, kind)
+        print(f'Image preprocessing: {prep_meta}')
+        with metrics.timer('OcrMs'):
+            extracted = extract_text(data, key, fmt)
+        meta = {'preprocess': prep_meta} if prep_meta else {}
+    print(f'Extracted text length: {len(extracted)}')
+    return extracted, meta
+
+
+def is_s3_event(event):
+    records = event.get('Records') if isinstance(event, dict) else None
+    return isinstance(records, list) and bool(records) and records[0].get('eventSource') == 'aws:s3'
+
+
+def prefetch_uploads(event):
+    """S3 ObjectCreated（uploads/ 配下）: 生成要求より先に抽出し、先行抽出ストアと抽出キャッシュに置く"""
+    results = []
+    for record in event['Records']:
+        if not str(record.get('eventName', '')).startswith('ObjectCreated'):
+            continue
+        s3 = record.get('s3') or {}
+        bucket = (s3.get('bucket') or {}).get('name')
+        obj = s3.get('object') or {}
+        # イベントのキーは URL エンコードされている（空白は +）
+        key = unquote_plus(obj.get('key') or '')
+        if not bucket or not key.startswith(UPLOAD_PREFIX):
+            continue
+        results.append(dict(prefetch(bucket, key, obj.get('eTag')), key=key))
+    metrics.put('EagerObjects', len(results), 'Count')
+    return res(200, {'prefetched': results})
+
+
+def prefetch(bucket, key, etag):
+    """1オブジェクトを先行抽出する。他で抽出中・抽出済みなら何もしない"""
+    if not extract_store.enabled or not MODEL_ID:
+        return {'status': 'disabled'}
+    if not extract_store.begin(bucket, key, etag, EXTRACT_VERSION):
+        print(f'Prefetch skipped (in flight or done): {key}')
+        return {'status': 'skipped'}
+    try:
+        with metrics.timer('EagerExtractMs'):
+            fetched = open_object(s3_client, bucket, key)
+            if content_digest(etag=fetched.etag) != content_digest(etag=etag):
+                # イベントの後に上書きされた。新しい版は後続のイベントで抽出する
+                fetched.close()
+                raise ValueError('object was replaced after the event')
+            etag_key = cache_key(content_digest(etag=etag), MODEL_ID, EXTRACT_CACHE_VERSION)
+            cached, tier = ocr_cache.get(etag_key)
+            meta = {}
+            if cached is not None:
+                fetched.close()
+                extracted = cached['text']
+            else:
+                data = fetched.read_all()
+                sha_key = cache_key(content_digest(data=data), MODEL_ID, EXTRACT_CACHE_VERSION)
+                cached, tier = ocr_cache.get(sha_key)
+                if cached is not None:
+                    extracted = cached['text']
+                    ocr_cache.alias(etag_key, cached)
+                else:
+                    extracted, meta = run_extraction(data, fetched.kind, key)
+                    if extracted:
+                        ocr_cache.put([etag_key, sha_key], extracted, modelId=MODEL_ID,
+                                      promptVersion=EXTRACT_CACHE_VERSION)
+        if not extracted:
+            raise ValueError('empty extraction')
+        extract_store.finish(bucket, key, etag, EXTRACT_VERSION, extracted, meta)
+        print(f'Prefetched {key}: {len(extracted)} chars (ocr cache {tier})')
+        return {'status': 'ready', 'chars': len(extracted), 'ocr': tier}
+    except Exception as e:
+        print(f'Prefetch failed for {key}: {str(e)}')
+        extract_store.fail(bucket, key, etag, EXTRACT_VERSION, e)
+        return {'status': 'failed', 'error': str(e)}
+
+
+def quiz_response(extracted, quiz, quiz_tier, cache_meta, routing, source=None):
+    """問題生成の結果をレスポンスにする（キャッシュ・経路の判断をメタデータとして含める）"""
+    routing['breaker'] = agentcore_breaker.snapshot()
+    metrics.set_property('QuizCache', quiz_tier)
+    metrics.set_property('Routing', routing.get('decision'))
+    metrics.set_property('Breaker', routing['breaker']['state'])
+    body = {
+        'extractedPreview': extracted[:400],
+        'quiz': quiz,
+        'cache': dict(cache_meta, quiz=quiz_tier),
+        'routing': routing
+    }
+    if source:
+        body['source'] = source
+    return res(200, body)
+
+
+def call_agentcore(bucket, key, target, difficulty, num_questions):
+    """AgentCore 呼び出しの成否と所要時間をブレーカーに記録する"""
+    started = time.time()
+    try:
+        with metrics.timer('AgentCoreMs'):
+            result = generate_agentcore(bucket, key, target, difficulty, num_questions)
+    except Exception:
+        agentcore_breaker.record(False, time.time() - started)
+        raise
+    agentcore_breaker.record(True, time.time() - started)
+    return result
+
+
+def hedge_deadline():
+    """AgentCore の p95 所要時間 × 係数 を HEDGE_MIN_SEC..HEDGE_MAX_SEC に収めた期限（秒）"""
+    p95 = agentcore_breaker.p95()
+    if p95 is None:
+        return HEDGE_MAX_SEC
+    return min(max(p95 * HEDGE_P95_FACTOR, HEDGE_MIN_SEC), HEDGE_MAX_SEC)
+
+
+def hedged_call(primary, fallback, deadline):
+    """primary が deadline 秒以内に終わらなければ fallback も始め、先に成功した方を返す。(結果, 'agentcore'|'local')
+
+    primary が期限前に失敗した場合は例外を投げる（呼び出し側で通常のフォールバックへ）。
+    ヘッジ後に遅れて完了した primary の結果もキャッシュには残る。
+    """
+    fut_primary = hedge_pool.submit(metrics.bind(primary))
+    done, _ = wait([fut_primary], timeout=deadline)
+    if done:
+        return fut_primary.result(), 'agentcore'
+    print(f'AgentCore did not answer within {deadline:.2f}s, hedging with local generation')
+    fut_fallback = hedge_pool.submit(metrics.bind(fallback))
+    pending = {fut_primary, fut_fallback}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for fut in done:
+            if fut.exception() is None:
+                return fut.result(), 'agentcore' if fut is fut_primary else 'local'
+            error = fut.exception()
+    raise error
+
+
+def generate_agentcore(bucket, key, target, difficulty, num_questions):
+    """AgentCore に問題生成を依頼し、応答を解析して返す"""
+    # セッション ID は33文字以上が必須
+    session_id = f"session-{int(time.time()*1000)}-{random.randint(10**15, 10**16 - 1)}"
+    print(f'AgentCore session_id length: {len(session_id)}')
+    
+    agent_payload = {
+        's3_uri': f's3://{bucket}/{key}',
+        'target': target,
+        'difficulty': difficulty,
+        'num_questions': num_questions
+    }
+    
+    print(f'Calling AgentCore with session_id={session_id}')
+    agent_resp = agentcore_client.invoke_agent_runtime(
+        agentRuntimeArn=AGENTCORE_RUNTIME_ARN,
+        runtimeSessionId=session_id,
+        payload=json.dumps(agent_payload)
+    )
+    
+    # レスポンス本体を読む（SSE/NDJSON はチャンク単位で逐次パース）
+    return normalize_quiz(read_agent_response(agent_resp))
+
+
+def quiz_layout(num_questions):
+    """ローカル生成の問題構成。(('mcq', 四択の数), ('cloze', 穴埋めの数))（既定の5問は四択3＋穴埋め2）"""
+    try:
+        total = int(num_questions)
+    except (TypeError, ValueError):
+        total = QUIZ_DEFAULT_QUESTIONS
+    total = min(max(total, 1), QUIZ_MAX_QUESTIONS)
+    mcq = max(1, round(total * 3 / 5))
+    return tuple((t, n) for t, n in (('mcq', mcq), ('cloze', total - mcq)) if n > 0)
+
+
+def generate_local(extracted, layout):
+    """Bedrock Converse で本文から問題を生成する（AgentCore が使えない場合のフォールバック）
+    
+    本文と maxTokens は問題数から決めた予算に収める（長い本文は問題ごとに関連の高い段落を選ぶ）。
+    出力は Question スキーマで1問ずつ検証し、途中切れ・不正で足りない問題だけを追加で依頼する。
+    1問も取り出せなかった場合は従来どおりモデルの出力文字列を返す。
+    """
+    total = sum(n for _, n in layout)
+    context, context_meta = text_budget.select_context(extracted, total)
+    metrics.put('QuizContextTokens', context_meta['tokens'], 'Count')
+    if 'chunks' in context_meta:
+        print(f'Quiz context selected: {context_meta}')
+    
+    with metrics.timer('GenerateMs'):
+        quiz_text = converse_text(quiz_prompt(context, layout), text_budget.quiz_max_tokens(total), 'Quiz')
+    
+    def request_more(missing, exclude):
+        return converse_text(
+            quiz_prompt(context, missing, exclude=exclude),
+            text_budget.quiz_max_tokens(sum(n for _, n in missing)),
+            'Repair'
+        )
+    
+    quiz = complete_quiz(quiz_text, layout, request_more)
+    if isinstance(quiz, dict):
+        quiz['context'] = context_meta
+    return quiz
+
+
+def complete_quiz(quiz_text, layout, request_more):
+    """生成結果を解析・検証し、足りない問題だけを request_more(不足分の layout, 既存の問題文) で追加依頼する
+    
+    1問も取り出せなかった場合はモデルの出力文字列を返す。
+    """
+    with metrics.timer('ParseMs'):
+        parsed = quiz_parser.parse_quiz(quiz_text)
+    questions, missing = quiz_parser.select(parsed['questions'], layout)
+    parse_meta = {
+        'status': parsed['status'],
+        'truncated': parsed['truncated'],
+        'invalid': len(parsed['invalid']),
+        'rerequested': 0
+    }
+    if parsed['invalid']:
+        print(f'Invalid questions dropped: {parsed["invalid"]}')
+    
+    for _ in range(QUIZ_REPAIR_ROUNDS):
+        if not missing:
+            break
+        count = sum(n for _, n in missing)
+        print(f'Quiz output incomplete ({parsed["status"]}), requesting {quiz_parser.describe(missing)}')
+        parse_meta['rerequested'] += count
+        with metrics.timer('RepairMs'):
+            more_text = request_more(missing, [q['question'] for q in questions])
+        more = quiz_parser.parse_quiz(more_text)
+        questions, missing = quiz_parser.select(questions + more['questions'], layout)
+    
+    metrics.put('QuizValid', len(questions), 'Count')
+    metrics.put('QuizInvalid', parse_meta['invalid'], 'Count')
+    if not questions:
+        return quiz_text
+    parse_meta['missing'] = sum(n for _, n in missing)
+    return {'questions': questions, 'parse': parse_meta}
+
+
+def use_fused(body, kind, data):
+    """この要求を fused で処理するか（AgentCore 経由の要求と、ページの多い PDF は two-call）"""
+    mode = body.get('pipeline') if body.get('pipeline') in PIPELINE_MODES else PIPELINE_MODE
+    if mode != 'fused':
+        return False
+    if AGENTCORE_RUNTIME_ARN and body.get('target') and body.get('difficulty') and body.get('num_questions') is not None:
+        return False  # AgentCore は教材の識別とプレビューに抽出テキストを使う
+    return kind != 'pdf' or count_pages(data) <= FUSED_MAX_PAGES
+
+
+def fused_response(body, key, kind, data, digest_key, ocr_tier):
+    """fused で生成してレスポンスを返す。問題が1問も取り出せなければ None（呼び出し側で two-call に戻る）"""
+    layout = quiz_layout(body.get('num_questions'))
+    fused_key = quiz_key(digest_key, None, None, layout,
+                         f'fused|{MODEL_ID}|{FUSED_PROMPT_VERSION}|{image_prep.signature()}')
+    value, quiz_tier = quiz_cache.get_or_compute(
+        fused_key, lambda: generate_fused(data, key, kind, layout), cacheable=lambda v: is_quiz(v['quiz']))
+    if not isinstance(value['quiz'], dict):
+        return None
+    metrics.set_property('Pipeline', 'fused')
+    metrics.set_property('OcrCache', ocr_tier)
+    cache_meta = dict(ocr_cache.stats(), ocr=ocr_tier)
+    if value.get('preprocess'):
+        cache_meta['preprocess'] = value['preprocess']
+    routing = {'decision': 'local', 'hedged': False, 'pipeline': 'fused'}
+    return quiz_response(value['preview'], value['quiz'], quiz_tier, cache_meta, routing)
+
+
+def generate_fused(data, key, kind, layout):
+    """画像/PDF を1回だけ送り、本文の冒頭（extractedPreview）と問題を1つの JSON で受け取る
+    
+    本文全体を書き出させないので、two-call より出力トークンが少なく、2回目の呼び出しの待ち時間もない。
+    足りない問題は同じ文書で追加依頼する（文書はプロンプトキャッシュから読まれる）。
+    """
+    prep_meta = None
+    fmt = 'pdf'
+    if kind != 'pdf':
+        with metrics.timer('ImagePrepMs'):
+            data, fmt, prep_meta = image_prep.prepare_image(data, kind)
+    source = document_block(data, key, fmt)
+    
+    def request(part, exclude=()):
+        avoid = ''
+        if exclude:
+            avoid = '\n次の問題とは重複しないようにしてください:\n' + '\n'.join(f'- {q}' for q in exclude)
+        text = f'この教材から小テストを{quiz_parser.describe(part)}で作成してください。{avoid}'
+        max_tokens = text_budget.quiz_max_tokens(sum(n for _, n in part)) + FUSED_PREVIEW_CHARS
+        return converse_text(text, max_tokens, 'Fused' if not exclude else 'Repair',
+                             system=FUSED_INSTRUCTIONS, attachment=source)
+    
+    with metrics.timer('GenerateMs'):
+        quiz_text = request(layout)
+    quiz = complete_quiz(quiz_text, layout, request)
+    return {'quiz': quiz, 'preview': fused_preview(quiz_text), 'preprocess': prep_meta}
+
+
+def fused_preview(text):
+    """fused の出力から extractedPreview を取り出す（途中切れでも文字列が閉じていれば取れる）"""
+    try:
+        data = json.loads(quiz_parser.repair_json(text) or 'null')
+    except ValueError:
+        return ''
+    preview = data.get('extractedPreview') if isinstance(data, dict) else None
+    return preview.strip() if isinstance(preview, str) else ''
+
+
+def quiz_prompt(extracted, layout, exclude=()):
+    """問題生成プロンプト（layout で問題の種類と数、exclude で重複させない既存の問題文を指定）"""
+    avoid = ''
+    if exclude:
+        avoid = '次の問題とは重複しないようにしてください:\n' + '\n'.join(f'- {q}' for q in exclude) + '\n'
+    return f'''以下の本文から日本語の小テストを{quiz_parser.describe(layout)}で作成してください。
 各問に 正答・解説・根拠（本文の該当行） を含め、全体を JSON で返してください。
 出力は {{"questions": Question[]}} の形で返してください。
 Question: {{"type": "mcq|cloze", "question": string, "choices"?: string[], "answer": string, "explanation": string, "sourceText": string}}
-本文:
+{avoid}本文:
 {extracted}'''
-        
-        quiz_resp = br_client.converse(
+
+
+def converse_text(prompt, max_tokens, usage_prefix, system=None, attachment=None):
+    """Converse を1回呼び、応答のテキストを連結して返す
+    
+    system（固定の指示文）と attachment（画像/文書ブロック）の後ろにはプロンプトキャッシュの cachePoint を置く。
+    モデルが cachePoint を受け付けなければ、以降は付けずに呼ぶ。
+    """
+    def build(cache):
+        req = {
+            'modelId': MODEL_ID,
+            'messages': [{
+                'role': 'user',
+                'content': ([attachment] if attachment else []) + ([CACHE_POINT] if cache and attachment else []) + [{
+                    'text': prompt
+                }]
+            }],
+            'inferenceConfig': {
+                'maxTokens': max_tokens,
+                'temperature': 0.2
+            }
+        }
+        if system:
+            req['system'] = [{'text': system}] + ([CACHE_POINT] if cache else [])
+        return req
+    
+    use_cache = bool(system or attachment) and prompt_cache_state['supported']
+    try:
+        resp = br_client.converse(**build(use_cache))
+    except ClientError as e:
+        error = e.response.get('Error', {})
+        message = str(error.get('Message') or '').lower()
+        # 画像サイズ超過なども ValidationException になるので、キャッシュに関するエラーのときだけ外して再試行する
+        if not use_cache or error.get('Code') != 'ValidationException' \
+                or not any(word in message for word in ('cachepoint', 'cache point', 'caching')):
+            raise
+        print(f'Prompt caching rejected by the model, retrying without cachePoint: {str(e)}')
+        prompt_cache_state['supported'] = False
+        resp = br_client.converse(**build(False))
+    metrics.usage(resp.get('usage'), usage_prefix)
+    if resp.get('stopReason') == 'max_tokens':
+        print(f'Quiz output reached maxTokens={max_tokens}')
+    
+    text = ''
+    if 'output' in resp and 'message' in resp['output'] and 'content' in resp['output']['message']:
+        for block in resp['output']['message']['content']:
+            if 'text' in block:  # type キーではなく text キーで判定
+                text += block.get('text', '')
+    return text.strip()
+
+
+def normalize_quiz(result):
+    """AgentCore の応答から問題を取り出して検証・正規化する（取り出せなければそのまま返す）"""
+    parsed = quiz_parser.parse_quiz(result)
+    if not parsed['questions']:
+        return result
+    normalized = {k: v for k, v in result.items() if k != 'result'} if isinstance(result, dict) else {}
+    normalized['questions'] = parsed['questions']
+    normalized['parse'] = {
+        'status': parsed['status'],
+        'truncated': parsed['truncated'],
+        'invalid': len(parsed['invalid'])
+    }
+    return normalized
+
+
+def is_quiz(result):
+    """キャッシュしてよい生成結果か（JSON として解析でき、問題が揃っているものだけ保存する）"""
+    if not isinstance(result, dict) or not result:
+        return False
+    return not (result.get('parse') or {}).get('missing')
+
+
+def document_block(data, key, fmt):
+    """Converse の画像/文書ブロック（fmt: pdf | png | jpeg | gif | webp）"""
+    if fmt == 'pdf':
+        return {
+            'document': {
+                'format': 'pdf',
+                'name': key.split('/')[-1],
+                'source': {
+                    'bytes': data
+                }
+            }
+        }
+    return {
+        'image': {
+            'format': fmt,
+            'source': {
+                'bytes': data
+            }
+        }
+    }
+
+
+def extract_text(image_bytes, key, fmt, pages=1):
+    """Converse API で画像/PDF から本文を抽出（fmt: pdf | png | jpeg | gif | webp。maxTokens はページ数に比例）"""
+    content = [
+        {
+            'text': EXTRACT_PROMPT
+        },
+        document_block(image_bytes, key, fmt)
+    ]
+    
+    with metrics.timer('BedrockOcrMs'):
+        ocr_resp = br_client.converse(
             modelId=MODEL_ID,
             messages=[{
                 'role': 'user',
-                'content': [{
-                    'text': quiz_prompt
-                }]
+                'content': content
             }],
             inferenceConfig={
-                'maxTokens': 1500,
-                'temperature': 0.2
+                'maxTokens': text_budget.ocr_max_tokens(pages),
+                'temperature': 0.0
             }
         )
-        
-        quiz_text = ''
-        if 'output' in quiz_resp and 'message' in quiz_resp['output'] and 'content' in quiz_resp['output']['message']:
-            for block in quiz_resp['output']['message']['content']:
-                if 'text' in block:  # type キーではなく text キーで判定
-                    quiz_text += block.get('text', '')
-        
-        quiz_text = quiz_text.strip()
-        
-        # JSON として安全に解析
-        quiz_result = safe_json(quiz_text)
-        
-        return res(200, {
-            'extractedPreview': extracted[:400],
-            'quiz': quiz_result
-        })
+    metrics.usage(ocr_resp.get('usage'), 'Ocr')
+    if ocr_resp.get('stopReason') == 'max_tokens':
+        print(f'Extraction reached maxTokens={text_budget.ocr_max_tokens(pages)} ({pages} pages)')
+        metrics.add('OcrTruncated', 1)
     
-    except Exception as e:
-        print(f'Error: {str(e)}')
-        return res(500, {'error': str(e)})
+    print(f'Bedrock response keys: {ocr_resp.keys()}')
+    
+    extracted = ''
+    if 'output' in ocr_resp and 'message' in ocr_resp['output'] and 'content' in ocr_resp['output']['message']:
+        for block in ocr_resp['output']['message']['content']:
+            if 'text' in block:  # type キーではなく text キーで判定
+                extracted += block.get('text', '')
+    
+    return extracted.strip()
+
+
+def extract_pdf(pdf_bytes, key):
+    """PDF をページ範囲に分割して並列に抽出し、ページ順に連結する（ページ単位でキャッシュ）"""
+    chunks = split_pdf(pdf_bytes, PDF_PAGES_PER_CHUNK)
+    if not chunks:
+        return extract_text(pdf_bytes, key, 'pdf', count_pages(pdf_bytes)), None
+    
+    def run(chunk):
+        digest = chunk['digest'] or content_digest(data=chunk['bytes'])
+        ck = cache_key(digest, MODEL_ID, EXTRACT_CACHE_VERSION)
+        hit, _ = ocr_cache.get(ck)
+        if hit is not None:
+            return hit['text'], True
+        text = extract_text(chunk['bytes'], key, 'pdf', chunk['last'] - chunk['first'] + 1)
+        if text:
+            ocr_cache.put([ck], text, modelId=MODEL_ID, promptVersion=EXTRACT_CACHE_VERSION)
+        return text, False
+    
+    with ThreadPoolExecutor(max_workers=max(1, min(PDF_MAX_WORKERS, len(chunks)))) as pool:
+        results = list(pool.map(metrics.bind(run), chunks))
+    
+    print(f'PDF extracted in {len(chunks)} chunks')
+    text = '\n\n'.join(t for t, _ in results if t)
+    return text, {'chunks': len(chunks), 'cached': sum(1 for _, hit in results if hit)}
+
+
+def iter_agent_events(response_body, chunk_size=AGENTCORE_STREAM_CHUNK):
+    """SSE / NDJSON の StreamingBody を行単位で読み、イベントを1件ずつ返す"""
+    if hasattr(response_body, 'iter_chunks'):
+        chunks = response_body.iter_chunks(chunk_size)
+    else:
+        chunks = iter(lambda: response_body.read(chunk_size), b'')
+    buf = bytearray()
+    for chunk in chunks:
+        buf += chunk
+        while True:
+            nl = buf.find(b'\n')
+            if nl < 0:
+                break
+            ev = parse_event_line(bytes(buf[:nl]))
+            del buf[:nl + 1]
+            if ev is not None:
+                yield ev
+    ev = parse_event_line(bytes(buf))
+    if ev is not None:
+        yield ev
+
+
+def parse_event_line(line):
+    """SSE の data 行 / NDJSON の1行をパース（空行・コメント・制御行は None）"""
+    line = line.strip()
+    if not line or line.startswith(b':'):
+        return None
+    if line.startswith(b'data:'):
+        line = line[5:].strip()
+    elif line.startswith((b'event:', b'id:', b'retry:')):
+        return None
+    text = line.decode('utf-8', errors='replace')
+    if text == '[DONE]':
+        return None
+    return safe_json(text)
+
+
+def read_agent_response(agent_resp):
+    """AgentCore の応答を読む。ストリーミング形式ならイベントを集約し、それ以外は JSON として解析"""
+    response_body = agent_resp.get('response')
+    content_type = str(agent_resp.get('contentType') or '').lower()
+    if hasattr(response_body, 'read') and ('event-stream' in content_type or 'ndjson' in content_type):
+        texts = []
+        result = {}
+        for ev in iter_agent_events(response_body):
+            if isinstance(ev, str):
+                texts.append(ev)
+            elif isinstance(ev, dict):
+                # {"question": ...} は1問分、{"questions": [...]} はその時点のスナップショット（ジョブ関数の _merge_event と同じ）
+                if isinstance(ev.get('questions'), list):
+                    result['questions'] = list(ev['questions'])
+                elif 'question' in ev:
+                    result.setdefault('questions', []).append(ev)
+                else:
+                    result.update(ev)
+        if texts and 'result' not in result:
+            result['result'] = ''.join(texts)
+        print(f'AgentCore stream received: {len(texts)} text events')
+        return result
+    
+    agent_result = ''
+    if hasattr(response_body, 'read'):
+        agent_result = response_body.read().decode('utf-8')
+    elif isinstance(response_body, bytes):
+        agent_result = response_body.decode('utf-8')
+    elif isinstance(response_body, str):
+        agent_result = response_body
+    print(f'AgentCore response received: {len(agent_result)} bytes')
+    return safe_json(agent_result)
 
 
 def res(code, body):
@@ -225,7 +848,7 @@ def parse_body(event):
     """Event body を JSON として解析"""
     if isinstance(event, dict) and 'body' in event:
         try:
-            return json.loads(event['body'])
+            return json.loads(compression.request_body(event))
         except:
             pass
     return event if isinstance(event, dict) else {}
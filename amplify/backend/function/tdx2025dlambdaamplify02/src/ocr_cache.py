@@ -0,0 +1,235 @@
+"""抽出テキストのコンテンツアドレス型キャッシュ
+
+同じ教材が `uploads/<timestamp>_...` の別キーで再アップロードされても、
+内容ハッシュ（ETag / SHA-256）+ モデルID + プロンプト版 をキーにして
+Bedrock の抽出呼び出しを丸ごと省略する。
+
+- 1段目: プロセス内 LRU（ウォームコンテナ間で共有、件数/バイト数で追い出し）
+- 2段目: 永続層（OCR_CACHE_BUCKET があれば S3、OCR_CACHE_DIR があればローカルファイル）
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+OCR_CACHE_TTL_SEC = int(os.environ.get('OCR_CACHE_TTL_SEC', str(7 * 24 * 3600)))
+OCR_CACHE_MAX_ITEMS = int(os.environ.get('OCR_CACHE_MAX_ITEMS', '256'))
+OCR_CACHE_MAX_BYTES = int(os.environ.get('OCR_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+OCR_CACHE_BUCKET = os.environ.get('OCR_CACHE_BUCKET', '')
+OCR_CACHE_PREFIX = os.environ.get('OCR_CACHE_PREFIX', 'cache/ocr/')
+OCR_CACHE_DIR = os.environ.get('OCR_CACHE_DIR', '')  # ローカル検証用（例: /tmp/ocr-cache）
+OCR_CACHE_DIR_MAX_BYTES = int(os.environ.get('OCR_CACHE_DIR_MAX_BYTES', str(256 * 1024 * 1024)))
+
+
+def content_digest(data=None, etag=None):
+    """内容ハッシュを返す（本体があれば SHA-256、なければ ETag）"""
+    if data is not None:
+        return 'sha256:' + hashlib.sha256(data).hexdigest()
+    if etag:
+        return 'etag:' + str(etag).strip('"')
+    return None
+
+
+def cache_key(digest, model_id, prompt_version):
+    """内容ハッシュ + モデルID + プロンプト版 からキャッシュキーを作る"""
+    raw = f'{digest}|{model_id}|{prompt_version}'
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class _LruTier:
+    """件数とバイト数の両方で上限を持つ TTL 付き LRU"""
+
+    def __init__(self, max_items, max_bytes, ttl_sec):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.ttl_sec = ttl_sec
+        self._items = OrderedDict()  # key -> (expires_at, size, entry)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            expires_at, size, entry = item
+            if expires_at < time.time():
+                self._drop(key)
+                return None
+            self._items.move_to_end(key)
+            return entry
+
+    def put(self, key, entry, size):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._items:
+                self._drop(key)
+            self._items[key] = (time.time() + self.ttl_sec, size, entry)
+            self._bytes += size
+            while self._items and (len(self._items) > self.max_items or self._bytes > self.max_bytes):
+                self._drop(next(iter(self._items)))
+
+    def _drop(self, key):
+        _, size, _ = self._items.pop(key)
+        self._bytes -= size
+
+
+class _S3Tier:
+    def __init__(self, s3_client, bucket, prefix, ttl_sec):
+        self.s3 = s3_client
+        self.bucket = bucket
+        self.prefix = prefix if prefix.endswith('/') else prefix + '/'
+        self.ttl_sec = ttl_sec
+
+    def get(self, key):
+        try:
+            obj = self.s3.get_object(Bucket=self.bucket, Key=f'{self.prefix}{key}.json')
+            entry = json.loads(obj['Body'].read())
+        except Exception:
+            return None
+        if entry.get('createdAt', 0) + self.ttl_sec < time.time():
+            return None
+        return entry
+
+    def put(self, key, entry):
+        try:
+            self.s3.put_object(
+                Bucket=self.bucket,
+                Key=f'{self.prefix}{key}.json',
+                Body=json.dumps(entry, ensure_ascii=False).encode('utf-8'),
+                ContentType='application/json'
+            )
+        except Exception as e:
+            print(f'OCR cache put failed: {str(e)}')
+
+
+class _FileTier:
+    """S3 の代わりにローカルディレクトリへ保存する永続層（検証用）"""
+
+    def __init__(self, directory, ttl_sec, max_bytes):
+        self.directory = directory
+        self.ttl_sec = ttl_sec
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.json')
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            if os.path.getmtime(path) + self.ttl_sec < time.time():
+                os.remove(path)
+                return None
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception:
+            return None
+
+    def put(self, key, entry):
+        path = self._path(key)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp, path)
+            self._prune()
+        except Exception as e:
+            print(f'OCR cache put failed: {str(e)}')
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+
+    def _prune(self):
+        files = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+        files.sort()
+        while files and total > self.max_bytes:
+            _, size, path = files.pop(0)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+
+class OcrCache:
+    """抽出結果の2段キャッシュ。hit/miss カウンタはコンテナ寿命の累計"""
+
+    def __init__(self, s3_client=None):
+        self.memory = _LruTier(OCR_CACHE_MAX_ITEMS, OCR_CACHE_MAX_BYTES, OCR_CACHE_TTL_SEC)
+        if OCR_CACHE_BUCKET and s3_client is not None:
+            self.persistent = _S3Tier(s3_client, OCR_CACHE_BUCKET, OCR_CACHE_PREFIX, OCR_CACHE_TTL_SEC)
+        elif OCR_CACHE_DIR:
+            self.persistent = _FileTier(OCR_CACHE_DIR, OCR_CACHE_TTL_SEC, OCR_CACHE_DIR_MAX_BYTES)
+        else:
+            self.persistent = None
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, *keys):
+        """いずれかのキーでヒットすれば (entry, tier) を返す。ミス時は (None, 'miss')"""
+        for key in keys:
+            if not key:
+                continue
+            entry = self.memory.get(key)
+            if entry is not None:
+                return entry, 'memory'
+        if self.persistent is not None:
+            for key in keys:
+                if not key:
+                    continue
+                entry = self.persistent.get(key)
+                if entry is not None:
+                    self._fill_memory(keys, entry)
+                    return entry, 'persistent'
+        return None, 'miss'
+
+    def put(self, keys, text, **meta):
+        entry = dict(meta, text=text, createdAt=int(time.time()))
+        self._fill_memory(keys, entry)
+        if self.persistent is not None:
+            for key in keys:
+                if key:
+                    self.persistent.put(key, entry)
+        return entry
+
+    def alias(self, key, entry, persist=True):
+        """別キー（例: SHA-256 でヒットしたときの ETag キー）にも同じ結果を登録（persist=False ならプロセス内のみ）"""
+        if not key:
+            return
+        self._fill_memory([key], entry)
+        if persist and self.persistent is not None:
+            self.persistent.put(key, entry)
+
+    def record(self, tier):
+        """1リクエストにつき1回、最終的なヒット/ミスを数える"""
+        with self._lock:
+            if tier == 'miss':
+                self.misses += 1
+            else:
+                self.hits += 1
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+    def _fill_memory(self, keys, entry):
+        size = len(entry.get('text', '').encode('utf-8'))
+        for key in keys:
+            if key:
+                self.memory.put(key, entry, size)
@@ -0,0 +1,78 @@
+"""PDF をページ範囲ごとに分割する（pypdf が使える場合のみ）
+
+分割した各チャンクは単独の PDF バイト列として抽出に渡す。ページ単位のキャッシュキーには、
+書き出した PDF のバイト列（/ID などで毎回変わり得る）ではなく、ページの内容ストリームと
+XObject（スキャン画像など）のハッシュを使う。
+"""
+import hashlib
+import re
+from io import BytesIO
+
+_PAGE_OBJECT = re.compile(rb'/Type\s*/Page(?![A-Za-z])')
+
+
+def _page_digest(page):
+    h = hashlib.sha256()
+    try:
+        contents = page.get_contents()
+        if contents is not None:
+            h.update(contents.get_data())
+        resources = page.get('/Resources')
+        xobjects = resources.get_object().get('/XObject') if resources is not None else None
+        if xobjects is not None:
+            xobjects = xobjects.get_object()
+            for name in sorted(xobjects.keys()):
+                obj = xobjects[name].get_object()
+                h.update(str(name).encode('utf-8'))
+                h.update(getattr(obj, '_data', b'') or b'')
+        h.update(repr(page.mediabox).encode('utf-8'))
+    except Exception:
+        return None
+    return h.hexdigest()
+
+
+def split_pdf(data, pages_per_chunk=1):
+    """[{'first': n, 'last': m, 'bytes': b, 'digest': d}] を返す。pypdf が無い/1ページのみ/壊れている場合は None"""
+    try:
+        from pypdf import PdfReader, PdfWriter
+    except ImportError:
+        return None
+    
+    try:
+        reader = PdfReader(BytesIO(data))
+        total = len(reader.pages)
+    except Exception as e:
+        print(f'PDF split failed: {str(e)}')
+        return None
+    if total <= 1:
+        return None
+    
+    step = max(1, int(pages_per_chunk))
+    chunks = []
+    for first in range(0, total, step):
+        last = min(first + step, total)
+        writer = PdfWriter()
+        digests = []
+        for i in range(first, last):
+            page = reader.pages[i]
+            writer.add_page(page)
+            digests.append(_page_digest(page))
+        buf = BytesIO()
+        writer.write(buf)
+        digest = None
+        if all(digests):
+            digest = 'pdfpage:' + hashlib.sha256('|'.join(digests).encode('utf-8')).hexdigest()
+        chunks.append({'first': first + 1, 'last': last, 'bytes': buf.getvalue(), 'digest': digest})
+    return chunks
+
+
+def count_pages(data):
+    """ページ数。pypdf で数え、pypdf が無い/開けない場合だけ /Type /Page の出現数で概算する
+
+    概算は圧縮されたオブジェクトストリーム内のページを数えられない（その場合は 1 になる）。
+    """
+    try:
+        from pypdf import PdfReader
+        return max(1, len(PdfReader(BytesIO(data)).pages))
+    except Exception:
+        return max(1, len(_PAGE_OBJECT.findall(data)))
@@ -0,0 +1,97 @@
+"""S3 オブジェクトの単一 GET 取得
+
+HEAD + GET の2往復をやめ、GET 応答のメタデータ（ETag / ContentLength / ContentType）を使う。
+本体は先頭数KBだけ先に読んでマジックバイトで種別を判定し、非対応・サイズ超過なら
+残りを読まずに打ち切る。本文は ContentLength 分を確保したバッファへ流し込む。
+"""
+import os
+
+FETCH_SNIFF_BYTES = int(os.environ.get('FETCH_SNIFF_BYTES', '8192'))
+FETCH_CHUNK_BYTES = int(os.environ.get('FETCH_CHUNK_BYTES', str(1024 * 1024)))
+MAX_OBJECT_BYTES = int(os.environ.get('MAX_OBJECT_BYTES', str(50 * 1024 * 1024)))
+
+
+class UnsupportedObject(Exception):
+    """非対応の形式（415）、サイズ上限超過（413）、または空のオブジェクト（400）"""
+
+    def __init__(self, message, status=415):
+        super().__init__(message)
+        self.status = status
+
+
+def sniff_type(head):
+    """先頭バイトから 'pdf' | 'png' | 'jpeg' | 'gif' | 'webp' を判定（不明なら None）"""
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'jpeg'
+    if head.startswith((b'GIF87a', b'GIF89a')):
+        return 'gif'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    # PDF は先頭 1024 バイト以内にヘッダがあればよい（仕様上の許容）
+    if b'%PDF-' in head[:1024]:
+        return 'pdf'
+    return None
+
+
+def _read_into(body, view, pos, limit):
+    while pos < limit:
+        chunk = body.read(min(FETCH_CHUNK_BYTES, limit - pos))
+        if not chunk:
+            break
+        view[pos:pos + len(chunk)] = chunk
+        pos += len(chunk)
+    return pos
+
+
+class FetchedObject:
+    def __init__(self, body, length, head, kind, meta):
+        self.kind = kind
+        self.length = length
+        self.etag = meta.get('ETag')
+        self.content_type = meta.get('ContentType', '')
+        self.meta = meta
+        self._body = body
+        self._head = head
+
+    def read_all(self):
+        """残りを確保済みバッファへ読み込み、本体全体を返す"""
+        buf = bytearray(self.length)
+        view = memoryview(buf)
+        n = len(self._head)
+        view[:n] = self._head
+        n = _read_into(self._body, view, n, self.length)
+        self.close()
+        return bytes(view[:n]) if n < self.length else bytes(buf)
+
+    def close(self):
+        try:
+            self._body.close()
+        except Exception:
+            pass
+
+
+def open_object(s3_client, bucket, key):
+    """GET を1回だけ発行し、先頭を読んで種別判定した FetchedObject を返す"""
+    obj = s3_client.get_object(Bucket=bucket, Key=key)
+    body = obj['Body']
+    length = int(obj.get('ContentLength') or 0)
+    if length > MAX_OBJECT_BYTES:
+        body.close()
+        raise UnsupportedObject(f'ファイルサイズが上限を超えています（{length} > {MAX_OBJECT_BYTES} bytes）', status=413)
+    
+    head = bytearray(min(FETCH_SNIFF_BYTES, length))
+    n = _read_into(body, memoryview(head), 0, len(head))
+    head = bytes(head[:n])
+    if not head:
+        # 0 バイトのオブジェクトは形式の判定より先に「本文なし」として返す
+        body.close()
+        raise UnsupportedObject('S3から本文を取得できませんでした', status=400)
+    kind = sniff_type(head)
+    if kind is None:
+        body.close()
+        raise UnsupportedObject('対応していないファイル形式です（PDF / PNG / JPEG / GIF / WebP）')
+    
+    meta = {k: v for k, v in obj.items() if k != 'Body'}
+    return FetchedObject(body, length, head, kind, meta)
@@ -0,0 +1,180 @@
+"""トークン予算の見積もりと、長い抽出テキストからの関連箇所の選択
+
+問題生成のプロンプトに本文全体を埋め込むと、長い教材ではコストと待ち時間が文書の長さに比例して増える。
+本文が「問題数 × QUIZ_CONTEXT_TOKENS_PER_QUESTION」（上限 QUIZ_CONTEXT_MAX_TOKENS）に収まらない場合は、
+段落単位のチャンクに分け、プロセス内の BM25 索引で1問ごとにまだ扱っていない重要語を多く含むチャンクを選んで予算内に詰める。
+生成の maxTokens も問題数から決める（文書の長さによらない）。
+
+トークン数は形態素解析なしの概算（かな・漢字は1文字≒1トークン、それ以外は4文字≒1トークン）。
+"""
+import math
+import os
+import re
+from collections import Counter
+
+# 問題生成: 本文の予算（1問あたり / 上限）と出力の maxTokens（固定分 + 1問あたり / 上限）
+QUIZ_CONTEXT_TOKENS_PER_QUESTION = int(os.environ.get('QUIZ_CONTEXT_TOKENS_PER_QUESTION', '800'))
+QUIZ_CONTEXT_MAX_TOKENS = int(os.environ.get('QUIZ_CONTEXT_MAX_TOKENS', '12000'))
+QUIZ_CHUNK_TOKENS = int(os.environ.get('QUIZ_CHUNK_TOKENS', '400'))
+QUIZ_KEYWORDS = int(os.environ.get('QUIZ_KEYWORDS', '64'))
+QUIZ_OUTPUT_BASE_TOKENS = int(os.environ.get('QUIZ_OUTPUT_BASE_TOKENS', '250'))
+QUIZ_OUTPUT_TOKENS_PER_QUESTION = int(os.environ.get('QUIZ_OUTPUT_TOKENS_PER_QUESTION', '250'))
+QUIZ_OUTPUT_MAX_TOKENS = int(os.environ.get('QUIZ_OUTPUT_MAX_TOKENS', '8192'))
+# 抽出: 1ページあたりの maxTokens（複数ページをまとめて送る場合はページ数倍、上限あり）
+OCR_TOKENS_PER_PAGE = int(os.environ.get('OCR_TOKENS_PER_PAGE', '1800'))
+OCR_MAX_TOKENS = int(os.environ.get('OCR_MAX_TOKENS', '8192'))
+
+_CJK_CLASS = '\u3040-\u30ff\u3400-\u9fff\uf900-\ufaff\uff66-\uff9f'  # かな・漢字・半角カナ
+_CJK = re.compile(f'[{_CJK_CLASS}]')
+_CJK_RUN = re.compile(f'[{_CJK_CLASS}]+')
+_WORD = re.compile(r'[A-Za-z0-9]+')
+_PARAGRAPH = re.compile(r'\n\s*\n')
+_SENTENCE = re.compile(r'(?<=[。．！？!?])')
+
+
+def estimate_tokens(text):
+    """トークン数の概算"""
+    if not text:
+        return 0
+    cjk = len(_CJK.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def quiz_max_tokens(num_questions):
+    """問題生成の maxTokens（問題数に比例。既定では5問で 1500）"""
+    return min(QUIZ_OUTPUT_BASE_TOKENS + QUIZ_OUTPUT_TOKENS_PER_QUESTION * max(1, num_questions), QUIZ_OUTPUT_MAX_TOKENS)
+
+
+def context_budget(num_questions):
+    """問題生成のプロンプトに入れる本文のトークン予算"""
+    return min(QUIZ_CONTEXT_TOKENS_PER_QUESTION * max(1, num_questions), QUIZ_CONTEXT_MAX_TOKENS)
+
+
+def ocr_max_tokens(pages=1):
+    """抽出の maxTokens（既定では1ページで 1800）"""
+    return min(OCR_TOKENS_PER_PAGE * max(1, pages), OCR_MAX_TOKENS)
+
+
+def signature():
+    """生成結果キャッシュのキーに含める設定（本文の選び方が変われば生成結果も変わる）"""
+    return f'ctx{QUIZ_CONTEXT_TOKENS_PER_QUESTION}/{QUIZ_CONTEXT_MAX_TOKENS}/{QUIZ_CHUNK_TOKENS}/{QUIZ_KEYWORDS}'
+
+
+def _units(text, max_tokens):
+    """(区切り, 断片) の並び。段落 → 行 → 文 の順に、max_tokens を超えない単位まで分ける"""
+    for p_no, paragraph in enumerate(p.strip() for p in _PARAGRAPH.split(text) if p.strip()):
+        sep = '\n\n' if p_no else ''
+        if estimate_tokens(paragraph) <= max_tokens:
+            yield sep, paragraph
+            continue
+        for l_no, line in enumerate(paragraph.split('\n')):
+            line_sep = sep if l_no == 0 else '\n'
+            if estimate_tokens(line) <= max_tokens:
+                yield line_sep, line
+                continue
+            for s_no, sentence in enumerate(s for s in _SENTENCE.split(line) if s):
+                s_sep = line_sep if s_no == 0 else ''
+                # 句点のない長い行は文字数で切る（かな・漢字なら max_tokens 文字 ≒ max_tokens トークン）
+                for i in range(0, len(sentence), max_tokens):
+                    yield (s_sep if i == 0 else ''), sentence[i:i + max_tokens]
+
+
+def split_chunks(text, max_tokens=QUIZ_CHUNK_TOKENS):
+    """段落の境目で区切ったチャンクのリスト（各チャンクは max_tokens 以下。長い段落だけ行・文で分ける）"""
+    chunks = []
+    current = ''
+    current_tokens = 0
+    for sep, unit in _units(text, max_tokens):
+        tokens = estimate_tokens(unit)
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append(current)
+            current, current_tokens = '', 0
+        current += (sep if current else '') + unit
+        current_tokens += tokens
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def terms(text):
+    """検索語（英数字は小文字の単語、かな・漢字は文字 bigram。形態素解析なしで日本語を扱う）"""
+    out = [w.lower() for w in _WORD.findall(text)]
+    for run in _CJK_RUN.findall(text):
+        if len(run) == 1:
+            out.append(run)
+        else:
+            out.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return out
+
+
+class Bm25Index:
+    """チャンク単位の BM25 索引（プロセス内・リクエストごとに構築）"""
+
+    def __init__(self, docs, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.tfs = [Counter(terms(d)) for d in docs]
+        self.lengths = [sum(tf.values()) for tf in self.tfs]
+        self.avg_length = (sum(self.lengths) / len(docs)) if docs else 0
+        df = Counter()
+        for tf in self.tfs:
+            df.update(tf.keys())
+        n = len(docs)
+        self.idf = {t: math.log(1 + (n - d + 0.5) / (d + 0.5)) for t, d in df.items()}
+
+    def score(self, i, query):
+        """チャンク i の query（語 → 重み）に対するスコア"""
+        tf = self.tfs[i]
+        norm = self.k1 * (1 - self.b + self.b * self.lengths[i] / (self.avg_length or 1))
+        total = 0.0
+        for term, weight in query.items():
+            f = tf.get(term)
+            if f:
+                total += weight * self.idf[term] * f * (self.k1 + 1) / (f + norm)
+        return total
+
+    def keywords(self, k):
+        """文書全体の重要語（出現数 × idf の上位 k 語）。{語: 重み}"""
+        total = Counter()
+        for tf in self.tfs:
+            total.update(tf)
+        ranked = sorted(total.items(), key=lambda item: -item[1] * self.idf[item[0]])
+        return {t: n * self.idf[t] for t, n in ranked[:k]}
+
+
+def select_context(text, num_questions):
+    """問題数に応じた予算内の本文と、選び方のメタデータを返す
+
+    予算に収まる本文はそのまま。収まらない場合は、1問ごとに「まだ選んだチャンクで扱っていない重要語」を
+    最も多く含むチャンクを選び（既に含まれた語は重みを下げる）、予算が尽きるまで続けて元の順に並べる。
+    """
+    budget = context_budget(num_questions)
+    total = estimate_tokens(text)
+    if total <= budget:
+        return text, {'tokens': total, 'budget': budget}
+    chunks = split_chunks(text)
+    sizes = [estimate_tokens(c) for c in chunks]
+    index = Bm25Index(chunks)
+    keywords = index.keywords(QUIZ_KEYWORDS)
+    covered = Counter()
+    selected = []
+    used = 0
+    remaining = set(range(len(chunks)))
+    while remaining:
+        query = {t: w / (1 + covered[t]) for t, w in keywords.items()}
+        fits = [i for i in remaining if used + sizes[i] <= budget]
+        if not fits:
+            break
+        best = max(fits, key=lambda i: (index.score(i, query), -i))
+        selected.append(best)
+        remaining.discard(best)
+        used += sizes[best]
+        covered.update(t for t in keywords if t in index.tfs[best])
+    selected.sort()
+    return '\n\n'.join(chunks[i] for i in selected), {
+        'tokens': used,
+        'budget': budget,
+        'documentTokens': total,
+        'chunks': len(chunks),
+        'selected': len(selected)
+    }
@@ -2,8 +2,12 @@ import json
 import os
 import logging
 import secrets
+import threading
 import time
-from typing import Any, Dict, Tuple, Optional
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+import compression
+import metrics
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -12,6 +16,37 @@ AWS_REGION = os.getenv("AWS_REGION", os.getenv("AWS_DEFAULT_REGION", "us-west-2"
 AGENTCORE_ARN = os.getenv("AGENTCORE_ARN", "")
 AGENTCORE_QUALIFIER = os.getenv("AGENTCORE_QUALIFIER", "")  # 省略時は DEFAULT が使われる
 INVOCATION_MODE = os.getenv("INVOCATION_MODE", "mock").lower()  # mock | sdk
+BOTO_MAX_POOL_CONNECTIONS = int(os.getenv("BOTO_MAX_POOL_CONNECTIONS", "32"))
+BOTO_MAX_ATTEMPTS = int(os.getenv("BOTO_MAX_ATTEMPTS", "4"))
+BOTO_CONNECT_TIMEOUT = float(os.getenv("BOTO_CONNECT_TIMEOUT", "5"))
+BOTO_READ_TIMEOUT = float(os.getenv("BOTO_READ_TIMEOUT", "60"))
+AGENTCORE_STREAM_CHUNK = int(os.getenv("AGENTCORE_STREAM_CHUNK", "8192"))
+
+# boto3 クライアントはウォームコンテナ間で使い回す（セッション/エンドポイント解決/HTTP プールの再構築を避ける）
+_CLIENTS: Dict[str, Any] = {}
+_CLIENTS_LOCK = threading.Lock()
+
+
+def _client(service: str):
+    c = _CLIENTS.get(service)
+    if c is not None:
+        return c
+    with _CLIENTS_LOCK:
+        c = _CLIENTS.get(service)
+        if c is None:
+            import boto3
+            from botocore.config import Config
+            cfg = Config(
+                region_name=AWS_REGION,
+                max_pool_connections=BOTO_MAX_POOL_CONNECTIONS,
+                tcp_keepalive=True,
+                connect_timeout=BOTO_CONNECT_TIMEOUT,
+                read_timeout=BOTO_READ_TIMEOUT,
+                retries={"max_attempts": BOTO_MAX_ATTEMPTS, "mode": "adaptive"},
+            )
+            c = boto3.client(service, config=cfg)
+            _CLIENTS[service] = c
+    return c
 
 
 def _resp(status: int, body: Dict[str, Any]) -> Dict[str, Any]:
@@ -20,7 +55,7 @@ def _resp(status: int, body: Dict[str, Any]) -> Dict[str, Any]:
         "headers": {
             "access-control-allow-origin": "*",
             "access-control-allow-methods": "POST,OPTIONS",
-            "access-control-allow-headers": "content-type",
+            "access-control-allow-headers": "content-type,content-encoding",
             "content-type": "application/json",
         },
         "body": json.dumps(body, ensure_ascii=False),
@@ -28,14 +63,13 @@ def _resp(status: int, body: Dict[str, Any]) -> Dict[str, Any]:
 
 
 def _parse_body(event: Dict[str, Any]) -> Tuple[Dict[str, Any], str]:
-    body_raw = event.get("body") if isinstance(event, dict) else None
-    if body_raw and isinstance(body_raw, str):
-        try:
-            body = json.loads(body_raw)
-            return body, "json"
-        except Exception:
-            pass
-    # API GWのlambda-proxyで body が Base64 のケースに対応（今回は未使用）
+    # API GW の lambda-proxy で body が Base64（バイナリメディアタイプ */*）でも読めるようにする
+    try:
+        body_raw = compression.request_body(event)
+        if body_raw:
+            return json.loads(body_raw), "json"
+    except Exception:
+        pass
     return {}, "unknown"
 
 
@@ -57,6 +91,78 @@ def _new_session_id(prefix: str = "sess") -> str:
     return f"{prefix}-{ts36}-{rand}"
 
 
+def _iter_body_chunks(body_stream, chunk_size: int = AGENTCORE_STREAM_CHUNK) -> Iterator[bytes]:
+    if hasattr(body_stream, 'iter_chunks'):
+        yield from body_stream.iter_chunks(chunk_size)
+        return
+    while True:
+        chunk = body_stream.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+def _parse_event_line(line: bytes) -> Optional[Any]:
+    line = line.strip()
+    if not line or line.startswith(b':'):
+        return None
+    if line.startswith(b'data:'):
+        line = line[5:].strip()
+    elif line.startswith((b'event:', b'id:', b'retry:')):
+        return None
+    text = line.decode('utf-8', errors='replace')
+    if text == '[DONE]':
+        return None
+    try:
+        return json.loads(text)
+    except Exception:
+        return text
+
+
+def iter_agentcore_events(body_stream) -> Iterator[Any]:
+    """SSE / NDJSON のレスポンスをチャンク単位で読み、イベントを1件ずつ返す（全体をバッファしない）"""
+    buf = bytearray()
+    for chunk in _iter_body_chunks(body_stream):
+        buf += chunk
+        while True:
+            nl = buf.find(b'\n')
+            if nl < 0:
+                break
+            ev = _parse_event_line(bytes(buf[:nl]))
+            del buf[:nl + 1]
+            if ev is not None:
+                yield ev
+    ev = _parse_event_line(bytes(buf))
+    if ev is not None:
+        yield ev
+
+
+def _merge_event(acc: Dict[str, Any], ev: Any) -> None:
+    # 文字列はテキスト断片、{"question": ...} は1問分、{"questions": [...]} はその時点のスナップショット
+    if isinstance(ev, str):
+        acc.setdefault('_text', []).append(ev)
+    elif isinstance(ev, dict):
+        if isinstance(ev.get('questions'), list):
+            acc['questions'] = list(ev['questions'])
+        elif 'question' in ev:
+            acc.setdefault('questions', []).append(ev)
+        else:
+            acc.update(ev)
+
+
+def _finish_events(acc: Dict[str, Any]) -> Dict[str, Any]:
+    text = ''.join(acc.pop('_text', []))
+    if text and 'result' not in acc:
+        acc['result'] = text
+    return acc
+
+
+def _is_event_stream(content_type: str) -> bool:
+    ct = (content_type or '').lower()
+    return 'event-stream' in ct or 'ndjson' in ct or 'jsonl' in ct
+
+
+@metrics.timed("AgentCoreMs")
 def invoke_agentcore_via_sdk(payload: Dict[str, Any], session_id: Optional[str] = None) -> Dict[str, Any]:
     """
     TODO: AgentCore の正式な SDK 呼び出しを実装してください。
@@ -69,9 +175,7 @@ def invoke_agentcore_via_sdk(payload: Dict[str, Any], session_id: Optional[str]
         resp = client.invoke(runtimeArn=AGENTCORE_ARN, payload=json.dumps(payload).encode('utf-8'))
         return json.loads(resp['body'])
     """
-    import boto3
-
-    client = boto3.client('bedrock-agentcore', region_name=AWS_REGION)
+    client = _client('bedrock-agentcore')
 
     runtime_session_id = session_id or payload.get('session_id') or _new_session_id()
 
@@ -85,7 +189,13 @@ def invoke_agentcore_via_sdk(payload: Dict[str, Any], session_id: Optional[str]
 
     resp = client.invoke_agent_runtime(**req)
     body_stream = resp.get('response')
-    if hasattr(body_stream, 'read'):
+    if hasattr(body_stream, 'read') and _is_event_stream(resp.get('contentType', '')):
+        # ストリーミング応答: 届いたイベントから順に反映する
+        acc: Dict[str, Any] = {}
+        for ev in iter_agentcore_events(body_stream):
+            _merge_event(acc, ev)
+        data = _finish_events(acc)
+    elif hasattr(body_stream, 'read'):
         raw = body_stream.read()
         try:
             data = json.loads(raw)
@@ -99,6 +209,8 @@ def invoke_agentcore_via_sdk(payload: Dict[str, Any], session_id: Optional[str]
     return data if isinstance(data, dict) else { 'result': data }
 
 
+@metrics.instrument("agentcore-invoke")
+@compression.negotiated
 def handler(event, context):
     if event.get("httpMethod") == "OPTIONS":
         return _resp(200, {"ok": True})
@@ -106,6 +218,7 @@ def handler(event, context):
     try:
         body, _ = _parse_body(event)
         ok, kind = _validate_payload(body)
+        metrics.set_property("PayloadKind", kind)
         if not ok:
             return _resp(400, {"error": kind, "usage": {
                 "prompt": {"prompt": "任意の文字列"},
@@ -1,29 +1,142 @@
 // getPresignedUrl (Node.js 20)
-import { S3Client, PutObjectCommand } from "@aws-sdk/client-s3";
+import {
+  S3Client, PutObjectCommand, CreateMultipartUploadCommand, UploadPartCommand,
+  CompleteMultipartUploadCommand, AbortMultipartUploadCommand, ListPartsCommand
+} from "@aws-sdk/client-s3";
 import { getSignedUrl } from "@aws-sdk/s3-request-presigner";
 
 const s3 = new S3Client({ region: process.env.AWS_REGION });
 const BUCKET = process.env.BUCKET;
+const URL_EXPIRES_SEC = 900; // 15分
+// マルチパート: パートサイズ（S3 の下限は 5MiB、パート数の上限は 10000）
+const MULTIPART_PART_BYTES = Math.max(5 * 1024 * 1024, Number(process.env.MULTIPART_PART_BYTES || 8 * 1024 * 1024));
+const MULTIPART_MAX_PARTS = 10000;
+const UPLOAD_PREFIX = "uploads/";
 
+// action: 省略時は単一 PUT の URL。create / resume / complete / abort はマルチパート
 export const handler = async (event) => {
   try {
     const body = parseBody(event);
-    const { filename, contentType } = body;
-
     if (!BUCKET) return res(500, { error: "環境変数 BUCKET が未設定です" });
-    if (!filename) return res(400, { error: "filename が必要です" });
-
-    const Key = `uploads/${Date.now()}_${sanitize(filename)}`;
-    const cmd = new PutObjectCommand({ Bucket: BUCKET, Key, ContentType: contentType || "application/octet-stream" });
-    const url = await getSignedUrl(s3, cmd, { expiresIn: 900 }); // 15分
 
-    return res(200, { url, key: Key, bucket: BUCKET });
+    switch (body.action || "put") {
+      case "put": return await presignPut(body);
+      case "create": return await createMultipart(body);
+      case "resume": return await resumeMultipart(body);
+      case "complete": return await completeMultipart(body);
+      case "abort": return await abortMultipart(body);
+      default: return res(400, { error: `不明な action です: ${body.action}` });
+    }
   } catch (e) {
     console.error(e);
-    return res(500, { error: String(e?.message || e) });
+    const status = e?.$metadata?.httpStatusCode;
+    if (e?.name === "NoSuchUpload") return res(404, { error: "アップロードが見つかりません（完了済み・中止済み・期限切れ）" });
+    return res(status >= 400 && status < 500 ? status : 500, { error: String(e?.message || e) });
   }
 };
 
+async function presignPut({ filename, contentType }){
+  if (!filename) return res(400, { error: "filename が必要です" });
+  const Key = newKey(filename);
+  const cmd = new PutObjectCommand({ Bucket: BUCKET, Key, ContentType: contentType || "application/octet-stream" });
+  const url = await getSignedUrl(s3, cmd, { expiresIn: URL_EXPIRES_SEC });
+
+  return res(200, { url, key: Key, bucket: BUCKET });
+}
+
+// マルチパートを開始し、全パートの署名付き URL を返す
+async function createMultipart({ filename, contentType, size }){
+  if (!filename) return res(400, { error: "filename が必要です" });
+  size = Number(size);
+  if (!Number.isFinite(size) || size <= 0) return res(400, { error: "size（バイト数）が必要です" });
+  const partSize = Math.max(MULTIPART_PART_BYTES, Math.ceil(size / MULTIPART_MAX_PARTS));
+  const partCount = Math.ceil(size / partSize);
+
+  const Key = newKey(filename);
+  const created = await s3.send(new CreateMultipartUploadCommand({
+    Bucket: BUCKET, Key, ContentType: contentType || "application/octet-stream"
+  }));
+  const numbers = Array.from({ length: partCount }, (_, i) => i + 1);
+
+  return res(200, {
+    mode: "multipart", bucket: BUCKET, key: Key, uploadId: created.UploadId,
+    partSize, partCount, parts: await signParts(Key, created.UploadId, numbers), expiresIn: URL_EXPIRES_SEC
+  });
+}
+
+// 中断後の再開: S3 に届いているパートを返し、未送信パートの URL を署名し直す（URL の期限切れにも使う）
+async function resumeMultipart({ key, uploadId, partCount }){
+  const invalid = checkUpload(key, uploadId);
+  if (invalid) return invalid;
+  partCount = Number(partCount);
+  if (!Number.isInteger(partCount) || partCount <= 0 || partCount > MULTIPART_MAX_PARTS) {
+    return res(400, { error: "partCount が必要です" });
+  }
+  const uploaded = await listParts(key, uploadId);
+  const done = new Set(uploaded.map(p => p.partNumber));
+  const missing = [];
+  for (let n = 1; n <= partCount; n++) if (!done.has(n)) missing.push(n);
+
+  return res(200, {
+    mode: "multipart", bucket: BUCKET, key, uploadId,
+    uploaded, parts: await signParts(key, uploadId, missing), expiresIn: URL_EXPIRES_SEC
+  });
+}
+
+// parts（{ partNumber, etag }）省略時は S3 に届いているパートで完了する
+async function completeMultipart({ key, uploadId, parts }){
+  const invalid = checkUpload(key, uploadId);
+  if (invalid) return invalid;
+  const list = Array.isArray(parts) && parts.length ? parts : await listParts(key, uploadId);
+  const done = await s3.send(new CompleteMultipartUploadCommand({
+    Bucket: BUCKET, Key: key, UploadId: uploadId,
+    MultipartUpload: {
+      Parts: list
+        .map(p => ({ PartNumber: Number(p.partNumber), ETag: p.etag }))
+        .sort((a, b) => a.PartNumber - b.PartNumber)
+    }
+  }));
+
+  return res(200, { key, bucket: BUCKET, etag: done.ETag });
+}
+
+async function abortMultipart({ key, uploadId }){
+  const invalid = checkUpload(key, uploadId);
+  if (invalid) return invalid;
+  await s3.send(new AbortMultipartUploadCommand({ Bucket: BUCKET, Key: key, UploadId: uploadId }));
+
+  return res(200, { key, bucket: BUCKET, aborted: true });
+}
+
+function signParts(Key, UploadId, numbers){
+  return Promise.all(numbers.map(async PartNumber => ({
+    partNumber: PartNumber,
+    url: await getSignedUrl(s3, new UploadPartCommand({ Bucket: BUCKET, Key, UploadId, PartNumber }), { expiresIn: URL_EXPIRES_SEC })
+  })));
+}
+
+async function listParts(Key, UploadId){
+  const parts = [];
+  let marker;
+  do {
+    const page = await s3.send(new ListPartsCommand({ Bucket: BUCKET, Key, UploadId, PartNumberMarker: marker }));
+    for (const p of page.Parts || []) parts.push({ partNumber: p.PartNumber, etag: p.ETag, size: p.Size });
+    marker = page.IsTruncated ? page.NextPartNumberMarker : undefined;
+  } while (marker);
+  return parts;
+}
+
+// このエンドポイントが発行したキー（uploads/ 配下）以外は操作させない
+function checkUpload(key, uploadId){
+  if (typeof key !== "string" || !key.startsWith(UPLOAD_PREFIX) || key.includes("..")) return res(400, { error: "key が不正です" });
+  if (typeof uploadId !== "string" || !uploadId) return res(400, { error: "uploadId が必要です" });
+  return null;
+}
+
+function newKey(filename){
+  return `${UPLOAD_PREFIX}${Date.now()}_${sanitize(filename)}`;
+}
+
 function res(code, body){
   return {
     statusCode: code,
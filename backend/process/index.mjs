@@ -1,9 +1,14 @@
-import { S3Client, GetObjectCommand, HeadObjectCommand } from "@aws-sdk/client-s3";
+import { S3Client, GetObjectCommand } from "@aws-sdk/client-s3";
 import { BedrockRuntimeClient, ConverseCommand } from "@aws-sdk/client-bedrock-runtime";
 
 const s3 = new S3Client({ region: process.env.AWS_REGION });
 const br = new BedrockRuntimeClient({ region: process.env.AWS_REGION });
 const MODEL_ID = process.env.BEDROCK_MODEL_ID; // 例: anthropic.claude-3-7-sonnet-20250219-v1:0 等
+const SNIFF_BYTES = Number(process.env.FETCH_SNIFF_BYTES || 8192);
+const MAX_OBJECT_BYTES = Number(process.env.MAX_OBJECT_BYTES || 50 * 1024 * 1024);
+const QUIZ_LAYOUT = [["mcq", 3], ["cloze", 2]]; // 四択3＋穴埋め2
+const QUIZ_MAX_TOKENS = Number(process.env.QUIZ_MAX_TOKENS || 1500);
+const QUIZ_REPAIR_TOKENS_PER_QUESTION = Number(process.env.QUIZ_REPAIR_TOKENS_PER_QUESTION || 400);
 
 export const handler = async (event) => {
   try {
@@ -12,18 +17,12 @@ export const handler = async (event) => {
     if (!bucket || !key) return res(400, { error: "bucket,key が必要です" });
     if (!MODEL_ID) return res(500, { error: "環境変数 BEDROCK_MODEL_ID が未設定です" });
 
-    // S3: メタデータ（ContentType）と本体バイト
-    const head = await s3.send(new HeadObjectCommand({ Bucket: bucket, Key: key }));
-    const obj  = await s3.send(new GetObjectCommand({ Bucket: bucket, Key: key }));
-    const bytes = await obj.Body?.transformToByteArray();
+    // S3: GET 1回で取得（メタデータは GET 応答から）。先頭数KBで種別判定し、非対応なら残りを読まない
+    const fetched = await fetchObject(bucket, key);
+    if (fetched.error) return res(fetched.status, { error: fetched.error });
+    const { bytes, kind } = fetched;
     if (!bytes || !bytes.length) return res(400, { error: "S3から本文を取得できませんでした" });
-
-    // 種別判定（拡張子 or ContentType）
-    const lower = key.toLowerCase();
-    const ct = String(head.ContentType || "");
-    const isPDF = lower.endsWith(".pdf") || ct.includes("pdf");
-    const isPNG = lower.endsWith(".png") || ct.includes("png");
-    const isJPG = lower.endsWith(".jpg") || lower.endsWith(".jpeg") || ct.includes("jpeg") || ct.includes("jpg");
+    const isPDF = kind === "pdf";
 
     // --- Contentブロックを正しい型で構築 ---
     const content = [
@@ -39,10 +38,9 @@ export const handler = async (event) => {
         }
       });
     } else {
-      const fmt = isPNG ? "png" : "jpeg"; // 他に webp/gif なども可
       content.push({
         image: {
-          format: fmt,                // 画像は image ブロック
+          format: kind,               // 画像は image ブロック（png/jpeg/gif/webp）
           source: { bytes }
         }
       });
@@ -61,36 +59,30 @@ export const handler = async (event) => {
       .trim();
 
     if (!extracted) {
-      console.warn("No text extracted. bytes=", bytes.length, "ct=", ct);
+      console.warn("No text extracted. bytes=", bytes.length, "kind=", kind);
       return res(200, { extracted: "", note: "テキスト抽出に失敗しました（画像品質やモデル設定を確認）" });
     }
 
-    // 2) 問題生成（抽出テキストから）
-    const quizPrompt = [{
-      role: "user",
-      content: [{
-        text:
-`以下の本文から日本語の小テストを5問（四択3＋穴埋め2）で作成してください。
-各問に 正答・解説・根拠（本文の該当行） を含め、全体を JSON で返してください。
-出力は {"questions": Question[]} の形で返してください。
-Question: {"type": "mcq|cloze", "question": string, "choices"?: string[], "answer": string, "explanation": string, "sourceText": string}
-本文:
-${extracted}`
-      }]
-    }];
-
-    const quizResp = await br.send(new ConverseCommand({
-      modelId: MODEL_ID,
-      messages: quizPrompt,
-      inferenceConfig: { maxTokens: 1500, temperature: 0.2 }
-    }));
-
-    const quizText = quizResp.output?.message?.content
-      ?.map(b => b?.text || "")
-      .join("\n")
-      .trim();
+    // 2) 問題生成（抽出テキストから）。Question スキーマで検証し、途中切れ・不正で足りない問題だけ追加で依頼する
+    const quizText = await converseText(quizPrompt(extracted, QUIZ_LAYOUT), QUIZ_MAX_TOKENS);
+    const parsed = parseQuiz(quizText);
+    let [questions, missing] = selectQuestions(parsed.questions, QUIZ_LAYOUT);
+    const parse = { status: parsed.status, truncated: parsed.truncated, invalid: parsed.invalid.length, rerequested: 0 };
+    if (missing.length) {
+      const count = missing.reduce((n, [, c]) => n + c, 0);
+      console.warn(`Quiz output incomplete (${parsed.status}), requesting ${describeLayout(missing)}`);
+      parse.rerequested = count;
+      const moreText = await converseText(
+        quizPrompt(extracted, missing, questions.map(q => q.question)),
+        QUIZ_REPAIR_TOKENS_PER_QUESTION * count + 200
+      );
+      [questions, missing] = selectQuestions(questions.concat(parseQuiz(moreText).questions), QUIZ_LAYOUT);
+    }
+    parse.missing = missing.reduce((n, [, c]) => n + c, 0);
 
-    return res(200, { extractedPreview: extracted.slice(0, 400), quiz: safeJson(quizText) });
+    // 1問も取り出せなければ従来どおりモデルの出力文字列を返す
+    const quiz = questions.length ? { questions, parse } : quizText;
+    return res(200, { extractedPreview: extracted.slice(0, 400), quiz });
 
   } catch (e) {
     console.error(e);
@@ -98,6 +90,49 @@ ${extracted}`
   }
 };
 
+// マジックバイトで種別判定（拡張子や ContentType には頼らない）
+function sniffType(head){
+  const startsWith = (sig) => sig.every((b, i) => head[i] === b);
+  if (startsWith([0x89, 0x50, 0x4e, 0x47, 0x0d, 0x0a, 0x1a, 0x0a])) return "png";
+  if (startsWith([0xff, 0xd8, 0xff])) return "jpeg";
+  const ascii = Buffer.from(head.subarray(0, 1024)).toString("latin1");
+  if (ascii.startsWith("GIF87a") || ascii.startsWith("GIF89a")) return "gif";
+  if (ascii.startsWith("RIFF") && ascii.slice(8, 12) === "WEBP") return "webp";
+  if (ascii.includes("%PDF-")) return "pdf";
+  return null;
+}
+
+// GetObject の本体を ContentLength 分の確保済みバッファへ流し込む
+async function fetchObject(bucket, key){
+  const obj = await s3.send(new GetObjectCommand({ Bucket: bucket, Key: key }));
+  const length = Number(obj.ContentLength || 0);
+  if (length > MAX_OBJECT_BYTES) {
+    obj.Body?.destroy?.();
+    return { status: 413, error: `ファイルサイズが上限を超えています（${length} > ${MAX_OBJECT_BYTES} bytes）` };
+  }
+  if (!length) {
+    // 0 バイトのオブジェクトは形式の判定より先に「本文なし」として返す
+    obj.Body?.destroy?.();
+    return { status: 400, error: "S3から本文を取得できませんでした" };
+  }
+  const buf = new Uint8Array(length);
+  let pos = 0, kind = null;
+  for await (const chunk of obj.Body) {
+    buf.set(chunk.subarray(0, length - pos), pos);
+    pos += Math.min(chunk.length, length - pos);
+    if (!kind && (pos >= SNIFF_BYTES || pos >= length)) {
+      kind = sniffType(buf.subarray(0, pos));
+      if (!kind) {
+        obj.Body.destroy?.();
+        return { status: 415, error: "対応していないファイル形式です（PDF / PNG / JPEG / GIF / WebP）" };
+      }
+    }
+  }
+  if (!kind) kind = sniffType(buf.subarray(0, pos));
+  if (!kind) return { status: 415, error: "対応していないファイル形式です（PDF / PNG / JPEG / GIF / WebP）" };
+  return { bytes: buf.subarray(0, pos), kind, etag: obj.ETag, contentType: obj.ContentType };
+}
+
 function res(code, body){
   return {
     statusCode: code,
@@ -113,4 +148,157 @@ function parseBody(event){
   return {};
 }
 
-function safeJson(s) { try { return JSON.parse(s); } catch { return s; } }
+async function converseText(prompt, maxTokens){
+  const resp = await br.send(new ConverseCommand({
+    modelId: MODEL_ID,
+    messages: [{ role: "user", content: [{ text: prompt }] }],
+    inferenceConfig: { maxTokens, temperature: 0.2 }
+  }));
+  return (resp.output?.message?.content?.map(b => b?.text || "").join("\n") || "").trim();
+}
+
+function quizPrompt(extracted, layout, exclude = []){
+  const avoid = exclude.length ? `次の問題とは重複しないようにしてください:\n${exclude.map(q => `- ${q}`).join("\n")}\n` : "";
+  return `以下の本文から日本語の小テストを${describeLayout(layout)}で作成してください。
+各問に 正答・解説・根拠（本文の該当行） を含め、全体を JSON で返してください。
+出力は {"questions": Question[]} の形で返してください。
+Question: {"type": "mcq|cloze", "question": string, "choices"?: string[], "answer": string, "explanation": string, "sourceText": string}
+${avoid}本文:
+${extracted}`;
+}
+
+// ---- 問題 JSON の解析・修復・検証（Python 版 quiz_parser.py と同じ規則） ----
+const TYPE_LABELS = { mcq: "四択", cloze: "穴埋め" };
+const ALIASES = [
+  ["question", ["question", "title"]],
+  ["choices", ["choices", "options"]],
+  ["answer", ["answer", "correctAnswer"]],
+  ["explanation", ["explanation", "reason"]],
+  ["sourceText", ["sourceText", "source"]]
+];
+const CHOICE_LABELS = ["ABCD", "abcd", "ＡＢＣＤ", "アイウエ", "1234", "１２３４"];
+
+function describeLayout(layout){
+  const total = layout.reduce((n, [, c]) => n + c, 0);
+  return `${total}問（${layout.map(([t, c]) => `${TYPE_LABELS[t] || t}${c}`).join("＋")}）`;
+}
+
+// コードフェンスの中身を取り出し、最初の { か [ から始まる文字列にする
+function stripFence(s){
+  const fenced = /```[A-Za-z]*[ \t]*\n?([\s\S]*?)(?:```|$)/.exec(s);
+  if (s.includes("```") && fenced) s = fenced[1];
+  const starts = [s.indexOf("{"), s.indexOf("[")].filter(i => i >= 0);
+  return starts.length ? s.slice(Math.min(...starts)) : s.trim();
+}
+
+// 途中切れの JSON を、最後に完結した要素までで切って開いている括弧を閉じる。{ text, truncated }
+function repairJson(s){
+  const stack = [];
+  let inStr = false, esc = false, safe = null, arrayDepth = null, elemOpen = false;
+  for (let i = 0; i < s.length; i++) {
+    const c = s[i];
+    if (inStr) {
+      if (esc) esc = false;
+      else if (c === "\\") esc = true;
+      else if (c === '"') inStr = false;
+      continue;
+    }
+    if (c === '"') inStr = true;
+    else if (c === "{" || c === "[") {
+      if (c === "{" && arrayDepth !== null && stack.length === arrayDepth) elemOpen = true;
+      stack.push(c);
+      if (c === "[" && arrayDepth === null && (stack.join("") === "[" || stack.join("") === "{[")) arrayDepth = stack.length;
+      safe = [i + 1, stack.length];
+    } else if (c === "}" || c === "]") {
+      stack.pop();
+      if (c === "}" && stack.length === arrayDepth) elemOpen = false;
+      safe = [i + 1, stack.length];
+      if (!stack.length) return { text: s.slice(0, i + 1), truncated: false };
+    } else if (c === ",") safe = [i, stack.length];
+  }
+  if (!safe) return { text: "", truncated: false };
+  const closers = stack.slice(0, safe[1]).reverse().map(c => (c === "{" ? "}" : "]")).join("");
+  return { text: s.slice(0, safe[0]) + closers, truncated: elemOpen };
+}
+
+// 1問を正規化して検証する。[問題, null] または [null, 理由]
+function validateQuestion(q){
+  if (!q || typeof q !== "object" || Array.isArray(q)) return [null, "not an object"];
+  const out = {};
+  for (const [key, names] of ALIASES) {
+    const name = names.find(n => q[n] !== undefined && q[n] !== null && q[n] !== "");
+    if (name) out[key] = typeof q[name] === "number" ? String(q[name]) : q[name];
+  }
+  const type = String(q.type || (out.choices ? "mcq" : "cloze")).trim().toLowerCase();
+  if (!TYPE_LABELS[type]) return [null, `unknown type: ${type}`];
+  for (const key of ["question", "answer", "explanation", "sourceText"]) {
+    if (typeof out[key] !== "string" || !out[key].trim()) return [null, `missing ${key}`];
+  }
+  if (type === "mcq") {
+    if (!Array.isArray(out.choices) || out.choices.length < 2) return [null, "mcq needs at least 2 choices"];
+    out.choices = out.choices.map(c => String(c).trim());
+    if (!out.choices.every(Boolean)) return [null, "empty choice"];
+    out.answer = resolveAnswer(out.answer, out.choices);
+  } else if (out.choices !== undefined && !Array.isArray(out.choices)) {
+    delete out.choices;
+  }
+  return [{ type, ...out }, null];
+}
+
+// 「B」「2」などの記号・番号で答えた場合は選択肢の本文に置き換える
+function resolveAnswer(answer, choices){
+  answer = answer.trim();
+  if (choices.includes(answer)) return answer;
+  const m = /^\s*[(（]?([A-Da-dＡ-Ｄア-エ1-4１-４])[)）.．:：]?\s*$/.exec(answer);
+  if (m) {
+    for (const labels of CHOICE_LABELS) {
+      const idx = labels.indexOf(m[1]);
+      if (idx >= 0 && idx < choices.length) return choices[idx];
+    }
+  }
+  return answer;
+}
+
+// モデル出力から問題を取り出して検証する。{ questions, invalid, status: ok|repaired|unparsed, truncated }
+function parseQuiz(text){
+  const body = stripFence(String(text || ""));
+  let data = null, status = "ok", truncated = false;
+  try {
+    data = JSON.parse(body);
+  } catch {
+    const repaired = repairJson(body);
+    truncated = repaired.truncated;
+    try {
+      data = JSON.parse(repaired.text);
+      status = "repaired";
+    } catch {
+      status = "unparsed";
+    }
+  }
+  const items = Array.isArray(data) ? data : Array.isArray(data?.questions) ? data.questions : null;
+  if (!items) return { questions: [], invalid: [], status: "unparsed", truncated };
+  // 途中切れで閉じなかった最後の問題は項目が欠けているので除く
+  if (status === "repaired" && truncated) items.pop();
+  const questions = [], invalid = [];
+  items.forEach((item, index) => {
+    const [q, error] = validateQuestion(item);
+    if (error) invalid.push({ index, error });
+    else questions.push(q);
+  });
+  return { questions, invalid, status, truncated };
+}
+
+// layout に合わせて先頭から問題を選ぶ（問題文の重複は除く）。[選んだ問題, 不足分の layout]
+function selectQuestions(questions, layout){
+  const want = Object.fromEntries(layout);
+  const seen = new Set();
+  const picked = [];
+  for (const q of questions) {
+    const text = q.question.trim();
+    if (!(want[q.type] > 0) || seen.has(text)) continue;
+    want[q.type] -= 1;
+    seen.add(text);
+    picked.push(q);
+  }
+  return [picked, layout.filter(([t]) => want[t] > 0).map(([t]) => [t, want[t]])];
+}
@@ -0,0 +1,386 @@
+# Lambda ハンドラを1プロセスで常駐させる ASGI サービス（Lambda 外での実行用）
+#
+# Lambda では1コンテナが同時に1要求しか処理しないため、授業開始時のような集中ではコンテナが要求の数だけ起動し、
+# ウォームな boto3 クライアントや抽出・生成結果のキャッシュも共有されない。本サービスは Python 版の3つのハンドラ
+#
+#   /process           … process 関数（tdx2025dlambdaamplify02）の lambda_handler（抽出 → 問題生成）
+#   /events/s3         … 同じく lambda_handler。本文の S3 イベント（{"Records": [...]}）をそのまま渡す（先行抽出）
+#   /agentcore         … ジョブ関数（tdx2025dagentcoreinvoke）の handler（投入・状態取得。ワーカーはプロセス内のキュー）
+#   /agentcore/invoke  … backend/agentcore_invoke/app.py の handler（AgentCore への同期中継）
+#
+# を1プロセスに読み込み、HTTP の要求を API Gateway（REST, lambda-proxy）形式のイベントにして呼び出す。
+# ハンドラ（boto3 の呼び出しを含む同期処理）は上限付きのスレッドプールで実行し、ルートごとに同時実行数を制限する。
+# 上限を超えた要求は SERVICE_QUEUE_TIMEOUT_SEC まで待たせ、待ち行列も一杯なら 429（Retry-After 付き）を返す。
+#
+#   pip install -r backend/service/requirements.txt
+#   python backend/service/server.py --port 8080
+#   uvicorn --app-dir backend/service --factory server:create_app --port 8080   # 同じもの
+#
+# キャッシュを共有するため、ワーカープロセスは1つで動かす（uvicorn --workers を増やすとプロセスごとに分かれる）。
+
+import argparse
+import asyncio
+import base64
+import functools
+import importlib.util
+import itertools
+import json
+import logging
+import math
+import os
+import resource
+import sys
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl
+
+logger = logging.getLogger("service")
+logger.setLevel(logging.INFO)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+FUNCTIONS = os.path.join(ROOT, "amplify", "backend", "function")
+# ハンドラ名 -> (ソースのディレクトリ, モジュール, 関数)
+HANDLERS = {
+    "process": (os.path.join(FUNCTIONS, "tdx2025dlambdaamplify02", "src"), "index", "lambda_handler"),
+    "jobs": (os.path.join(FUNCTIONS, "tdx2025dagentcoreinvoke", "src"), "index", "handler"),
+    "relay": (os.path.join(ROOT, "backend", "agentcore_invoke"), "app", "handler"),
+}
+# パス -> (ルート名, ハンドラ名, 受け付けるメソッド, 本文をイベントそのものとして渡すか)
+ROUTES = {
+    "/process": ("process", "process", ("POST",), False),
+    "/events/s3": ("events", "process", ("POST",), True),
+    "/agentcore": ("jobs", "jobs", ("GET", "POST"), False),
+    "/agentcore/invoke": ("relay", "relay", ("POST",), False),
+}
+DEFAULT_ROUTE_LIMITS = {"process": 16, "events": 4, "jobs": 64, "relay": 16}
+
+SERVICE_HANDLERS = [h.strip() for h in os.getenv("SERVICE_HANDLERS", "process,jobs,relay").split(",") if h.strip()]
+SERVICE_ROUTE_LIMITS = os.getenv("SERVICE_ROUTE_LIMITS", "")  # 例: process=16,jobs=64（未指定のルートは既定値）
+SERVICE_QUEUE_DEPTH = int(os.getenv("SERVICE_QUEUE_DEPTH", "-1"))  # ルートごとの待ち行列の長さ（-1 で同時実行数と同じ）
+SERVICE_QUEUE_TIMEOUT_SEC = float(os.getenv("SERVICE_QUEUE_TIMEOUT_SEC", "5"))
+SERVICE_THREADS = int(os.getenv("SERVICE_THREADS", "0"))  # 0 でルートの同時実行数の合計
+SERVICE_TIMEOUT_SEC = float(os.getenv("SERVICE_TIMEOUT_SEC", "29"))  # context.get_remaining_time_in_millis の基準
+SERVICE_MAX_BODY_BYTES = int(os.getenv("SERVICE_MAX_BODY_BYTES", str(6 * 1024 * 1024)))  # Lambda の同期呼び出しと同じ
+
+CORS_HEADERS = {
+    "access-control-allow-origin": "*",
+    "access-control-allow-methods": "GET,POST,OPTIONS",
+    "access-control-allow-headers": "content-type,content-encoding,if-none-match",
+    "access-control-expose-headers": "etag",
+    "access-control-max-age": "600",
+}
+
+
+def _service_defaults() -> None:
+    """常駐させるときの既定値（ハンドラは設定をモジュールの読み込み時に読むので、読み込む前に整える）"""
+    # API Gateway を通らないのでバイナリメディアタイプの設定なしで圧縮できる
+    os.environ.setdefault("RESPONSE_COMPRESSION", "1")
+    # 起動時にクライアント生成と重いモジュールの import を済ませる（初回の要求に載せない）
+    os.environ.setdefault("INIT_MODE", "eager")
+    os.environ.setdefault("METRICS_SERVICE", "quiz-service")
+
+
+def _parse_limits(spec: str) -> Dict[str, int]:
+    limits = dict(DEFAULT_ROUTE_LIMITS)
+    for part in spec.split(","):
+        name, _, value = part.partition("=")
+        if name.strip() and value.strip():
+            limits[name.strip()] = int(value)
+    return limits
+
+
+def load_module(src: str, module: str, alias: str) -> Any:
+    """src ディレクトリの module を alias という名前で読み込む。
+
+    関数ごとに同名のモジュール（index、metrics、quiz_cache など）を持つため、読み込みの間だけ
+    そのディレクトリを sys.path の先頭に置き、他の関数の同名モジュールを sys.modules から外しておく。
+    読み込んだモジュールは自分の関数のモジュールを参照し続ける。
+    """
+    local = {f[:-3] for f in os.listdir(src) if f.endswith(".py")}
+    saved = {k: sys.modules.pop(k) for k in list(sys.modules) if k.split(".")[0] in local}
+    sys.path.insert(0, src)
+    try:
+        spec = importlib.util.spec_from_file_location(alias, os.path.join(src, f"{module}.py"))
+        mod = importlib.util.module_from_spec(spec)
+        sys.modules[spec.name] = mod
+        spec.loader.exec_module(mod)
+    finally:
+        sys.path.remove(src)
+        for k in [k for k in sys.modules if k.split(".")[0] in local]:
+            del sys.modules[k]
+        sys.modules.update(saved)
+    return mod
+
+
+def load_handler(name: str) -> Callable:
+    """ハンドラを読み込む（load_module で関数ごとに分けて読み込むので、キャッシュやクライアントはハンドラごと）"""
+    src, module, attr = HANDLERS[name]
+    return getattr(load_module(src, module, f"service_{name}"), attr)
+
+
+class RouteLimiter:
+    """ルートごとの同時実行数の上限と待ち行列（イベントループ上でだけ使う）"""
+
+    def __init__(self, name: str, limit: int, queue_depth: int, queue_timeout: float):
+        self.name = name
+        self.limit = max(1, limit)
+        self.queue_depth = self.limit if queue_depth < 0 else queue_depth
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.served = 0
+        self.rejected = 0
+        self.avg_sec = 1.0  # 処理時間の指数移動平均（Retry-After の見積もり）
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    async def acquire(self) -> bool:
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return True
+        if len(self._waiters) >= self.queue_depth or self.queue_timeout <= 0:
+            self.rejected += 1
+            return False
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.append(fut)
+        try:
+            # 空きができると release() がこの要求に枠を渡す（active はそのまま）
+            await asyncio.wait_for(fut, self.queue_timeout)
+            return True
+        except asyncio.TimeoutError:
+            if fut.done() and not fut.cancelled():
+                return True  # 期限と同時に枠を渡された
+            self.rejected += 1
+            return False
+        finally:
+            if fut in self._waiters:
+                self._waiters.remove(fut)
+
+    def release(self, elapsed_sec: float) -> None:
+        self.served += 1
+        self.avg_sec = 0.8 * self.avg_sec + 0.2 * elapsed_sec
+        while self._waiters:
+            fut = self._waiters.popleft()
+            if not fut.done():
+                fut.set_result(True)
+                return
+        self.active -= 1
+
+    def retry_after(self) -> int:
+        """待ち行列が捌けるまでのおおよその秒数"""
+        return max(1, math.ceil(self.avg_sec * (len(self._waiters) + 1) / self.limit))
+
+    def stats(self) -> Dict[str, Any]:
+        return {"limit": self.limit, "active": self.active, "waiting": len(self._waiters), "served": self.served,
+                "rejected": self.rejected, "avgMs": round(self.avg_sec * 1000, 1)}
+
+
+class LambdaContext:
+    """ハンドラに渡す Lambda の context の代わり"""
+
+    function_name = os.getenv("METRICS_SERVICE", "quiz-service")
+    memory_limit_in_mb = 0
+
+    def __init__(self, request_id: str, timeout_sec: float):
+        self.aws_request_id = request_id
+        self._deadline = time.monotonic() + timeout_sec
+
+    def get_remaining_time_in_millis(self) -> int:
+        return max(0, int((self._deadline - time.monotonic()) * 1000))
+
+
+def build_event(scope: Dict[str, Any], body: bytes, resource_path: str, request_id: str) -> Dict[str, Any]:
+    """ASGI の要求を API Gateway（REST, lambda-proxy）形式のイベントにする"""
+    headers: Dict[str, str] = {}
+    multi_headers: Dict[str, List[str]] = {}
+    for k, v in scope.get("headers") or []:
+        name, value = k.decode("latin-1").lower(), v.decode("latin-1")
+        headers[name] = f"{headers[name]},{value}" if name in headers else value
+        multi_headers.setdefault(name, []).append(value)
+    pairs = parse_qsl((scope.get("query_string") or b"").decode("latin-1"), keep_blank_values=True)
+    qs: Dict[str, str] = {}
+    multi_qs: Dict[str, List[str]] = {}
+    for k, v in pairs:
+        qs[k] = v
+        multi_qs.setdefault(k, []).append(v)
+    text: Optional[str] = None
+    if body and "content-encoding" not in headers:
+        try:
+            text = body.decode("utf-8")
+        except UnicodeDecodeError:
+            text = None
+    event: Dict[str, Any] = {
+        "resource": resource_path,
+        "path": scope.get("path") or resource_path,
+        "httpMethod": scope.get("method", "GET"),
+        "headers": headers,
+        "multiValueHeaders": multi_headers,
+        "queryStringParameters": qs or None,
+        "multiValueQueryStringParameters": multi_qs or None,
+        "body": (text if text is not None else base64.b64encode(body).decode("ascii")) if body else None,
+        "isBase64Encoded": bool(body) and text is None,
+        "requestContext": {
+            "requestId": request_id,
+            "resourcePath": resource_path,
+            "httpMethod": scope.get("method", "GET"),
+            "identity": {"sourceIp": (scope.get("client") or ("", 0))[0]},
+        },
+    }
+    return event
+
+
+def _response_parts(result: Any) -> Tuple[int, Dict[str, str], bytes]:
+    """Lambda の応答（lambda-proxy 形式）を HTTP のステータス・ヘッダー・本文にする"""
+    if not isinstance(result, dict) or "statusCode" not in result:
+        return 200, {"content-type": "application/json"}, json.dumps(result, ensure_ascii=False, default=str).encode()
+    headers = {str(k).lower(): str(v) for k, v in (result.get("headers") or {}).items()}
+    for k, values in (result.get("multiValueHeaders") or {}).items():
+        headers[str(k).lower()] = ",".join(str(v) for v in values)
+    body = result.get("body") or ""
+    data = base64.b64decode(body) if result.get("isBase64Encoded") else str(body).encode("utf-8")
+    return int(result.get("statusCode") or 200), headers, data
+
+
+class Service:
+    """ASGI アプリケーション。ハンドラの読み込み・ルーティング・同時実行の制御を行う"""
+
+    def __init__(self, handlers: Optional[List[str]] = None, route_limits: Optional[Dict[str, int]] = None,
+                 queue_depth: int = SERVICE_QUEUE_DEPTH, queue_timeout: float = SERVICE_QUEUE_TIMEOUT_SEC,
+                 threads: int = SERVICE_THREADS):
+        _service_defaults()
+        self.handlers: Dict[str, Callable] = {}
+        for name in handlers if handlers is not None else SERVICE_HANDLERS:
+            started = time.perf_counter()
+            self.handlers[name] = load_handler(name)
+            logger.info("loaded handler %s in %.1f ms", name, (time.perf_counter() - started) * 1000)
+        limits = route_limits or _parse_limits(SERVICE_ROUTE_LIMITS)
+        self.routes = {path: route for path, route in ROUTES.items() if route[1] in self.handlers}
+        self.limiters = {name: RouteLimiter(name, limits.get(name, 16), queue_depth, queue_timeout)
+                         for name, _, _, _ in self.routes.values()}
+        self.pool = ThreadPoolExecutor(max_workers=threads or sum(l.limit for l in self.limiters.values()),
+                                       thread_name_prefix="handler")
+        self.started_at = time.time()
+        self._ids = itertools.count(1)
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable[[], Awaitable[Dict[str, Any]]],
+                       send: Callable[[Dict[str, Any]], Awaitable[None]]) -> None:
+        if scope["type"] == "lifespan":
+            return await self._lifespan(receive, send)
+        if scope["type"] != "http":
+            return
+        path = scope.get("path") or "/"
+        method = scope.get("method", "GET").upper()
+        if path == "/healthz" and method == "GET":
+            return await self._send(send, 200, {"content-type": "application/json"},
+                                    json.dumps(self.stats()).encode())
+        route = self.routes.get(path.rstrip("/") or "/")
+        if route is None:
+            return await self._send_json(send, 404, {"error": "not found"})
+        name, handler_name, methods, raw_event = route
+        if method == "OPTIONS":
+            return await self._send(send, 204, dict(CORS_HEADERS), b"")
+        if method not in methods:
+            return await self._send_json(send, 405, {"error": f"{method} is not allowed"}, {"allow": ",".join(methods)})
+        body = await self._read_body(receive)
+        if body is None:
+            return await self._send_json(send, 413, {"error": "request body is too large"})
+
+        limiter = self.limiters[name]
+        if not await limiter.acquire():
+            return await self._send_json(send, 429, {"error": "too many requests"},
+                                         {"retry-after": str(limiter.retry_after())})
+        started = time.perf_counter()
+        try:
+            request_id = f"{uuid.uuid4().hex[:16]}-{next(self._ids)}"
+            if raw_event:
+                try:
+                    event = json.loads(body or b"{}")
+                except ValueError:
+                    return await self._send_json(send, 400, {"error": "body must be a JSON event"})
+            else:
+                event = build_event(scope, body, path.rstrip("/"), request_id)
+            fn = functools.partial(self.handlers[handler_name], event, LambdaContext(request_id, SERVICE_TIMEOUT_SEC))
+            try:
+                result = await asyncio.get_running_loop().run_in_executor(self.pool, fn)
+            except Exception as e:
+                logger.exception("handler %s failed", handler_name)
+                return await self._send_json(send, 500, {"error": str(e)})
+            status, headers, data = _response_parts(result)
+            await self._send(send, status, headers, data)
+        finally:
+            limiter.release(time.perf_counter() - started)
+
+    def stats(self) -> Dict[str, Any]:
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return {
+            "ok": True,
+            "uptimeSec": round(time.time() - self.started_at, 1),
+            "handlers": sorted(self.handlers),
+            "routes": {name: limiter.stats() for name, limiter in self.limiters.items()},
+            "peakRssMb": round(rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024, 1),
+        }
+
+    async def _lifespan(self, receive: Callable, send: Callable) -> None:
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.pool.shutdown(wait=False, cancel_futures=True)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    @staticmethod
+    async def _read_body(receive: Callable) -> Optional[bytes]:
+        chunks, size = [], 0
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                break
+            chunk = message.get("body") or b""
+            size += len(chunk)
+            if size > SERVICE_MAX_BODY_BYTES:
+                return None
+            chunks.append(chunk)
+            if not message.get("more_body"):
+                break
+        return b"".join(chunks)
+
+    @staticmethod
+    async def _send(send: Callable, status: int, headers: Dict[str, str], data: bytes) -> None:
+        headers = dict(headers, **{"content-length": str(len(data))})
+        await send({"type": "http.response.start", "status": status,
+                    "headers": [(k.encode("latin-1"), v.encode("latin-1")) for k, v in headers.items()]})
+        await send({"type": "http.response.body", "body": data})
+
+    async def _send_json(self, send: Callable, status: int, body: Dict[str, Any],
+                         headers: Optional[Dict[str, str]] = None) -> None:
+        h = dict(CORS_HEADERS, **{"content-type": "application/json"})
+        h.update(headers or {})
+        await self._send(send, status, h, json.dumps(body, ensure_ascii=False).encode("utf-8"))
+
+
+def create_app() -> Service:
+    """uvicorn --factory 用（import しただけではハンドラを読み込まない）"""
+    return Service()
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Python 版ハンドラを常駐させる ASGI サービス")
+    ap.add_argument("--host", default=os.getenv("SERVICE_HOST", "127.0.0.1"))
+    ap.add_argument("--port", type=int, default=int(os.getenv("SERVICE_PORT", "8080")))
+    ap.add_argument("--log-level", default="warning")
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    try:
+        import uvicorn
+    except ImportError:
+        raise SystemExit("uvicorn is required: pip install -r backend/service/requirements.txt")
+    # ループは1つ、ワーカープロセスも1つ（キャッシュとクライアントを全要求で共有する）
+    uvicorn.run(create_app(), host=args.host, port=args.port, log_level=args.log_level, workers=1,
+                timeout_keep_alive=30)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""boto3 クライアント再利用のマイクロベンチマーク
+
+ローカルのスタブ S3 エンドポイント（http.server）に対して、ワーカー1回分の
+S3 呼び出し（get → get → put）を次の2通りで実行し、1リクエストあたりの
+レイテンシを比較する。
+
+- before: 呼び出しごとに boto3.client(...) を生成（従来の実装）
+- after : tdx2025dagentcoreinvoke の `_client()` レジストリを使い回す（ジョブストアの S3 実装経由）
+
+使い方:
+    pip install boto3
+    python bench/bench_clients.py --requests 200
+"""
+import argparse
+import importlib.util
+import json
+import os
+import statistics
+import sys
+import time
+
+from stubs import StubS3Handler, serve
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+AGENTCORE_INDEX = os.path.join(ROOT, 'amplify', 'backend', 'function', 'tdx2025dagentcoreinvoke', 'src', 'index.py')
+
+
+def _load_index():
+    sys.path.insert(0, os.path.dirname(AGENTCORE_INDEX))  # scheduler などの同梱モジュール
+    spec = importlib.util.spec_from_file_location('agentcore_invoke_index', AGENTCORE_INDEX)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+
+def _summary(samples):
+    s = sorted(samples)
+    return {
+        'n': len(s),
+        'mean_ms': round(statistics.mean(s) * 1000, 3),
+        'p50_ms': round(s[len(s) // 2] * 1000, 3),
+        'p95_ms': round(s[min(len(s) - 1, int(len(s) * 0.95))] * 1000, 3),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--requests', type=int, default=100)
+    args = ap.parse_args()
+
+    server, endpoint = serve(StubS3Handler)
+
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'bench')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'bench')
+    os.environ['AWS_ENDPOINT_URL'] = endpoint
+    os.environ['AWS_REGION'] = 'us-west-2'
+
+    import boto3
+    index = _load_index()
+    from job_store import JOBS, S3JobStore
+    bucket, key = 'bench-bucket', 'jobs/bench.json'
+    doc = {'jobId': 'bench', 'status': 'RUNNING', 'payload': {'prompt': 'x' * 512}}
+    boto3.client('s3', region_name='us-west-2').put_object(Bucket=bucket, Key=key, Body=json.dumps(doc).encode('utf-8'))
+
+    def run_before():
+        for _ in range(2):
+            s3 = boto3.client('s3', region_name='us-west-2')
+            s3.get_object(Bucket=bucket, Key=key)['Body'].read()
+        s3 = boto3.client('s3', region_name='us-west-2')
+        s3.put_object(Bucket=bucket, Key=key, Body=json.dumps(doc).encode('utf-8'))
+
+    store = S3JobStore(index._client, bucket, {JOBS: 'jobs/'})
+
+    def run_after():
+        store.get(JOBS, 'bench')
+        store.get(JOBS, 'bench')
+        store.put(JOBS, 'bench', doc, previous=doc)  # 状態が変わらないので索引マーカーは書かない
+
+    results = {}
+    for name, fn in (('before', run_before), ('after', run_after)):
+        fn()  # ウォームアップ（after は初回だけクライアント生成）
+        samples = []
+        for _ in range(args.requests):
+            t0 = time.perf_counter()
+            fn()
+            samples.append(time.perf_counter() - t0)
+        results[name] = _summary(samples)
+
+    server.shutdown()
+    json.dump(results, sys.stdout, indent=2)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
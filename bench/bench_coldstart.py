@@ -0,0 +1,105 @@
+"""process 関数（tdx2025dlambdaamplify02）のコールドスタート計測
+
+新しいプロセスで `import index` → 初回リクエスト → 2回目のリクエスト を実行し、
+INIT_MODE=eager（従来どおり初期化時に boto3 クライアントを3つ生成）と
+INIT_MODE=lazy（初回使用時に生成）の所要時間を比較する。スタブは bench/stubs.py。
+
+- initMs        : モジュールの読み込み（Lambda の Init フェーズに相当）
+- firstMs       : 初回リクエスト（lazy ではクライアント生成を含む）
+- initPlusFirst : 初回の利用者から見た合計
+- warmMs        : 2回目のリクエスト
+
+使い方:
+    pip install boto3 Pillow
+    python bench/bench_coldstart.py --runs 5
+    python bench/bench_coldstart.py --importtime     # -X importtime の上位（累積時間順）も表示
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+from bench_handlers import BUCKET, HANDLERS, child_env, s3_put
+from fixtures import load_sample
+from stubs import StubAgentCoreHandler, StubBedrockHandler, StubS3Handler, serve
+
+SRC = HANDLERS['process'][0]
+CHILD = '''
+import json, sys, time
+sys.path.insert(0, {src!r})
+t0 = time.perf_counter()
+import index
+t1 = time.perf_counter()
+event = {{'body': json.dumps({body})}}
+ok = index.lambda_handler(event, None)['statusCode'] == 200
+t2 = time.perf_counter()
+index.lambda_handler(event, None)
+t3 = time.perf_counter()
+sys.stderr.write(json.dumps({{'initMs': (t1 - t0) * 1000, 'firstMs': (t2 - t1) * 1000, 'warmMs': (t3 - t2) * 1000, 'ok': ok}}) + '\\n')
+'''
+
+
+def run_once(mode, body, env):
+    env = dict(env, INIT_MODE=mode)
+    code = CHILD.format(src=SRC, body=json.dumps(body))
+    proc = subprocess.run([sys.executable, '-c', code], env=env, stdout=subprocess.DEVNULL,
+                          stderr=subprocess.PIPE, text=True)
+    last = (proc.stderr or '').strip().splitlines()[-1:] or ['{}']
+    try:
+        return json.loads(last[0])
+    except ValueError:
+        raise SystemExit(proc.stderr)
+
+
+def import_report(env, top):
+    """-X importtime の出力を累積時間順に並べる（index が直接・間接に読み込む上位のモジュール）"""
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import sys; sys.path.insert(0, {SRC!r}); import index'],
+                          env=dict(env, INIT_MODE='lazy'), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2  # 名前の字下げが import の入れ子の深さ
+        if depth <= 1:
+            rows.append({'module': name.strip(), 'selfMs': int(self_us) / 1000, 'cumulativeMs': int(cumulative_us) / 1000})
+    rows.sort(key=lambda r: -r['cumulativeMs'])
+    return rows[:top]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--runs', type=int, default=5)
+    ap.add_argument('--structured', action='store_true', help='AgentCore 経由の要求で計測する')
+    ap.add_argument('--importtime', action='store_true')
+    ap.add_argument('--top', type=int, default=15)
+    args = ap.parse_args()
+
+    servers = {name: serve(cls) for name, cls in
+               (('s3', StubS3Handler), ('bedrock', StubBedrockHandler), ('agentcore', StubAgentCoreHandler))}
+    endpoints = {name: url for name, (_, url) in servers.items()}
+    s3_put(endpoints['s3'], 'uploads/coldstart.png', load_sample('test.png'))
+    body = {'bucket': BUCKET, 'key': 'uploads/coldstart.png'}
+    if args.structured:
+        body.update(target='高校生', difficulty='普通', num_questions=5)
+    env = child_env(argparse.Namespace(concurrency=4, metrics=False, cache=True), endpoints)
+
+    report = {}
+    for mode in ('eager', 'lazy'):
+        runs = [run_once(mode, body, env) for _ in range(args.runs)]
+        med = {k: round(statistics.median(r[k] for r in runs), 1) for k in ('initMs', 'firstMs', 'warmMs')}
+        med['initPlusFirstMs'] = round(statistics.median(r['initMs'] + r['firstMs'] for r in runs), 1)
+        med['ok'] = all(r['ok'] for r in runs)
+        report[mode] = med
+    if args.importtime:
+        report['importtime'] = import_report(env, args.top)
+
+    for server, _ in servers.values():
+        server.shutdown()
+    json.dump(report, sys.stdout, indent=2, ensure_ascii=False)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""先行抽出（uploads/ への S3 ObjectCreated イベント → 抽出）の効果を、イベントの再生で計測する
+
+S3 スタブ（bench/stubs.py）の `record_events` で PUT ごとのイベントレコードを溜め、
+それを process 関数（tdx2025dlambdaamplify02）の lambda_handler に `{"Records": [...]}` として渡す
+（S3 イベント通知 → Lambda の非同期起動の代わり）。1件ごとに
+
+    アップロード → （--event-delay 秒後にイベントを再生）→ --think 秒後に利用者が「生成」→ 応答
+
+を同時実行で流し、「生成」から応答までの時間（利用者が待つ時間）を比べる。
+
+- off  : イベントを再生しない（従来どおり生成要求で抽出する）
+- eager: イベントを再生する。think が抽出より長ければ抽出済み（cache.ocr=eager）、
+         短ければ抽出中のレコードに合流する
+
+抽出キャッシュはプロセス内では無効にし（別コンテナの想定）、先行抽出のレコードは S3 スタブに置く。
+スタブとハンドラは同じプロセスで動く（同じコンテナで抽出中のものにはイベントで合流する）。
+イベントの再生で抽出が省かれること・重複配信が skipped になることは tests/test_eager.py で確かめている。
+
+使い方:
+    pip install boto3 pypdf Pillow
+    python bench/bench_eager.py --uploads 20 --concurrency 4 --think 1.0
+    python bench/bench_eager.py --think 0.1     # 抽出の途中で生成を押した場合（合流）
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote_plus
+
+from bench_handlers import BUCKET, HANDLERS, child_env, parse_mix, s3_put, summarize
+from fixtures import load_sample, make_pdf, vary
+from stubs import StubAgentCoreHandler, StubBedrockHandler, StubS3Handler, serve
+
+EXTRACT_BUCKET = 'bench-cache'
+EXTENSIONS = {'jpg': 'jpg', 'png': 'png', 'pdf': 'pdf'}
+
+
+def take_event(key):
+    """S3 スタブに溜まったイベントから key のものを取り出す"""
+    with StubS3Handler.lock:
+        for i, event in enumerate(StubS3Handler.events):
+            s3 = event['s3']
+            if s3['bucket']['name'] == BUCKET and unquote_plus(s3['object']['key']) == key:
+                return StubS3Handler.events.pop(i)
+    return None
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--uploads', type=int, default=20)
+    ap.add_argument('--concurrency', type=int, default=4)
+    ap.add_argument('--mix', default='jpg:2,png:1,pdf:1', help='入力の比率（jpg / png / pdf）')
+    ap.add_argument('--pdf-pages', type=int, default=4)
+    ap.add_argument('--think', type=float, default=1.0, help='アップロード完了から「生成」までの秒数')
+    ap.add_argument('--event-delay', type=float, default=0.1, help='アップロードから S3 イベントが届くまでの秒数')
+    ap.add_argument('--s3-latency', type=float, default=0.005)
+    ap.add_argument('--bedrock-latency', type=float, default=0.2)
+    ap.add_argument('--token-latency', type=float, default=0.0002, help='出力1トークンあたりの遅延（秒）')
+    ap.add_argument('--ocr-chars', type=int, default=2000)
+    ap.add_argument('--questions', type=int, default=5)
+    args = ap.parse_args()
+
+    StubS3Handler.latency = args.s3_latency
+    StubS3Handler.record_events = True
+    StubBedrockHandler.latency = args.bedrock_latency
+    StubBedrockHandler.token_latency = args.token_latency
+    StubBedrockHandler.ocr_chars = args.ocr_chars
+    StubBedrockHandler.num_questions = args.questions
+    servers = {name: serve(cls) for name, cls in
+               (('s3', StubS3Handler), ('bedrock', StubBedrockHandler), ('agentcore', StubAgentCoreHandler))}
+    endpoints = {name: url for name, (_, url) in servers.items()}
+
+    # ハンドラは設定をモジュールの読み込み時に読むので、環境変数を整えてから import する
+    env = child_env(argparse.Namespace(concurrency=args.concurrency, metrics=False, cache=False), endpoints)
+    os.environ.update(env, EXTRACT_STORE_BUCKET=EXTRACT_BUCKET)
+    sys.path.insert(0, HANDLERS['process'][0])
+    import index
+
+    mix = parse_mix(args.mix)
+    kinds = [k for k, w in mix for _ in range(max(1, int(w)))]
+    samples = {'jpg': load_sample('test.jpg'), 'png': load_sample('test.png')}
+
+    def scenario(mode, i):
+        kind = kinds[i % len(kinds)]
+        n = i + 1 + (0 if mode == 'off' else args.uploads)  # モード間で同じ入力にしない
+        data = make_pdf(args.pdf_pages, tag=f'e{n}') if kind == 'pdf' else vary(samples[kind], n)
+        key = f'uploads/{int(time.time() * 1000)}_{mode}-{i}.{EXTENSIONS[kind]}'
+        s3_put(endpoints['s3'], key, data)
+        event = take_event(key)
+        replay = None
+        if mode == 'eager' and event is not None:
+            replay = threading.Timer(args.event_delay, index.lambda_handler, ({'Records': [event]}, None))
+            replay.start()
+        time.sleep(args.think)
+        started = time.perf_counter()
+        r = index.lambda_handler({'body': json.dumps({'bucket': BUCKET, 'key': key})}, None)
+        elapsed = time.perf_counter() - started
+        if replay is not None:
+            replay.join()
+        body = json.loads(r.get('body') or '{}')
+        return r.get('statusCode') == 200, elapsed, (body.get('cache') or {}).get('ocr')
+
+    # ハンドラのログ（print）はレポートに混ぜない
+    stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+    report = {}
+    for mode in ('off', 'eager'):
+        c0 = StubBedrockHandler.calls
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            results = list(pool.map(lambda i: scenario(mode, i), range(args.uploads)))
+        wall = time.perf_counter() - t0
+        out = summarize([sec for ok, sec, _ in results if ok], sum(1 for ok, _, _ in results if not ok), wall)
+        out['ocr'] = dict(Counter(tier for ok, _, tier in results if ok))
+        out['bedrockCalls'] = StubBedrockHandler.calls - c0
+        report[mode] = out
+    for server, _ in servers.values():
+        server.shutdown()
+    sys.stdout.close()
+    sys.stdout = stdout
+
+    off, eager = report['off'], report['eager']
+    if off.get('p50Ms') and eager.get('p50Ms'):
+        report['eagerVsOff'] = {
+            'p50': f"{(eager['p50Ms'] - off['p50Ms']) / off['p50Ms']:+.1%}",
+            'p95': f"{(eager['p95Ms'] - off['p95Ms']) / off['p95Ms']:+.1%}",
+        }
+    report['config'] = vars(args)
+    json.dump(report, sys.stdout, indent=2, ensure_ascii=False)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
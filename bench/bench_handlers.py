@@ -0,0 +1,322 @@
+"""ハンドラのオフライン負荷試験
+
+ローカルのスタブ（S3 / Bedrock converse / AgentCore invoke_agent_runtime。bench/stubs.py）に向けて
+Python 版の3つのハンドラへ同時実行のリクエストを流し、ハンドラごとに
+スループット・レイテンシ（p50/p95/p99）・ピーク RSS を計測する。
+
+- process: tdx2025dlambdaamplify02 の lambda_handler（画像/PDF の抽出 → 問題生成）
+- jobs   : tdx2025dagentcoreinvoke の handler（POST → ロングポーリングで完了まで。ローカルキューで実行）
+- relay  : backend/agentcore_invoke/app.py の handler（AgentCore への同期中継）
+
+各ハンドラは別プロセスで実行する（モジュール名の衝突を避け、RSS をハンドラ単位で測るため）。
+
+使い方:
+    pip install boto3 pypdf Pillow
+    python bench/bench_handlers.py --requests 200 --concurrency 16 --mix jpg:2,png:1,pdf:1
+    python bench/bench_handlers.py --save-baseline bench/baselines/local.json
+    python bench/bench_handlers.py --baseline bench/baselines/local.json --tolerance 0.2   # 悪化すれば終了コード 1
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from fixtures import load_sample, make_pdf, vary
+from stubs import StubAgentCoreHandler, StubBedrockHandler, StubS3Handler, serve
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HANDLERS = {
+    'process': (os.path.join(ROOT, 'amplify', 'backend', 'function', 'tdx2025dlambdaamplify02', 'src'), 'index', 'lambda_handler'),
+    'jobs': (os.path.join(ROOT, 'amplify', 'backend', 'function', 'tdx2025dagentcoreinvoke', 'src'), 'index', 'handler'),
+    'relay': (os.path.join(ROOT, 'backend', 'agentcore_invoke'), 'app', 'handler'),
+}
+BUCKET = 'bench-uploads'
+AGENT_ARN = 'arn:aws:bedrock-agentcore:us-west-2:000000000000:runtime/bench'
+REGRESSION_KEYS = (('p95Ms', 1), ('p99Ms', 1), ('throughputRps', -1), ('peakRssMb', 1))
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * q))]
+
+
+def summarize(latencies, errors, wall_sec):
+    s = sorted(latencies)
+    return {
+        'requests': len(latencies) + errors,
+        'errors': errors,
+        'throughputRps': round(len(latencies) / wall_sec, 2) if wall_sec else None,
+        'meanMs': round(statistics.mean(s) * 1000, 2) if s else None,
+        'p50Ms': round(percentile(s, 0.50) * 1000, 2) if s else None,
+        'p95Ms': round(percentile(s, 0.95) * 1000, 2) if s else None,
+        'p99Ms': round(percentile(s, 0.99) * 1000, 2) if s else None,
+        'maxMs': round(s[-1] * 1000, 2) if s else None,
+        'wallSec': round(wall_sec, 3),
+    }
+
+
+def peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024, 1)
+
+
+# ---- 親プロセス: スタブ起動・入力の準備・子プロセスの実行 ----
+
+def parse_mix(spec):
+    mix = []
+    for part in spec.split(','):
+        name, _, weight = part.partition(':')
+        if name.strip() not in ('jpg', 'png', 'pdf'):
+            raise SystemExit(f'unknown input kind in --mix: {name}')
+        mix.append((name.strip(), float(weight or 1)))
+    return mix
+
+
+def s3_put(endpoint, key, data):
+    req = urllib.request.Request(f'{endpoint}/{BUCKET}/{key}', data=data, method='PUT')
+    urllib.request.urlopen(req).read()
+
+
+def build_plan(args, s3_endpoint):
+    """ハンドラごとのリクエスト列（JSON）を作り、必要な入力を S3 スタブへ置く"""
+    rng = random.Random(args.seed)
+    mix = parse_mix(args.mix)
+    samples = {'jpg': load_sample('test.jpg'), 'png': load_sample('test.png')}
+    process, structured = [], []
+    for i in range(args.requests):
+        kind = rng.choices([k for k, _ in mix], weights=[w for _, w in mix])[0]
+        # repeat の割合だけ同じ入力を繰り返す（キャッシュの効果を見る）
+        n = 0 if rng.random() < args.repeat else i + 1
+        key = f'uploads/bench-{kind}-{n}.{kind}'
+        if kind == 'pdf':
+            data = make_pdf(args.pdf_pages, tag=f'v{n}')
+        else:
+            data = vary(samples[kind], n) if n else samples[kind]
+        s3_put(s3_endpoint, key, data)
+        body = {'bucket': BUCKET, 'key': key}
+        if rng.random() < args.agentcore_ratio:
+            body.update(target='高校生', difficulty='普通', num_questions=args.questions)
+        process.append(body)
+        structured.append({'s3_uri': f's3://{BUCKET}/{key}', 'target': '高校生', 'difficulty': '普通',
+                           'num_questions': args.questions})
+    return {'process': process, 'jobs': structured, 'relay': structured}
+
+
+def child_env(args, endpoints):
+    env = dict(os.environ)
+    env.update({
+        'AWS_ACCESS_KEY_ID': 'bench', 'AWS_SECRET_ACCESS_KEY': 'bench',
+        'AWS_REGION': 'us-west-2', 'AWS_DEFAULT_REGION': 'us-west-2',
+        'AWS_ENDPOINT_URL_S3': endpoints['s3'],
+        'AWS_ENDPOINT_URL_BEDROCK_RUNTIME': endpoints['bedrock'],
+        'AWS_ENDPOINT_URL_BEDROCK_AGENTCORE': endpoints['agentcore'],
+        'BEDROCK_MODEL_ID': 'bench-model',
+        'AGENTCORE_RUNTIME_ARN': AGENT_ARN, 'AGENTCORE_ARN': AGENT_ARN,
+        'INVOCATION_MODE': 'sdk',
+        'JOBS_BUCKET': 'bench-jobs', 'JOB_SCHEDULER': 'local', 'WORKER_CONCURRENCY': str(args.concurrency),
+        'BOTO_MAX_POOL_CONNECTIONS': str(max(32, args.concurrency * 2)),
+        'METRICS_ENABLED': '1' if args.metrics else '0',
+    })
+    if not args.cache:
+        env.update({'OCR_CACHE_MAX_ITEMS': '0', 'QUIZ_CACHE_TTL_SEC': '0', 'IMAGE_CACHE_MAX_ITEMS': '0'})
+    return env
+
+
+def run_child(name, plan, args, env):
+    with tempfile.TemporaryDirectory() as tmp:
+        plan_path = os.path.join(tmp, 'plan.json')
+        out_path = os.path.join(tmp, 'out.json')
+        with open(plan_path, 'w') as f:
+            json.dump(plan, f)
+        cmd = [sys.executable, os.path.abspath(__file__), '--child', name, '--plan', plan_path, '--out', out_path,
+               '--concurrency', str(args.concurrency)]
+        proc = subprocess.run(cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        if proc.returncode != 0 or not os.path.exists(out_path):
+            return {'error': (proc.stderr or '').strip().splitlines()[-5:]}
+        with open(out_path) as f:
+            return json.load(f)
+
+
+def compare(results, baseline, tolerance):
+    """ベースラインより tolerance を超えて悪化した項目を返す"""
+    regressions = []
+    for name, cur in results.items():
+        base = (baseline.get('results') or {}).get(name)
+        if not base or 'error' in cur or 'error' in base:
+            continue
+        for key, direction in REGRESSION_KEYS:
+            b, c = base.get(key), cur.get(key)
+            if not b or c is None:
+                continue
+            change = (c - b) / b * direction
+            if change > tolerance:
+                regressions.append({'handler': name, 'metric': key, 'baseline': b, 'current': c,
+                                    'change': f'{(c - b) / b:+.1%}'})
+    return regressions
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--handlers', default='process,jobs,relay')
+    ap.add_argument('--requests', type=int, default=100)
+    ap.add_argument('--concurrency', type=int, default=8)
+    ap.add_argument('--mix', default='jpg:2,png:1,pdf:1', help='入力の比率（jpg / png / pdf）')
+    ap.add_argument('--pdf-pages', type=int, default=4)
+    ap.add_argument('--agentcore-ratio', type=float, default=0.5, help='process で AgentCore 経由にする割合')
+    ap.add_argument('--questions', type=int, default=5)
+    ap.add_argument('--repeat', type=float, default=0.0, help='同じ入力を繰り返す割合（キャッシュの効果を見る）')
+    ap.add_argument('--cache', action='store_true', help='抽出・生成結果キャッシュを有効にする（既定は無効）')
+    ap.add_argument('--metrics', action='store_true', help='EMF メトリクス出力を有効にする（既定は無効）')
+    ap.add_argument('--s3-latency', type=float, default=0.005)
+    ap.add_argument('--bedrock-latency', type=float, default=0.2)
+    ap.add_argument('--agentcore-latency', type=float, default=0.5)
+    ap.add_argument('--agentcore-stream', action='store_true', help='AgentCore スタブを text/event-stream で応答させる')
+    ap.add_argument('--ocr-chars', type=int, default=2000)
+    ap.add_argument('--seed', type=int, default=1)
+    ap.add_argument('--save-baseline')
+    ap.add_argument('--baseline')
+    ap.add_argument('--tolerance', type=float, default=0.2)
+    ap.add_argument('--child', help=argparse.SUPPRESS)
+    ap.add_argument('--plan', help=argparse.SUPPRESS)
+    ap.add_argument('--out', help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.child:
+        return child_main(args)
+
+    StubS3Handler.latency = args.s3_latency
+    StubBedrockHandler.latency = args.bedrock_latency
+    StubBedrockHandler.ocr_chars = args.ocr_chars
+    StubBedrockHandler.num_questions = args.questions
+    StubAgentCoreHandler.latency = args.agentcore_latency
+    StubAgentCoreHandler.stream = args.agentcore_stream
+    servers = {name: serve(cls) for name, cls in
+               (('s3', StubS3Handler), ('bedrock', StubBedrockHandler), ('agentcore', StubAgentCoreHandler))}
+    endpoints = {name: url for name, (_, url) in servers.items()}
+
+    plans = build_plan(args, endpoints['s3'])
+    env = child_env(args, endpoints)
+    results = {}
+    for name in [h.strip() for h in args.handlers.split(',') if h.strip()]:
+        if name not in HANDLERS:
+            raise SystemExit(f'unknown handler: {name}')
+        b0, a0 = StubBedrockHandler.calls, StubAgentCoreHandler.calls
+        results[name] = run_child(name, plans[name], args, env)
+        results[name]['stubCalls'] = {'bedrock': StubBedrockHandler.calls - b0,
+                                      'agentcore': StubAgentCoreHandler.calls - a0}
+    for server, _ in servers.values():
+        server.shutdown()
+
+    config = {k: v for k, v in vars(args).items() if k not in ('child', 'plan', 'out', 'save_baseline', 'baseline')}
+    report = {'createdAt': time.strftime('%Y-%m-%dT%H:%M:%S'), 'config': config, 'results': results}
+    json.dump(report, sys.stdout, indent=2, ensure_ascii=False)
+    sys.stdout.write('\n')
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save_baseline)), exist_ok=True)
+        with open(args.save_baseline, 'w') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f'baseline saved: {args.save_baseline}', file=sys.stderr)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('config') != config:
+            print('warning: baseline was recorded with a different configuration', file=sys.stderr)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(json.dumps({'regressions': regressions}, indent=2), file=sys.stderr)
+            return 1
+        print(f'no regressions beyond {args.tolerance:.0%}', file=sys.stderr)
+    return 0
+
+
+# ---- 子プロセス: ハンドラを読み込み、同時実行で呼び出す ----
+
+def call_process(mod, fn, body):
+    r = fn({'body': json.dumps(body)}, None)
+    return r.get('statusCode') == 200
+
+
+def call_relay(mod, fn, body):
+    r = fn({'httpMethod': 'POST', 'body': json.dumps(body)}, None)
+    return r.get('statusCode') == 200
+
+
+def call_jobs(mod, fn, body):
+    """投入から完了（SUCCEEDED / FAILED）までを1リクエストとして測る"""
+    r = fn({'httpMethod': 'POST', 'body': json.dumps(body)}, None)
+    if r.get('statusCode') != 202:
+        return False
+    job_id = json.loads(r['body'])['jobId']
+    etag = None
+    while True:
+        qs = {'jobId': job_id}
+        if etag:
+            qs['wait'] = '20'
+        r = fn({'httpMethod': 'GET', 'queryStringParameters': qs,
+                'headers': {'If-None-Match': etag} if etag else {}}, None)
+        if r.get('statusCode') == 200:
+            etag = r['headers'].get('etag')
+            status = json.loads(r['body']).get('status')
+            if status in ('SUCCEEDED', 'FAILED'):
+                return status == 'SUCCEEDED'
+        elif r.get('statusCode') != 304:
+            return False
+
+
+CALLERS = {'process': call_process, 'jobs': call_jobs, 'relay': call_relay}
+
+
+def child_main(args):
+    src, module, attr = HANDLERS[args.child]
+    sys.path.insert(0, src)
+    with open(args.plan) as f:
+        plan = json.load(f)
+
+    t0 = time.perf_counter()
+    mod = __import__(module)
+    import_ms = (time.perf_counter() - t0) * 1000
+    fn = getattr(mod, attr)
+    call = CALLERS[args.child]
+
+    def one(body):
+        started = time.perf_counter()
+        try:
+            ok = call(mod, fn, body)
+        except Exception:
+            ok = False
+        return ok, time.perf_counter() - started
+
+    # 1件目でクライアント生成などの初期化を済ませてから測る
+    first_ok, first_sec = one(plan[0])
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(one, plan[1:]))
+    wall = time.perf_counter() - t0
+
+    latencies = [sec for ok, sec in results if ok]
+    errors = sum(1 for ok, _ in results if not ok)
+    out = summarize(latencies, errors, wall)
+    out.update({
+        'importMs': round(import_ms, 2),
+        'firstRequestMs': round(first_sec * 1000, 2),
+        'firstRequestOk': first_ok,
+        'peakRssMb': peak_rss_mb(),
+    })
+    with open(args.out, 'w') as f:
+        json.dump(out, f)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,111 @@
+"""ジョブ完了通知（ロングポーリング）のローカル検証
+
+スタブ S3 + ローカルキュー（JOB_SCHEDULER=local）+ mock 生成（MOCK_LATENCY_SEC）で
+ジョブを投入し、クライアントの状態取得リクエスト数を比較する。
+
+- interval: 従来の固定間隔ポーリング（--interval 秒ごとに GET）
+- longpoll: `wait=` 付き GET + If-None-Match（変化するまでサーバー側で待機）
+
+ロングポーリングでは1ジョブあたりのリクエスト数が生成時間に依存せず O(1) になる
+（mock では初回 GET + 完了通知の GET の 2 回程度）。
+1ジョブ分の回数の上限は tests/test_notify.py で確かめている。
+
+使い方:
+    pip install boto3
+    python bench/bench_notify.py --jobs 10 --latency 3
+"""
+import argparse
+import importlib.util
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from stubs import StubS3Handler, serve
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+AGENTCORE_SRC = os.path.join(ROOT, 'amplify', 'backend', 'function', 'tdx2025dagentcoreinvoke', 'src')
+TERMINAL = ('SUCCEEDED', 'FAILED')
+
+
+def _load_index():
+    sys.path.insert(0, AGENTCORE_SRC)
+    spec = importlib.util.spec_from_file_location('agentcore_invoke_index', os.path.join(AGENTCORE_SRC, 'index.py'))
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+
+def _get(index, job_id, etag=None, wait=None):
+    qs = {'jobId': job_id}
+    if wait:
+        qs['wait'] = str(wait)
+    r = index.handler({'httpMethod': 'GET', 'queryStringParameters': qs,
+                       'headers': {'If-None-Match': etag} if etag else {}}, None)
+    body = json.loads(r['body']) if r['body'] else None
+    return r['statusCode'], r['headers'].get('etag'), body
+
+
+def poll_interval(index, job_id, interval):
+    n = 0
+    while True:
+        n += 1
+        _, _, doc = _get(index, job_id)
+        if doc and doc.get('status') in TERMINAL:
+            return n
+        time.sleep(interval)
+
+
+def poll_long(index, job_id, wait):
+    n, etag = 0, None
+    while True:
+        n += 1
+        status, new_etag, doc = _get(index, job_id, etag=etag, wait=wait if etag else None)
+        if status == 200:
+            etag = new_etag
+            if doc.get('status') in TERMINAL:
+                return n
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--jobs', type=int, default=10)
+    ap.add_argument('--latency', type=float, default=3.0, help='mock の生成時間（秒）')
+    ap.add_argument('--interval', type=float, default=2.0)
+    ap.add_argument('--wait', type=float, default=20.0)
+    args = ap.parse_args()
+
+    server, endpoint = serve(StubS3Handler)
+    os.environ.update({
+        'AWS_ACCESS_KEY_ID': 'bench', 'AWS_SECRET_ACCESS_KEY': 'bench', 'AWS_REGION': 'us-west-2',
+        'AWS_ENDPOINT_URL': endpoint, 'JOBS_BUCKET': 'bench-jobs', 'INVOCATION_MODE': 'mock',
+        'JOB_SCHEDULER': 'local', 'WORKER_CONCURRENCY': str(args.jobs), 'MOCK_LATENCY_SEC': str(args.latency),
+    })
+    index = _load_index()
+
+    results = {}
+    for mode in ('interval', 'longpoll'):
+        r = index.handler({'httpMethod': 'POST', 'body': json.dumps({'jobs': [{'prompt': f'p{i}'} for i in range(args.jobs)]})}, None)
+        ids = [j['jobId'] for j in json.loads(r['body'])['jobs']]
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+            if mode == 'interval':
+                counts = list(pool.map(lambda j: poll_interval(index, j, args.interval), ids))
+            else:
+                counts = list(pool.map(lambda j: poll_long(index, j, args.wait), ids))
+        results[mode] = {
+            'jobs': len(ids),
+            'requests': sum(counts),
+            'requestsPerJob': round(sum(counts) / len(ids), 2),
+            'maxRequestsPerJob': max(counts),
+            'wallSec': round(time.perf_counter() - t0, 2),
+        }
+
+    server.shutdown()
+    json.dump(results, sys.stdout, indent=2)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
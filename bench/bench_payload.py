@@ -0,0 +1,140 @@
+"""ジョブ関数（tdx2025dagentcoreinvoke）の GET 応答の転送量を、圧縮と fields= の有無で比べる
+
+AgentCore スタブ（bench/stubs.py）+ ローカルキュー（JOB_SCHEDULER=local）+ SQLite のジョブストア（JOB_STORE=sqlite。
+S3 スタブは一覧を返せないため）でジョブを流して完了させ、
+エンドポイントごとに
+
+- full    : 従来どおり（fields なし）
+- fields  : ポーリング / 一覧で使う項目だけ（fields=status,progress など）
+
+を Accept-Encoding なし / gzip / br（brotli が入っていれば）で取得し、応答本文のバイト数（ResponseRawBytes）と
+転送量（ResponseBytes。圧縮後、base64 を戻した大きさ）、ハンドラの所要時間を出す。
+あわせてジョブストアに置いた生成結果の大きさ（圧縮前 / 保存した大きさ）も出す。
+
+使い方:
+    pip install boto3          # brotli も入れると br も比べる
+    python bench/bench_payload.py --jobs 20 --questions 20
+"""
+import argparse
+import base64
+import importlib.util
+import json
+import os
+import statistics
+import sys
+import time
+
+from bench_handlers import AGENT_ARN
+from stubs import StubAgentCoreHandler, serve
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+AGENTCORE_SRC = os.path.join(ROOT, 'amplify', 'backend', 'function', 'tdx2025dagentcoreinvoke', 'src')
+TERMINAL = ('SUCCEEDED', 'FAILED')
+
+
+def _load_index():
+    sys.path.insert(0, AGENTCORE_SRC)
+    spec = importlib.util.spec_from_file_location('agentcore_invoke_index', os.path.join(AGENTCORE_SRC, 'index.py'))
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+
+def _wire_bytes(r):
+    body = r.get('body') or ''
+    return len(base64.b64decode(body)) if r.get('isBase64Encoded') else len(body.encode('utf-8'))
+
+
+def _raw_bytes(r, compression):
+    body = r.get('body') or ''
+    if not r.get('isBase64Encoded'):
+        return len(body.encode('utf-8'))
+    return len(compression.decompress(base64.b64decode(body), r['headers'].get('content-encoding')))
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--jobs', type=int, default=20)
+    ap.add_argument('--questions', type=int, default=20, help='1ジョブあたりの問題数（生成結果の大きさ）')
+    ap.add_argument('--repeat', type=int, default=20, help='エンドポイント・条件ごとの GET 回数')
+    args = ap.parse_args()
+
+    server, endpoint = serve(StubAgentCoreHandler)
+    os.environ.update({
+        'AWS_ACCESS_KEY_ID': 'bench', 'AWS_SECRET_ACCESS_KEY': 'bench', 'AWS_REGION': 'us-west-2',
+        'AWS_ENDPOINT_URL_BEDROCK_AGENTCORE': endpoint, 'AGENTCORE_ARN': AGENT_ARN, 'INVOCATION_MODE': 'sdk',
+        'JOB_STORE': 'sqlite',
+        'JOB_SCHEDULER': 'local', 'WORKER_CONCURRENCY': str(args.jobs), 'QUIZ_CACHE_TTL_SEC': '0',
+        'RESPONSE_COMPRESSION': '1', 'METRICS_ENABLED': '0',
+    })
+    index = _load_index()
+    compression = sys.modules['compression']
+
+    # 一覧（?status=）は認証済みの呼び出し元のジョブだけを返すので、Cognito オーソライザーの claims を付ける
+    auth = {'authorizer': {'claims': {'sub': 'bench'}}}
+
+    def call(qs, encoding):
+        headers = {'Accept-Encoding': encoding} if encoding else {}
+        event = {'httpMethod': 'GET', 'resource': '/agentcore', 'queryStringParameters': qs, 'headers': headers,
+                 'requestContext': auth}
+        started = time.perf_counter()
+        r = index.handler(event, None)
+        return r, (time.perf_counter() - started) * 1000
+
+    # ジョブを流して完了を待つ
+    payloads = [{'prompt': f'p{i}', 'num_questions': args.questions} for i in range(args.jobs)]
+    r = index.handler({'httpMethod': 'POST', 'body': json.dumps({'jobs': payloads}), 'requestContext': auth}, None)
+    ids = [j['jobId'] for j in json.loads(r['body'])['jobs']]
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        r, _ = call({'jobIds': ','.join(ids), 'fields': 'status'}, None)
+        if all(j.get('status') in TERMINAL for j in json.loads(r['body'])['jobs']):
+            break
+        time.sleep(0.2)
+
+    cases = {
+        'GET ?jobId': [({'jobId': ids[0]}, 'full'), ({'jobId': ids[0], 'fields': 'status,progress'}, 'fields')],
+        'GET ?jobIds': [({'jobIds': ','.join(ids)}, 'full'),
+                        ({'jobIds': ','.join(ids), 'fields': 'status'}, 'fields')],
+        'GET ?status': [({'status': 'SUCCEEDED', 'limit': str(args.jobs)}, 'full'),
+                        ({'status': 'SUCCEEDED', 'limit': str(args.jobs), 'fields': 'status,createdAt'}, 'fields')],
+    }
+    encodings = [None, 'gzip'] + (['br'] if 'br' in compression.ENCODINGS else [])
+    report = {}
+    for endpoint, variants in cases.items():
+        out = report.setdefault(endpoint, {})
+        for qs, label in variants:
+            for encoding in encodings:
+                times = []
+                for _ in range(args.repeat):
+                    r, ms = call(qs, encoding)
+                    times.append(ms)
+                out[f'{label}/{encoding or "identity"}'] = {
+                    'rawBytes': _raw_bytes(r, compression),
+                    'wireBytes': _wire_bytes(r),
+                    'contentEncoding': r['headers'].get('content-encoding'),
+                    'p50Ms': round(statistics.median(times), 3),
+                }
+        base = out['full/identity']['wireBytes']
+        for variant in out.values():
+            variant['vsFullIdentity'] = f"{(variant['wireBytes'] - base) / base:+.1%}" if base else 'n/a'
+
+    # ジョブストアに置いた生成結果（圧縮前の大きさはジョブレコードの resultBytes）
+    store = index._store()
+    with store._lock:
+        stored = store._db.execute("SELECT COALESCE(SUM(LENGTH(CAST(data AS BLOB))), 0) FROM blobs "
+                                   "WHERE name = 'result'").fetchone()[0]
+    raw = sum(store.get('jobs', job_id)[0].get('resultBytes', 0) for job_id in ids)
+    report['storedResults'] = {
+        'jobs': len(ids), 'rawBytes': raw, 'storedBytes': stored,
+        'change': f'{(stored - raw) / raw:+.1%}' if raw else 'n/a',
+    }
+
+    server.shutdown()
+    report['config'] = vars(args)
+    json.dump(report, sys.stdout, indent=2, ensure_ascii=False)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
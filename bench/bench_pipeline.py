@@ -0,0 +1,90 @@
+"""process 関数（tdx2025dlambdaamplify02）の two-call / fused の比較
+
+同じリクエスト列を PIPELINE_MODE=two-call（抽出 → 問題生成の2回の converse）と
+PIPELINE_MODE=fused（画像/PDF から抽出の要約と問題を1回の converse で返す）で流し、
+エンドツーエンドのレイテンシと Bedrock の呼び出し回数・トークン数を比べる。スタブは bench/stubs.py。
+
+スタブの応答時間は「固定遅延 + 出力トークン数 × --token-latency」。fused は抽出テキスト全文を
+出力しない分、出力トークン（と生成時間）が減る。入力トークンは cachePoint の手前が
+cacheRead / cacheWrite に分かれる（PROMPT_CACHE=0 で無効にして比べられる）。
+
+使い方:
+    pip install boto3 pypdf Pillow
+    python bench/bench_pipeline.py --requests 50 --concurrency 4 --mix jpg:2,png:1,pdf:1
+    python bench/bench_pipeline.py --token-latency 0.0005 --prompt-cache 0
+"""
+import argparse
+import json
+import sys
+
+from bench_handlers import build_plan, child_env, run_child
+from stubs import StubAgentCoreHandler, StubBedrockHandler, StubS3Handler, serve
+
+MODES = ('two-call', 'fused')
+USAGE_KEYS = ('inputTokens', 'outputTokens', 'cacheReadInputTokens', 'cacheWriteInputTokens')
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--requests', type=int, default=50)
+    ap.add_argument('--concurrency', type=int, default=4)
+    ap.add_argument('--mix', default='jpg:2,png:1,pdf:1', help='入力の比率（jpg / png / pdf）')
+    ap.add_argument('--pdf-pages', type=int, default=4)
+    ap.add_argument('--questions', type=int, default=5)
+    ap.add_argument('--s3-latency', type=float, default=0.005)
+    ap.add_argument('--bedrock-latency', type=float, default=0.2)
+    ap.add_argument('--token-latency', type=float, default=0.0002, help='出力1トークンあたりの遅延（秒）')
+    ap.add_argument('--ocr-chars', type=int, default=2000)
+    ap.add_argument('--prompt-cache', default='1', help='PROMPT_CACHE（1 / 0）')
+    ap.add_argument('--seed', type=int, default=1)
+    args = ap.parse_args()
+    # build_plan / child_env の引数（AgentCore 経由の要求は fused の対象外なので含めない）
+    args.agentcore_ratio, args.repeat, args.cache, args.metrics = 0.0, 0.0, False, False
+
+    StubS3Handler.latency = args.s3_latency
+    StubBedrockHandler.latency = args.bedrock_latency
+    StubBedrockHandler.token_latency = args.token_latency
+    StubBedrockHandler.ocr_chars = args.ocr_chars
+    StubBedrockHandler.num_questions = args.questions
+    servers = {name: serve(cls) for name, cls in
+               (('s3', StubS3Handler), ('bedrock', StubBedrockHandler), ('agentcore', StubAgentCoreHandler))}
+    endpoints = {name: url for name, (_, url) in servers.items()}
+
+    plan = build_plan(args, endpoints['s3'])['process']
+    env = child_env(args, endpoints)
+    report = {}
+    for mode in MODES:
+        # モード間でプロンプトキャッシュを持ち越さない
+        StubBedrockHandler.cached.clear()
+        c0, u0 = StubBedrockHandler.calls, StubBedrockHandler.usage.copy()
+        result = run_child('process', plan, args, dict(env, PIPELINE_MODE=mode, PROMPT_CACHE=args.prompt_cache))
+        calls = StubBedrockHandler.calls - c0
+        usage = StubBedrockHandler.usage - u0
+        result['bedrockCalls'] = calls
+        tokens = {k: round(usage[k] / len(plan), 1) for k in USAGE_KEYS}
+        # キャッシュからの読み込み・書き込みも含めた入力の合計
+        tokens['totalInputTokens'] = round(sum(tokens[k] for k in USAGE_KEYS if k != 'outputTokens'), 1)
+        result['tokensPerRequest'] = tokens
+        report[mode] = result
+    for server, _ in servers.values():
+        server.shutdown()
+
+    two, fused = report['two-call'], report['fused']
+    if 'error' not in two and 'error' not in fused and two.get('p50Ms') and fused.get('p50Ms'):
+        report['fusedVsTwoCall'] = {
+            'p50': f"{(fused['p50Ms'] - two['p50Ms']) / two['p50Ms']:+.1%}",
+            'p95': f"{(fused['p95Ms'] - two['p95Ms']) / two['p95Ms']:+.1%}",
+            'outputTokens': f"{_change(two, fused, 'outputTokens')}",
+            'totalInputTokens': f"{_change(two, fused, 'totalInputTokens')}",
+        }
+    json.dump(report, sys.stdout, indent=2, ensure_ascii=False)
+    sys.stdout.write('\n')
+
+
+def _change(before, after, key):
+    b, a = before['tokensPerRequest'][key], after['tokensPerRequest'][key]
+    return f'{(a - b) / b:+.1%}' if b else 'n/a'
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,312 @@
+"""常駐サービス（backend/service/server.py）と Lambda の「1コンテナ1要求」モデルの負荷試験での比較
+
+同じリクエスト列（授業開始時のような一斉の要求。--repeat の割合で同じ教材を繰り返す）を
+
+- per-invoke: ハンドラを読み込んだ子プロセスを「コンテナ」とし、1コンテナは同時に1要求だけを処理する。
+              空いたコンテナが無ければ新しく起動する（コールドスタート。起動と import の時間が要求に載る）。
+              キャッシュとクライアントはコンテナごと
+- service   : server.py を1プロセスで起動し、HTTP で要求する（キャッシュとクライアントは全要求で共有。
+              ルートごとの上限を超えた分は 429 + Retry-After で、クライアントは Retry-After 後に再送する）
+
+に同時実行 --concurrency で流し、レイテンシ・スループット・コールドスタート数・メモリ（コンテナの RSS の合計 /
+サービスの RSS）・Bedrock / AgentCore スタブの呼び出し回数を比べる。対象は同期のルート（process と relay）。
+ジョブ関数はサービスでは同じプロセスのキューでワーカーが動くが、Lambda の非同期起動を模擬できないため比較に含めない
+（--jobs を付けるとサービスだけで投入 → 完了までを計測する）。
+
+使い方:
+    pip install boto3 pypdf Pillow uvicorn
+    python bench/bench_service.py --requests 120 --concurrency 24 --repeat 0.5
+    python bench/bench_service.py --route-limits process=8 --concurrency 32   # 429 と再送の様子を見る
+"""
+import argparse
+import json
+import os
+import queue
+import random
+import resource
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from bench_handlers import HANDLERS, ROOT, build_plan, child_env, summarize
+from stubs import StubAgentCoreHandler, StubBedrockHandler, StubS3Handler, serve
+
+SERVER = os.path.join(ROOT, 'backend', 'service', 'server.py')
+PATHS = {'process': '/process', 'relay': '/agentcore/invoke'}
+
+
+# ---- per-invoke: 1コンテナ1要求 ----
+
+class Container:
+    """ハンドラを読み込んだ子プロセス（標準入出力で1行ずつイベントと応答をやり取りする）"""
+
+    def __init__(self, name, env):
+        self.proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--container', name], env=env,
+                                     stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                     text=True)
+        ready = json.loads(self.proc.stdout.readline())
+        self.rss_mb = ready['rssMb']
+
+    def call(self, event):
+        self.proc.stdin.write(json.dumps(event) + '\n')
+        self.proc.stdin.flush()
+        reply = json.loads(self.proc.stdout.readline())
+        self.rss_mb = reply['rssMb']
+        return reply['statusCode']
+
+    def close(self):
+        self.proc.stdin.close()
+        self.proc.wait(timeout=10)
+
+
+class Fleet:
+    """空いているコンテナに要求を渡し、無ければ新しく起動する（Lambda のスケールアウト）"""
+
+    def __init__(self, name, env):
+        self.name, self.env = name, env
+        self.idle = queue.SimpleQueue()
+        self.containers = []
+        self.lock = threading.Lock()
+
+    def invoke(self, event):
+        try:
+            c, cold = self.idle.get_nowait(), False
+        except queue.Empty:
+            c, cold = Container(self.name, self.env), True
+            with self.lock:
+                self.containers.append(c)
+        try:
+            return c.call(event), cold
+        finally:
+            self.idle.put(c)
+
+    def close(self):
+        for c in self.containers:
+            c.close()
+
+
+def container_main(name):
+    """子プロセス: ハンドラを読み込み、標準入力のイベントを1件ずつ処理する"""
+    out = os.fdopen(os.dup(1), 'w')
+    sys.stdout = open(os.devnull, 'w')  # ハンドラのログ（print / EMF）は捨てる
+    src, module, attr = HANDLERS[name]
+    sys.path.insert(0, src)
+    fn = getattr(__import__(module), attr)
+
+    def reply(doc):
+        doc['rssMb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+        out.write(json.dumps(doc) + '\n')
+        out.flush()
+
+    reply({'ready': True})
+    for line in sys.stdin:
+        try:
+            r = fn(json.loads(line), None)
+            status = r.get('statusCode') if isinstance(r, dict) else 200
+        except Exception:
+            status = 500
+        reply({'statusCode': status})
+
+
+def run_per_invoke(plan, args, env):
+    fleets = {name: Fleet(name, env) for name in PATHS}
+
+    def one(item):
+        name, body = item
+        started = time.perf_counter()
+        try:
+            status, cold = fleets[name].invoke({'httpMethod': 'POST', 'resource': PATHS[name], 'path': PATHS[name],
+                                                'body': json.dumps(body)})
+        except Exception:
+            status, cold = 500, False
+        return name, status == 200, time.perf_counter() - started, cold, 0
+
+    out = _drive(plan, args, one)
+    out['coldStarts'] = {name: len(f.containers) for name, f in fleets.items()}
+    out['containers'] = sum(len(f.containers) for f in fleets.values())
+    out['totalRssMb'] = round(sum(c.rss_mb for f in fleets.values() for c in f.containers), 1)
+    for f in fleets.values():
+        f.close()
+    return out
+
+
+# ---- service: 1プロセスの常駐サービス ----
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _http(url, body=None, method='POST', timeout=60, headers=None):
+    data = json.dumps(body).encode('utf-8') if body is not None else None
+    req = urllib.request.Request(url, data=data, method=method, headers=dict(headers or {}, **{'content-type': 'application/json'}))
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as r:
+            return r.status, dict(r.headers), r.read()
+    except urllib.error.HTTPError as e:
+        return e.code, dict(e.headers), e.read()
+
+
+def start_service(env, args):
+    port = _free_port()
+    env = dict(env, SERVICE_ROUTE_LIMITS=args.route_limits or '', SERVICE_QUEUE_TIMEOUT_SEC=str(args.queue_timeout))
+    proc = subprocess.Popen([sys.executable, SERVER, '--port', str(port)], env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base = f'http://127.0.0.1:{port}'
+    started = time.perf_counter()
+    while True:
+        try:
+            if _http(f'{base}/healthz', method='GET', timeout=1)[0] == 200:
+                break
+        except OSError:
+            pass
+        if proc.poll() is not None or time.perf_counter() - started > 60:
+            raise SystemExit('service did not start (is uvicorn installed?)')
+        time.sleep(0.1)
+    return proc, base, round((time.perf_counter() - started) * 1000, 1)
+
+
+def run_service(plan, args, env):
+    proc, base, startup_ms = start_service(env, args)
+
+    def one(item):
+        name, body = item
+        started = time.perf_counter()
+        throttled = 0
+        while True:
+            try:
+                status, headers, _ = _http(f'{base}{PATHS[name]}', body)
+            except OSError:
+                status, headers = 599, {}
+            if status != 429:
+                break
+            # 429 は Retry-After の秒数だけ待って再送する
+            throttled += 1
+            time.sleep(float(headers.get('Retry-After') or headers.get('retry-after') or 1))
+        return name, status == 200, time.perf_counter() - started, False, throttled
+
+    out = _drive(plan, args, one)
+    out['startupMs'] = startup_ms
+    if args.jobs:
+        out['jobs'] = run_jobs(base, args)
+    stats = json.loads(_http(f'{base}/healthz', method='GET')[2])
+    out['totalRssMb'] = stats['peakRssMb']
+    out['routes'] = {k: v for k, v in stats['routes'].items() if v['served'] or v['rejected']}
+    proc.terminate()
+    proc.wait(timeout=10)
+    return out
+
+
+def run_jobs(base, args):
+    """ジョブの投入 → ロングポーリングで完了まで（サービスのみ。ワーカーは同じプロセスのキュー）"""
+    def one(i):
+        started = time.perf_counter()
+        status, _, body = _http(f'{base}/agentcore', {'prompt': f'job {i}', 'num_questions': args.questions})
+        if status != 202:
+            return False, 0
+        job_id = json.loads(body)['jobId']
+        etag = None
+        while True:
+            status, headers, body = _http(f'{base}/agentcore?jobId={job_id}&fields=status&wait=20', method='GET',
+                                          headers={'If-None-Match': etag} if etag else None)
+            if status == 304:
+                continue
+            if status != 200:
+                return False, 0
+            etag = headers.get('etag') or headers.get('ETag')
+            doc = json.loads(body)
+            if doc.get('status') in ('SUCCEEDED', 'FAILED'):
+                return doc['status'] == 'SUCCEEDED', time.perf_counter() - started
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(one, range(args.jobs)))
+    return summarize([sec for ok, sec in results if ok], sum(1 for ok, _ in results if not ok),
+                     time.perf_counter() - t0)
+
+
+# ---- 共通 ----
+
+def _drive(plan, args, one):
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(one, plan))
+    wall = time.perf_counter() - t0
+    out = summarize([sec for _, ok, sec, _, _ in results if ok], sum(1 for _, ok, _, _, _ in results if not ok), wall)
+    out['byRoute'] = {}
+    for name in PATHS:
+        rows = [r for r in results if r[0] == name]
+        if rows:
+            out['byRoute'][name] = summarize([sec for _, ok, sec, _, _ in rows if ok],
+                                             sum(1 for _, ok, _, _, _ in rows if not ok), wall)
+    out['throttled'] = sum(t for _, _, _, _, t in results)
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--requests', type=int, default=120)
+    ap.add_argument('--concurrency', type=int, default=24)
+    ap.add_argument('--relay-ratio', type=float, default=0.25, help='relay（AgentCore 同期中継）にする割合')
+    ap.add_argument('--mix', default='jpg:2,png:1,pdf:1', help='入力の比率（jpg / png / pdf）')
+    ap.add_argument('--pdf-pages', type=int, default=4)
+    ap.add_argument('--repeat', type=float, default=0.5, help='同じ入力を繰り返す割合（共有キャッシュの効果）')
+    ap.add_argument('--questions', type=int, default=5)
+    ap.add_argument('--s3-latency', type=float, default=0.005)
+    ap.add_argument('--bedrock-latency', type=float, default=0.2)
+    ap.add_argument('--agentcore-latency', type=float, default=0.5)
+    ap.add_argument('--ocr-chars', type=int, default=2000)
+    ap.add_argument('--route-limits', default='', help='サービスの SERVICE_ROUTE_LIMITS（例: process=8）')
+    ap.add_argument('--queue-timeout', type=float, default=5.0, help='サービスの SERVICE_QUEUE_TIMEOUT_SEC')
+    ap.add_argument('--jobs', type=int, default=0, help='サービスで続けて流すジョブの数')
+    ap.add_argument('--seed', type=int, default=1)
+    ap.add_argument('--container', help=argparse.SUPPRESS)
+    args = ap.parse_args()
+    if args.container:
+        return container_main(args.container)
+    # build_plan / child_env の引数（キャッシュは有効にする）
+    args.agentcore_ratio, args.cache, args.metrics = 0.0, True, False
+
+    StubS3Handler.latency = args.s3_latency
+    StubBedrockHandler.latency = args.bedrock_latency
+    StubBedrockHandler.ocr_chars = args.ocr_chars
+    StubBedrockHandler.num_questions = args.questions
+    StubAgentCoreHandler.latency = args.agentcore_latency
+    servers = {name: serve(cls) for name, cls in
+               (('s3', StubS3Handler), ('bedrock', StubBedrockHandler), ('agentcore', StubAgentCoreHandler))}
+    endpoints = {name: url for name, (_, url) in servers.items()}
+
+    plans = build_plan(args, endpoints['s3'])
+    rng = random.Random(args.seed)
+    plan = [('relay', plans['relay'][i]) if rng.random() < args.relay_ratio else ('process', plans['process'][i])
+            for i in range(args.requests)]
+    env = child_env(args, endpoints)
+
+    report = {}
+    for mode, run in (('per-invoke', run_per_invoke), ('service', run_service)):
+        b0, a0 = StubBedrockHandler.calls, StubAgentCoreHandler.calls
+        report[mode] = run(plan, args, env)
+        report[mode]['stubCalls'] = {'bedrock': StubBedrockHandler.calls - b0,
+                                     'agentcore': StubAgentCoreHandler.calls - a0}
+    for server, _ in servers.values():
+        server.shutdown()
+
+    per, svc = report['per-invoke'], report['service']
+    if per.get('p50Ms') and svc.get('p50Ms'):
+        report['serviceVsPerInvoke'] = {
+            key: f"{(svc[key] - per[key]) / per[key]:+.1%}"
+            for key in ('p50Ms', 'p95Ms', 'p99Ms', 'throughputRps', 'totalRssMb') if per.get(key) and svc.get(key)
+        }
+    report['config'] = {k: v for k, v in vars(args).items() if k != 'container'}
+    json.dump(report, sys.stdout, indent=2, ensure_ascii=False)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
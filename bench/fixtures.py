@@ -0,0 +1,52 @@
+"""ベンチマーク用の入力データ
+
+- test.jpg / test.png（リポジトリ直下のサンプル画像）
+- 複数ページ PDF（依存ライブラリなしで生成。ページごとにテキストが異なる）
+
+vary() / make_pdf(tag=...) で内容を少しずつ変えた版を作り、キャッシュに当たらない入力も用意できる。
+"""
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_sample(name):
+    with open(os.path.join(ROOT, name), 'rb') as f:
+        return f.read()
+
+
+def make_pdf(pages, tag=''):
+    """pages ページの PDF を生成する（各ページに番号と tag を描画）"""
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        None,  # Pages（子の番号が決まってから埋める）
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>',
+    ]
+    kids = []
+    for i in range(pages):
+        text = f'Page {i + 1} {tag}'.replace('(', '').replace(')', '')
+        stream = f'BT /F1 24 Tf 72 720 Td ({text}) Tj ET'.encode('latin-1')
+        objects.append(b'<< /Length %d >>\nstream\n%s\nendstream' % (len(stream), stream))
+        content_no = len(objects)
+        objects.append(b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] '
+                       b'/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>' % content_no)
+        kids.append(len(objects))
+    objects[1] = b'<< /Type /Pages /Kids [%s] /Count %d >>' % (
+        b' '.join(b'%d 0 R' % k for k in kids), len(kids))
+
+    out = bytearray(b'%PDF-1.4\n')
+    offsets = []
+    for no, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b'%d 0 obj\n%s\nendobj\n' % (no, body)
+    xref = len(out)
+    out += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    for off in offsets:
+        out += b'%010d 00000 n \n' % off
+    out += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+def vary(data, n):
+    """画像の末尾にバイトを足し、表示は同じで内容ハッシュだけが異なる版を返す（PDF は make_pdf の tag で変える）"""
+    return data + b'\x00bench-%d' % n
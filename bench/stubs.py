@@ -0,0 +1,266 @@
+"""ローカル検証用のスタブ AWS エンドポイント
+
+boto3 は環境変数 `AWS_ENDPOINT_URL` を参照するため、ハンドラーのコードを変えずに
+ローカルのスタブへ向けられる。
+
+- S3: GET / PUT / HEAD / DELETE（ETag、IfMatch / IfNoneMatch の条件付き書き込み、If-None-Match の 304）。
+  `record_events` を立てると PUT ごとに ObjectCreated:Put のイベントレコードを `events` に溜める（S3 イベント通知の代わり）
+- Bedrock Runtime: converse（画像/文書付きは抽出テキスト、それ以外は問題 JSON を返す。usage 付き。
+  画像/文書付きで extractedPreview を求める fused の要求には本文の冒頭と問題を1つの JSON で返す。
+  cachePoint があればその手前までをプロンプトキャッシュとして数え、usage に cacheRead/WriteInputTokens を返す）
+- Bedrock AgentCore: invoke_agent_runtime（JSON または text/event-stream で問題を返す）
+
+Bedrock / AgentCore はサービスごとの環境変数（`AWS_ENDPOINT_URL_BEDROCK_RUNTIME`、
+`AWS_ENDPOINT_URL_BEDROCK_AGENTCORE`）で別ポートのスタブへ向ける。
+遅延と応答サイズはクラス属性（`latency`、`output_chars` など）で設定する。
+
+単体起動:
+    python bench/stubs.py --port 4566
+    AWS_ENDPOINT_URL=http://127.0.0.1:4566 AWS_ACCESS_KEY_ID=x AWS_SECRET_ACCESS_KEY=x \\
+        JOBS_BUCKET=local INVOCATION_MODE=mock python -c "..."
+"""
+import argparse
+import hashlib
+import json
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote_plus, unquote
+
+
+class StubS3Handler(BaseHTTPRequestHandler):
+    """オブジェクトを (Host, path) 単位でメモリに保持するだけの S3 スタブ"""
+    protocol_version = 'HTTP/1.1'
+    store = {}
+    lock = threading.Lock()
+    latency = 0.0  # 1リクエストあたりの固定遅延（秒）
+    record_events = False
+    events = []    # S3 イベント通知のレコード（Lambda に渡す {"Records": [...]} の要素）
+
+    def _key(self):
+        return (self.headers.get('Host', ''), self.path.split('?')[0])
+
+    def _reply(self, status, body=b'', headers=None):
+        if self.latency:
+            time.sleep(self.latency)
+        self.send_response(status)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body and self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def do_PUT(self):
+        n = int(self.headers.get('Content-Length') or 0)
+        data = self.rfile.read(n)
+        key = self._key()
+        with self.lock:
+            cur = self.store.get(key)
+            if_match = self.headers.get('If-Match')
+            if_none_match = self.headers.get('If-None-Match')
+            if (if_none_match == '*' and cur is not None) or (if_match and (cur is None or cur[1] != if_match)):
+                return self._reply(412, b'<Error><Code>PreconditionFailed</Code></Error>')
+            etag = '"%s"' % hashlib.md5(data).hexdigest()
+            meta = {k: v for k, v in self.headers.items()
+                    if k.lower() in ('content-type', 'content-encoding') or k.lower().startswith('x-amz-meta-')}
+            self.store[key] = (data, etag, meta)
+            if self.record_events:
+                self.events.append(self._event(len(data), etag))
+        self._reply(200, headers={'ETag': etag})
+
+    def _event(self, size, etag):
+        """パス形式（/bucket/key）の PUT に対応する ObjectCreated:Put のレコード"""
+        bucket, _, key = unquote(self.path.split('?')[0]).lstrip('/').partition('/')
+        return {
+            'eventVersion': '2.1', 'eventSource': 'aws:s3', 'awsRegion': 'us-west-2',
+            'eventTime': time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime()), 'eventName': 'ObjectCreated:Put',
+            's3': {'bucket': {'name': bucket}, 'object': {'key': quote_plus(key, safe='/'), 'size': size,
+                                                          'eTag': etag.strip('"')}},
+        }
+
+    def do_GET(self):
+        cur = self.store.get(self._key())
+        if cur is None:
+            return self._reply(404, b'<Error><Code>NoSuchKey</Code></Error>')
+        data, etag, meta = cur
+        if self.headers.get('If-None-Match') == etag:
+            return self._reply(304, headers={'ETag': etag})
+        headers = dict(meta, ETag=etag)
+        rng = self.headers.get('Range')
+        if rng and rng.startswith('bytes='):
+            a, b = rng[6:].split('-')
+            start, end = int(a), min(int(b) if b else len(data) - 1, len(data) - 1)
+            headers['Content-Range'] = f'bytes {start}-{end}/{len(data)}'
+            return self._reply(206, data[start:end + 1], headers)
+        self._reply(200, data, headers)
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_DELETE(self):
+        with self.lock:
+            self.store.pop(self._key(), None)
+        self._reply(204)
+
+    def log_message(self, *args):
+        pass
+
+
+class _JsonStub(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _read_json(self):
+        n = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(n)
+        try:
+            return raw, json.loads(raw or b'{}')
+        except ValueError:
+            return raw, {}
+
+    def _send(self, status, body, content_type='application/json', headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _questions(n, seed):
+    return [{
+        'type': 'mcq' if i % 2 == 0 else 'cloze',
+        'question': f'問{i + 1}（{seed[:8]}）: 本文の内容として正しいものはどれか',
+        'choices': ['A', 'B', 'C', 'D'] if i % 2 == 0 else None,
+        'answer': 'A',
+        'explanation': '本文の該当箇所を参照',
+        'sourceText': '本文の一節',
+    } for i in range(n)]
+
+
+class StubBedrockHandler(_JsonStub):
+    """converse のスタブ。POST /model/{modelId}/converse"""
+    latency = 0.0          # 1回あたりの固定遅延（秒）
+    token_latency = 0.0    # 出力1トークンあたりの遅延（秒）。出力の長さに比例する生成時間を模擬する
+    ocr_chars = 2000       # 抽出テキストの文字数
+    num_questions = 5
+    calls = 0
+    attachment_calls = 0   # 画像/文書付き（抽出・fused）の呼び出し回数
+    usage = Counter()      # 全呼び出しの usage の合計
+    cached = set()         # プロンプトキャッシュに書かれた prefix
+    lock = threading.Lock()
+
+    def do_POST(self):
+        raw, req = self._read_json()
+        if not self.path.split('?')[0].endswith('/converse'):
+            return self._send(404, b'{"message": "not found"}')
+        seed = hashlib.sha256(raw).hexdigest()
+        blocks = [b for m in req.get('messages') or [] for b in m.get('content') or []]
+        if any('image' in b or 'document' in b for b in blocks) and b'extractedPreview' in raw:
+            head = f'抽出本文 {seed}\n'
+            text = json.dumps({'extractedPreview': head + '本文の段落。' * 60,
+                               'questions': _questions(self.num_questions, seed)}, ensure_ascii=False)
+        elif any('image' in b or 'document' in b for b in blocks):
+            head = f'抽出本文 {seed}\n'
+            text = head + ('本文の段落。' * (self.ocr_chars // 6 + 1))[:max(0, self.ocr_chars - len(head))]
+        else:
+            text = json.dumps({'questions': _questions(self.num_questions, seed)}, ensure_ascii=False)
+        usage = {'inputTokens': len(raw) // 4, 'outputTokens': len(text) // 2}
+        prefix = self._cache_prefix(req)
+        if prefix:
+            digest = hashlib.sha256(prefix).hexdigest()
+            with self.lock:
+                hit = digest in self.cached
+                self.cached.add(digest)
+            usage['cacheReadInputTokens' if hit else 'cacheWriteInputTokens'] = len(prefix) // 4
+            usage['inputTokens'] -= len(prefix) // 4
+        usage['totalTokens'] = sum(usage.values())
+        with self.lock:
+            type(self).calls += 1
+            if any('image' in b or 'document' in b for b in blocks):
+                type(self).attachment_calls += 1
+            self.usage.update(usage)
+        delay = self.latency + self.token_latency * usage['outputTokens']
+        if delay:
+            time.sleep(delay)
+        body = json.dumps({
+            'output': {'message': {'role': 'assistant', 'content': [{'text': text}]}},
+            'stopReason': 'end_turn',
+            'usage': usage,
+            'metrics': {'latencyMs': int(delay * 1000)},
+        }, ensure_ascii=False).encode('utf-8')
+        self._send(200, body)
+
+    @staticmethod
+    def _cache_prefix(req):
+        """最後の cachePoint までの system / messages（キャッシュ対象の prefix）。cachePoint がなければ None"""
+        parts = [('system', b) for b in req.get('system') or []]
+        parts += [('message', b) for m in req.get('messages') or [] for b in m.get('content') or []]
+        last = max((i for i, (_, b) in enumerate(parts) if 'cachePoint' in b), default=None)
+        if last is None:
+            return None
+        return json.dumps(parts[:last], ensure_ascii=False, sort_keys=True).encode('utf-8')
+
+
+class StubAgentCoreHandler(_JsonStub):
+    """invoke_agent_runtime のスタブ。POST /runtimes/{arn}/invocations
+
+    stream=True なら text/event-stream で1問ずつ返す（latency を問題数で割った間隔）。
+    """
+    latency = 0.0
+    stream = False
+    calls = 0
+    lock = threading.Lock()
+
+    def do_POST(self):
+        raw, req = self._read_json()
+        if '/runtimes/' not in self.path:
+            return self._send(404, b'{"message": "not found"}')
+        with self.lock:
+            type(self).calls += 1
+        session = self.headers.get('X-Amzn-Bedrock-AgentCore-Runtime-Session-Id', '')
+        n = int(req.get('num_questions') or 5) if isinstance(req, dict) else 5
+        questions = _questions(n, hashlib.sha256(raw).hexdigest())
+        headers = {'X-Amzn-Bedrock-AgentCore-Runtime-Session-Id': session}
+        if not self.stream:
+            if self.latency:
+                time.sleep(self.latency)
+            body = json.dumps({'questions': questions}, ensure_ascii=False).encode('utf-8')
+            return self._send(200, body, 'application/json', headers)
+        # チャンク転送でイベントを逐次送る
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.end_headers()
+        for q in questions:
+            if self.latency:
+                time.sleep(self.latency / len(questions))
+            data = ('data: ' + json.dumps({'question': q}, ensure_ascii=False) + '\n\n').encode('utf-8')
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+        self.wfile.write(b'0\r\n\r\n')
+
+
+def serve(handler_cls, port=0):
+    """スタブをバックグラウンドスレッドで起動し、(server, endpoint_url) を返す"""
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler_cls)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--port', type=int, default=4566)
+    args = ap.parse_args()
+    server, url = serve(StubS3Handler, args.port)
+    print(f'stub S3 listening on {url}')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
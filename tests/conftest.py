@@ -0,0 +1,63 @@
+"""ハンドラのローカル検証（bench/stubs.py のスタブ AWS エンドポイントに向けて実行する）
+
+各関数は同名のモジュール（index、metrics など）を持つため、backend/service/server.py の load_handler / load_module で
+関数ごとに分けて読み込む。設定は読み込み時の環境変数で決まるので、load() / load_module() の前に env を渡す。
+スタブに向けてハンドラを動かすテストは boto3 が無ければモジュールごと飛ばす（単体のモジュールのテストは標準ライブラリだけで動く）。
+
+    pip install boto3 pypdf Pillow pytest
+    python -m pytest -q tests
+"""
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, 'bench'), os.path.join(ROOT, 'backend', 'service')]
+
+from server import FUNCTIONS, load_handler, load_module as _load_module  # noqa: E402
+from stubs import StubBedrockHandler, StubS3Handler, serve  # noqa: E402
+
+
+@pytest.fixture
+def s3_stub():
+    StubS3Handler.store.clear()
+    StubS3Handler.events.clear()
+    server, endpoint = serve(StubS3Handler)
+    yield endpoint
+    server.shutdown()
+    StubS3Handler.record_events = False
+
+
+@pytest.fixture
+def bedrock_stub():
+    server, endpoint = serve(StubBedrockHandler)
+    yield endpoint
+    server.shutdown()
+
+
+BASE_ENV = {'AWS_ACCESS_KEY_ID': 'test', 'AWS_SECRET_ACCESS_KEY': 'test', 'AWS_REGION': 'us-west-2',
+            'AWS_DEFAULT_REGION': 'us-west-2', 'METRICS_ENABLED': '0', 'RESPONSE_COMPRESSION': '0'}
+# load_module() の関数名 -> ソースのディレクトリ
+SOURCES = {'process': os.path.join(FUNCTIONS, 'tdx2025dlambdaamplify02', 'src'),
+           'jobs': os.path.join(FUNCTIONS, 'tdx2025dagentcoreinvoke', 'src')}
+
+
+@pytest.fixture
+def load(monkeypatch):
+    """環境変数を設定してからハンドラ（'process' / 'jobs' / 'relay'）を読み込む"""
+    def _load(name, env):
+        for k, v in dict(BASE_ENV, **env).items():
+            monkeypatch.setenv(k, v)
+        return load_handler(name)
+    return _load
+
+
+@pytest.fixture
+def load_module(monkeypatch):
+    """環境変数を設定してから関数（'process' / 'jobs'）の1モジュールを読み込む"""
+    def _load(function, module, env=None):
+        for k, v in dict(BASE_ENV, **(env or {})).items():
+            monkeypatch.setenv(k, v)
+        return _load_module(SOURCES[function], module, f'test_{function}_{module}')
+    return _load
@@ -0,0 +1,69 @@
+"""AgentCore 呼び出しのサーキットブレーカー: closed → open → half-open → closed / open の遷移"""
+import pytest
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def breaker(load_module, monkeypatch):
+    circuit = load_module('process', 'circuit')
+    clock = Clock()
+    monkeypatch.setattr(circuit, 'time', clock)
+    cb = circuit.CircuitBreaker('test', window_sec=60, min_calls=4, failure_rate=0.5, slow_call_sec=5, open_sec=30)
+    return cb, clock
+
+
+def test_opens_when_failure_rate_reaches_threshold(breaker):
+    cb, clock = breaker
+    for ok in (True, False, True):
+        assert cb.allow()
+        cb.record(ok, 0.1)
+    assert cb.snapshot()['state'] == 'closed'  # min_calls に満たない
+    cb.record(True, 6.0)  # 遅すぎる呼び出しも失敗に数える
+    assert cb.snapshot()['state'] == 'open'
+    assert not cb.allow()
+    clock.now += 29
+    assert not cb.allow()
+
+
+def test_half_open_lets_one_probe_and_closes_on_success(breaker):
+    cb, clock = breaker
+    for _ in range(4):
+        cb.record(False, 0.1)
+    clock.now += 30
+    assert cb.snapshot()['state'] == 'half_open'
+    assert cb.allow()
+    assert not cb.allow()  # 試行中は他を通さない
+    cb.record(True, 0.2)
+    assert cb.snapshot()['state'] == 'closed'
+    assert cb.snapshot()['calls'] == 1  # 閉じたら古い失敗は数えない
+    assert cb.allow()
+
+
+def test_half_open_probe_failure_reopens(breaker):
+    cb, clock = breaker
+    for _ in range(4):
+        cb.record(False, 0.1)
+    clock.now += 30
+    assert cb.allow()
+    cb.record(False, 0.1)
+    assert cb.snapshot()['state'] == 'open'
+    assert not cb.allow()
+    clock.now += 30
+    assert cb.allow()
+
+
+def test_old_failures_leave_the_window(breaker):
+    cb, clock = breaker
+    for _ in range(3):
+        cb.record(False, 0.1)
+    clock.now += 61
+    cb.record(False, 0.1)
+    assert cb.snapshot()['state'] == 'closed'
+    assert cb.snapshot()['failures'] == 1
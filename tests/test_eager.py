@@ -0,0 +1,41 @@
+"""先行抽出: S3 ObjectCreated イベントの再生で抽出しておけば、生成要求では抽出（OCR）を呼ばない"""
+import json
+
+import pytest
+
+from bench_handlers import BUCKET, s3_put
+from fixtures import load_sample
+from stubs import StubBedrockHandler, StubS3Handler
+
+pytest.importorskip('boto3')
+
+
+def test_replayed_upload_event_skips_ocr_on_generate(s3_stub, bedrock_stub, load, monkeypatch, tmp_path):
+    for name in ('EXTRACT_STORE_BUCKET', 'OCR_CACHE_BUCKET'):
+        monkeypatch.delenv(name, raising=False)
+    # 抽出キャッシュはプロセス内で持たない（生成要求は別コンテナに届いた想定）
+    handler = load('process', {
+        'AWS_ENDPOINT_URL_S3': s3_stub, 'AWS_ENDPOINT_URL_BEDROCK_RUNTIME': bedrock_stub,
+        'BEDROCK_MODEL_ID': 'test-model', 'EXTRACT_STORE_DIR': str(tmp_path),
+        'OCR_CACHE_MAX_ITEMS': '0', 'QUIZ_CACHE_TTL_SEC': '0', 'IMAGE_CACHE_MAX_ITEMS': '0',
+    })
+    StubS3Handler.record_events = True
+    key = 'uploads/eager-test.jpg'
+    s3_put(s3_stub, key, load_sample('test.jpg'))
+    event = {'Records': [e for e in StubS3Handler.events if e['s3']['object']['key'] == key]}
+    assert len(event['Records']) == 1
+
+    r = handler(event, None)
+    assert r['statusCode'] == 200
+    assert [p['status'] for p in json.loads(r['body'])['prefetched']] == ['ready']
+    extracted_calls = StubBedrockHandler.attachment_calls
+
+    r = handler({'body': json.dumps({'bucket': BUCKET, 'key': key})}, None)
+    assert r['statusCode'] == 200
+    assert json.loads(r['body'])['cache']['ocr'] == 'eager'
+    assert StubBedrockHandler.attachment_calls == extracted_calls
+
+    # 同じイベントの重複配信は抽出し直さない
+    r = handler(event, None)
+    assert [p['status'] for p in json.loads(r['body'])['prefetched']] == ['skipped']
+    assert StubBedrockHandler.attachment_calls == extracted_calls
@@ -0,0 +1,70 @@
+"""ジョブストア（SqliteJobStore）: 索引の問い合わせ（状態・テナント・since・件数）と期限切れレコードの削除"""
+import pytest
+
+
+@pytest.fixture
+def job_store(load_module):
+    return load_module('jobs', 'job_store')
+
+
+@pytest.fixture
+def store(job_store):
+    return job_store.SqliteJobStore(':memory:')
+
+
+def _job(job_id, status, tenant, created, expires=None):
+    doc = {'jobId': job_id, 'status': status, 'tenant': tenant, 'createdAt': created}
+    if expires is not None:
+        doc['expiresAt'] = expires
+    return doc
+
+
+def _ids(docs):
+    return [d['jobId'] for d in docs]
+
+
+def test_query_by_status_and_tenant(job_store, store):
+    for doc in (_job('a1', 'SUCCEEDED', 'a', 100), _job('a2', 'RUNNING', 'a', 200),
+                _job('a3', 'SUCCEEDED', 'a', 300), _job('b1', 'SUCCEEDED', 'b', 250)):
+        store.put(job_store.JOBS, doc['jobId'], doc)
+
+    # 新しい順
+    assert _ids(store.query('status', 'SUCCEEDED')) == ['a3', 'b1', 'a1']
+    assert _ids(store.query('tenant', 'a')) == ['a3', 'a2', 'a1']
+    assert _ids(store.query('status', 'SUCCEEDED', since_ms=250)) == ['a3', 'b1']
+    assert _ids(store.query('status', 'SUCCEEDED', limit=1)) == ['a3']
+    # テナントを指定すると他テナントのジョブは返さない
+    assert _ids(store.query('status', 'SUCCEEDED', tenant='a')) == ['a3', 'a1']
+    assert store.query('tenant', 'b', tenant='a') == []
+    with pytest.raises(ValueError):
+        store.query('owner', 'x')
+
+
+def test_status_change_moves_job_between_indexes(job_store, store):
+    doc = _job('j', 'PENDING', 't', 100)
+    store.put(job_store.JOBS, 'j', doc)
+    store.put(job_store.JOBS, 'j', dict(doc, status='SUCCEEDED'), previous=doc)
+    assert store.query('status', 'PENDING') == []
+    assert _ids(store.query('status', 'SUCCEEDED', tenant='t')) == ['j']
+
+
+def test_compact_removes_expired_records_and_blobs(job_store, store):
+    now = job_store._now_ms()
+    store.put(job_store.JOBS, 'old', _job('old', 'SUCCEEDED', 't', 100, expires=now - 1000))
+    store.put(job_store.JOBS, 'new', _job('new', 'SUCCEEDED', 't', 200, expires=now + 60000))
+    store.put_blob('old', 'result', {'questions': [1]})
+    store.put_blob('new', 'result', {'questions': [2]})
+    store.put(job_store.RESULTS, 'r-old', {'status': 'SUCCEEDED', 'expiresAt': now - 1000})
+    store.put(job_store.RESULTS, 'r-new', {'status': 'SUCCEEDED', 'expiresAt': now + 60000})
+
+    # 期限切れは compact() の前から存在しないものとして扱う
+    assert _ids(store.query('tenant', 't')) == ['new']
+    assert store.get(job_store.JOBS, 'old')[0] is None
+
+    assert store.compact(now_ms=now) == 1
+    assert store.get(job_store.JOBS, 'old')[1] is None  # レコードごと消えている
+    assert store.get_blob('old', 'result') is None
+    assert store.get_blob('new', 'result') == {'questions': [2]}
+    assert store.get(job_store.RESULTS, 'r-old')[1] is None
+    assert store.get(job_store.RESULTS, 'r-new')[0]['status'] == 'SUCCEEDED'
+    assert store.compact(now_ms=now) == 0
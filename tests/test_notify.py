@@ -0,0 +1,43 @@
+"""ジョブ完了通知（ロングポーリング）: 1ジョブあたりの状態取得が生成時間によらず数回で済む"""
+import json
+import time
+
+import pytest
+
+pytest.importorskip('boto3')
+
+TERMINAL = ('SUCCEEDED', 'FAILED')
+
+
+def test_long_poll_needs_constant_requests_per_job(s3_stub, load):
+    handler = load('jobs', {
+        'AWS_ENDPOINT_URL': s3_stub, 'JOBS_BUCKET': 'test-jobs', 'JOB_STORE': 's3',
+        'INVOCATION_MODE': 'mock', 'MOCK_LATENCY_SEC': '1.5', 'JOB_SCHEDULER': 'local',
+    })
+    r = handler({'httpMethod': 'POST', 'body': json.dumps({'prompt': 'p'})}, None)
+    assert r['statusCode'] == 202
+    job_id = json.loads(r['body'])['jobId']
+
+    requests, not_modified, etag = 0, 0, None
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        qs = {'jobId': job_id, 'fields': 'status'}
+        if etag:
+            qs['wait'] = '20'
+        requests += 1
+        r = handler({'httpMethod': 'GET', 'queryStringParameters': qs,
+                     'headers': {'If-None-Match': etag} if etag else {}}, None)
+        if r['statusCode'] == 304:
+            not_modified += 1
+            continue
+        assert r['statusCode'] == 200
+        etag = r['headers']['etag']
+        if json.loads(r['body'])['status'] in TERMINAL:
+            break
+    else:
+        raise AssertionError('job did not finish')
+
+    # 初回 GET + 状態の変化（PENDING → RUNNING → SUCCEEDED）ごとに1回。固定間隔なら 1.5 秒 / 間隔 に比例する
+    assert json.loads(r['body'])['status'] == 'SUCCEEDED'
+    assert requests <= 4
+    assert not_modified == 0
@@ -0,0 +1,67 @@
+"""生成結果キャッシュの合流（single-flight）: 同じキーの同時要求では compute を1回だけ呼ぶ"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+WAITERS = 4
+
+
+@pytest.fixture(params=['process', 'jobs'])
+def quiz_cache(request, load_module):
+    return load_module(request.param, 'quiz_cache')
+
+
+def _start_flight(pool, cache, compute):
+    """compute を実行中の生成役と、その完了を待つ WAITERS 件の要求を投入する"""
+    leader = pool.submit(cache.get_or_compute, 'k', compute)
+    while cache.stats()['inFlight'] == 0:
+        threading.Event().wait(0.01)
+    waiters = [pool.submit(cache.get_or_compute, 'k', compute, timeout=10) for _ in range(WAITERS)]
+    while cache.counts['coalesced'] < WAITERS:
+        threading.Event().wait(0.01)
+    return leader, waiters
+
+
+def test_concurrent_requests_share_one_compute(quiz_cache):
+    cache = quiz_cache.QuizCache(max_items=8, ttl_sec=60)
+    release = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        release.wait(10)
+        return {'questions': [1, 2]}
+
+    with ThreadPoolExecutor(WAITERS + 1) as pool:
+        leader, waiters = _start_flight(pool, cache, compute)
+        release.set()
+        assert leader.result() == ({'questions': [1, 2]}, 'miss')
+        assert [w.result() for w in waiters] == [({'questions': [1, 2]}, 'coalesced')] * WAITERS
+    assert len(calls) == 1
+    assert cache.get_or_compute('k', compute) == ({'questions': [1, 2]}, 'hit')
+    assert cache.stats() == {'hit': 1, 'miss': 1, 'coalesced': WAITERS, 'size': 1, 'inFlight': 0}
+
+
+def test_failure_is_shared_and_not_cached(quiz_cache):
+    cache = quiz_cache.QuizCache(max_items=8, ttl_sec=60)
+    release = threading.Event()
+
+    def compute():
+        release.wait(10)
+        raise RuntimeError('model error')
+
+    with ThreadPoolExecutor(WAITERS + 1) as pool:
+        leader, waiters = _start_flight(pool, cache, compute)
+        release.set()
+        for f in [leader] + waiters:
+            with pytest.raises(RuntimeError, match='model error'):
+                f.result()
+    assert cache.get_or_compute('k', lambda: {'ok': True}) == ({'ok': True}, 'miss')
+
+
+def test_uncacheable_result_is_shared_but_not_stored(quiz_cache):
+    cache = quiz_cache.QuizCache(max_items=8, ttl_sec=60)
+    assert cache.get_or_compute('k', lambda: {'questions': []}, cacheable=lambda v: bool(v['questions'])) == \
+        ({'questions': []}, 'miss')
+    assert cache.get('k') is None
@@ -0,0 +1,50 @@
+"""小テスト JSON の修復と検証（process 関数とジョブ関数の quiz_parser は同じ結果になること）"""
+import json
+
+import pytest
+
+Q1 = {'type': 'mcq', 'question': '問1', 'choices': ['A', 'B', 'C', 'D'], 'answer': 'A', 'explanation': '説明1',
+      'sourceText': '本文1'}
+Q2 = {'type': 'cloze', 'question': '問2 ____', 'answer': '答え', 'explanation': '説明2', 'sourceText': '本文2'}
+
+
+@pytest.fixture(params=['process', 'jobs'])
+def quiz_parser(request, load_module):
+    return load_module(request.param, 'quiz_parser')
+
+
+def _truncated(questions, cut):
+    """最後の問題の途中（末尾から cut 文字）で切れたモデル出力"""
+    text = json.dumps({'questions': questions}, ensure_ascii=False)
+    return text[:-cut]
+
+
+def test_repair_json_closes_after_last_complete_element(quiz_parser):
+    text = _truncated([Q1, Q2], 20)
+    repaired = json.loads(quiz_parser.repair_json(text))
+    assert repaired['questions'][0] == Q1
+    # 閉じた JSON はそのまま返す
+    closed = json.dumps([Q1], ensure_ascii=False)
+    assert quiz_parser.repair_json(closed) == closed
+
+
+def test_parse_quiz_drops_unclosed_last_question(quiz_parser):
+    parsed = quiz_parser.parse_quiz('```json\n' + _truncated([Q1, Q2], 20))
+    assert parsed['status'] == 'repaired'
+    assert parsed['truncated'] is True
+    assert parsed['questions'] == [Q1]
+    assert parsed['invalid'] == []
+
+
+def test_parse_quiz_normalizes_aliases_and_answer_labels(quiz_parser):
+    raw = [{'title': '問1', 'options': ['赤', '青', '黄', '緑'], 'correctAnswer': 'B', 'reason': 'r', 'source': 's'},
+           {'type': 'mcq', 'question': '問2', 'choices': ['x'], 'answer': 'x', 'explanation': 'e', 'sourceText': 's'}]
+    parsed = quiz_parser.parse_quiz('以下が問題です。\n' + json.dumps(raw, ensure_ascii=False))
+    assert parsed['status'] == 'ok'
+    assert parsed['questions'] == [{'type': 'mcq', 'question': '問1', 'choices': ['赤', '青', '黄', '緑'],
+                                    'answer': '青', 'explanation': 'r', 'sourceText': 's'}]
+    assert parsed['invalid'] == [{'index': 1, 'error': 'mcq needs at least 2 choices'}]
+
+
+def test_parse_quiz_unparsed(quiz_parser):
+    assert quiz_parser.parse_quiz('問題を作れませんでした')['status'] == 'unparsed'